@@ -1,10 +1,20 @@
 import pandas as pd
 import numpy as np
-def run_backtest(returns: pd.DataFrame, signals: pd.DataFrame, clusters: dict) -> dict:
+
+from typing import Optional
+
+from app.analytics.strategy import Clusters
+from app.instrumentation import timed
+
+
+@timed("analytics.run_backtest")
+def run_backtest(returns: pd.DataFrame, signals: pd.DataFrame, clusters: Clusters) -> dict:
     """
     Vectorized backtest.
     signals: DataFrame of 1, -1, 0 at time t.
     returns: DataFrame of returns at time t.
+    clusters: static dict, or membership frame: positions are closed on dates
+    where the ticker is unassigned (e.g. dropped at a walk-forward refit).
     
     Strategy: 
     rebalance at t based on signal(t). Return realized at t+1.
@@ -26,6 +36,8 @@ def run_backtest(returns: pd.DataFrame, signals: pd.DataFrame, clusters: dict) -
     # positions = signals.shift(1) (positions held at t, determined by signal t-1)
     
     positions = signals.shift(1).fillna(0)
+    if isinstance(clusters, pd.DataFrame):
+        positions = positions.where(clusters.reindex_like(positions).notna(), 0)
     
     # Strategy Return = positions * returns
     # But wait, we need to handle weighting.
@@ -66,4 +78,38 @@ def run_backtest(returns: pd.DataFrame, signals: pd.DataFrame, clusters: dict) -
             "Max Drawdown": max_drawdown,
             "Daily Turnover": turnover
         }
-    }
\ No newline at end of file
+    }
+
+
+def backtest_metrics(returns: np.ndarray, signals: np.ndarray, active: Optional[np.ndarray] = None) -> dict:
+    """
+    run_backtest's metrics straight from aligned (dates x tickers) arrays, for sweeps that
+    score many signal sets against the same returns. NaN returns are skipped as in
+    run_backtest; `active` (bool) closes positions where a ticker is unassigned.
+    """
+    positions = np.zeros(signals.shape)
+    positions[1:] = signals[:-1]
+    if active is not None:
+        positions[~active] = 0
+    gross = np.abs(positions).sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = np.where(gross > 0, positions / gross, 0.0)
+    port_rets = np.nansum(weights * returns, axis=1)
+
+    cumulative_ret = np.cumprod(1 + port_rets)
+    total_return = cumulative_ret[-1] - 1 if len(cumulative_ret) else 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = port_rets.std(ddof=1) if len(port_rets) > 1 else np.nan
+        mean = port_rets.mean() if len(port_rets) else np.nan
+        sharpe = (mean / std) * (252**0.5) if std != 0 else 0
+        running_max = np.maximum.accumulate(cumulative_ret)
+        max_drawdown = ((cumulative_ret - running_max) / running_max).min() if len(cumulative_ret) else np.nan
+    turnover = np.abs(np.diff(weights, axis=0)).sum(axis=1).sum() / len(weights) if len(weights) else np.nan
+
+    return {
+        "Total Return": total_return,
+        "Annualized Return": mean * 252,
+        "Sharpe Ratio": sharpe,
+        "Max Drawdown": max_drawdown,
+        "Daily Turnover": turnover
+    }
@@ -3,20 +3,26 @@ import numpy as np
 from scipy.cluster.hierarchy import linkage, fcluster
 from sklearn.cluster import SpectralClustering
 
+from app.analytics.correlation import correlation_matrix
+from app.instrumentation import timed
 
 
+@timed("analytics.calculate_log_returns")
 def calculate_log_returns(prices: pd.DataFrame) -> pd.DataFrame:
     """
     Calculate log returns from a price matrix (Date Index, Ticker Columns).
     """
     return np.log(prices / prices.shift(1)).dropna()
 
+@timed("analytics.get_correlation_matrix")
 def get_correlation_matrix(returns: pd.DataFrame) -> pd.DataFrame:
     """
     Calculate correlation matrix from returns.
+    Same values as returns.corr(), computed with one cross-product (see analytics.correlation).
     """
-    return returns.corr()
+    return correlation_matrix(returns)
 
+@timed("analytics.cluster_hierarchical")
 def cluster_hierarchical(corr_matrix: pd.DataFrame, num_clusters: int) -> dict:
     """
     Perform Hierarchical Clustering using Ward linkage.
@@ -46,6 +52,7 @@ def cluster_hierarchical(corr_matrix: pd.DataFrame, num_clusters: int) -> dict:
         
     return clusters
     
+@timed("analytics.cluster_spectral")
 def cluster_spectral(corr_matrix: pd.DataFrame, num_clusters: int) -> dict:
     """
     Perform Spectral Clustering.
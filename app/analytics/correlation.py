@@ -0,0 +1,190 @@
+"""
+Incremental Pearson correlation over a trailing (or expanding) window of returns.
+
+RollingCorrelation keeps running sums and the cross-product matrix of the rows in its
+window. Adding k days and dropping the k oldest is a rank-k update (two small GEMMs,
+O(k·N²)) instead of a fresh O(T·N²) pass, so a sequence of rolling matrices costs
+about as much as one full pass.
+
+Rows without NaN use a single count and per-ticker sums. The first NaN switches the
+state to pairwise-complete form (per-pair counts and sums, like DataFrame.corr()),
+at roughly four times the memory.
+"""
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app.instrumentation import timed
+
+
+class RollingCorrelation:
+    """
+    Correlation of the last `window` rows pushed (every row if window is None).
+    Values are shifted by each ticker's first observation before accumulating, and
+    the state is rebuilt from the window buffer every `recompute_every` evictions,
+    so float error from repeated add/remove stays bounded.
+    """
+
+    def __init__(self, tickers: Sequence[str], window: Optional[int] = None,
+                 recompute_every: Optional[int] = None):
+        if window is not None and window < 2:
+            raise ValueError("window must be at least 2")
+        self.tickers = list(tickers)
+        self.window = window
+        self.recompute_every = recompute_every or (4 * window if window else None)
+        n = len(self.tickers)
+        self._shift = np.full(n, np.nan)
+        # Ring buffer of the (shifted) rows currently in the window
+        self._buffer = np.empty((window or 0, n))
+        self._head = 0      # index of the oldest buffered row
+        self._size = 0      # rows in the buffer
+        self._evicted = 0   # evictions since the last rebuild
+        self._reset_sums()
+
+    # -- state ---------------------------------------------------------------------
+
+    def _reset_sums(self):
+        n = len(self.tickers)
+        self._pairwise = False
+        self._count = 0.0
+        self._sum = np.zeros(n)
+        self._sumsq = np.zeros(n)
+        self._cross = np.zeros((n, n))
+
+    def _to_pairwise(self):
+        """Expand the dense sums into per-pair form: [i, j] only counts rows where j is present too."""
+        n = len(self.tickers)
+        self._count = np.full((n, n), self._count)
+        self._sum = np.repeat(self._sum[:, None], n, axis=1)
+        self._sumsq = np.repeat(self._sumsq[:, None], n, axis=1)
+        self._pairwise = True
+
+    def _accumulate(self, rows: np.ndarray, sign: float):
+        """Add (sign=1) or remove (sign=-1) already-shifted rows."""
+        present = ~np.isnan(rows)
+        if not self._pairwise and present.all():
+            self._count += sign * len(rows)
+            self._sum += sign * rows.sum(axis=0)
+            self._sumsq += sign * np.einsum("ij,ij->j", rows, rows)
+            self._cross += sign * (rows.T @ rows)
+            return
+        if not self._pairwise:
+            self._to_pairwise()
+        mask = present.astype(np.float64)
+        values = np.where(present, rows, 0.0)
+        self._count += sign * (mask.T @ mask)
+        self._sum += sign * (values.T @ mask)
+        self._sumsq += sign * ((values * values).T @ mask)
+        self._cross += sign * (values.T @ values)
+
+    def _rebuild(self):
+        self._reset_sums()
+        if self._size:
+            self._accumulate(self._rows(0, self._size), 1.0)
+        self._evicted = 0
+
+    def _rows(self, start: int, k: int) -> np.ndarray:
+        """k buffered rows starting `start` rows after the oldest."""
+        idx = (self._head + start + np.arange(k)) % self.window
+        return self._buffer[idx]
+
+    # -- updates -------------------------------------------------------------------
+
+    @property
+    def n_obs(self) -> int:
+        """Rows currently in the window."""
+        return self._size if self.window else int(np.max(self._count, initial=0))
+
+    def update(self, returns: Union[pd.DataFrame, np.ndarray]) -> "RollingCorrelation":
+        """
+        Push new rows (oldest first). DataFrame columns are aligned to the engine's
+        tickers (missing tickers count as NaN). With a window, the rows that fall
+        out are removed in the same step.
+        """
+        if isinstance(returns, pd.DataFrame):
+            rows = returns.reindex(columns=self.tickers).to_numpy(dtype=np.float64)
+        else:
+            rows = np.asarray(returns, dtype=np.float64).reshape(-1, len(self.tickers))
+        if not len(rows):
+            return self
+
+        # Shift each ticker by its first observation; earlier rows hold no value for it
+        unset = np.isnan(self._shift)
+        if unset.any():
+            seen = ~np.isnan(rows[:, unset])
+            first = np.where(seen.any(axis=0), rows[seen.argmax(axis=0), np.flatnonzero(unset)], np.nan)
+            self._shift[unset] = first
+        rows = rows - np.where(np.isnan(self._shift), 0.0, self._shift)
+
+        if self.window is None:
+            self._accumulate(rows, 1.0)
+            return self
+
+        if len(rows) >= self.window:
+            # The whole window is replaced
+            rows = rows[-self.window:]
+            self._buffer[:] = rows
+            self._head, self._size = 0, self.window
+            self._rebuild()
+            return self
+
+        overflow = max(0, self._size + len(rows) - self.window)
+        if overflow:
+            self._accumulate(self._rows(0, overflow), -1.0)
+            self._head = (self._head + overflow) % self.window
+            self._size -= overflow
+            self._evicted += overflow
+        idx = (self._head + self._size + np.arange(len(rows))) % self.window
+        self._buffer[idx] = rows
+        self._size += len(rows)
+
+        if self.recompute_every and self._evicted >= self.recompute_every:
+            self._rebuild()
+        else:
+            self._accumulate(rows, 1.0)
+        return self
+
+    # -- results -------------------------------------------------------------------
+
+    def matrix(self) -> np.ndarray:
+        """Correlation matrix (N x N); NaN where a pair has fewer than 2 joint observations or no variance."""
+        n, s, ss, c = self._count, self._sum, self._sumsq, self._cross
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if self._pairwise:
+                # s[i, j]: sum of x_i over rows where x_j is also present
+                var = n * ss - s * s
+                corr = (n * c - s * s.T) / np.sqrt(var * var.T)
+                corr[n < 2] = np.nan
+            else:
+                if n < 2:
+                    return np.full(c.shape, np.nan)
+                var = n * ss - s * s
+                corr = (n * c - np.outer(s, s)) / np.sqrt(np.outer(var, var))
+        return np.clip(corr, -1.0, 1.0)
+
+    def corr(self) -> pd.DataFrame:
+        return pd.DataFrame(self.matrix(), index=self.tickers, columns=self.tickers)
+
+
+@timed("analytics.correlation_matrix")
+def correlation_matrix(returns: pd.DataFrame) -> pd.DataFrame:
+    """One-shot equivalent of returns.corr() (pairwise-complete Pearson) through BLAS."""
+    return RollingCorrelation(returns.columns).update(returns).corr()
+
+
+def rolling_correlations(returns: pd.DataFrame, window: int, step: int = 1,
+                         ) -> Iterator[Tuple[pd.Timestamp, pd.DataFrame]]:
+    """
+    (date, correlation of the `window` rows ending at date) every `step` rows, starting
+    with the first full window. Each step is a rank-`step` update of the previous one.
+    """
+    engine = RollingCorrelation(returns.columns, window)
+    values = returns.to_numpy(dtype=np.float64)
+    if len(values) < window:
+        return
+    engine.update(values[:window])
+    yield returns.index[window - 1], engine.corr()
+    for end in range(window + step, len(values) + 1, step):
+        engine.update(values[end - step:end])
+        yield returns.index[end - 1], engine.corr()
@@ -0,0 +1,139 @@
+"""
+Analytics jobs, executed in worker processes.
+
+Each job loads its own price panel through the process-wide BarRepository, runs the
+same pipeline as the dashboard pages and writes status and result straight to the
+jobs collection, so results survive the API process and any API replica can serve them.
+"""
+import math
+import traceback
+from datetime import datetime
+from typing import Callable, Dict
+
+import pandas as pd
+
+from app.analytics.backtest import run_backtest
+from app.analytics.clustering import calculate_log_returns, get_correlation_matrix, cluster_hierarchical, cluster_spectral
+from app.analytics.strategy import calculate_cluster_returns, calculate_residuals, calculate_z_scores, generate_signals
+from app.analytics.sweep import run_sweep
+from app.analytics.walkforward import membership_clusters, walk_forward_clusters
+from app.db.repository import get_repository
+from app.instrumentation import registry, timings_since
+
+JOBS_COLLECTION = "jobs"
+
+
+def _float(x) -> float:
+    x = float(x)
+    return None if math.isnan(x) or math.isinf(x) else x
+
+
+def load_prices(params: dict) -> pd.DataFrame:
+    """Forward-filled close matrix with only fully populated tickers, as on the dashboard pages."""
+    panel = get_repository().panel(
+        params["start"], params["end"], ["close"],
+        exchange=params.get("exchange"), tickers=params.get("tickers"),
+    )
+    return panel.frame("close").ffill().dropna(axis=1)
+
+
+def compute_clusters(prices: pd.DataFrame, method: str, num_clusters: int) -> Dict[int, list]:
+    corr_matrix = get_correlation_matrix(calculate_log_returns(prices))
+    if method == "spectral":
+        return cluster_spectral(corr_matrix, num_clusters)
+    return cluster_hierarchical(corr_matrix, num_clusters)
+
+
+def cluster_job(params: dict) -> dict:
+    prices = load_prices(params)
+    if prices.empty:
+        raise ValueError("No overlapping price data for the requested universe and range")
+    clusters = compute_clusters(prices, params["method"], params["num_clusters"])
+    return {
+        "n_assets": prices.shape[1],
+        "clusters": {str(c_id): members for c_id, members in clusters.items()},
+    }
+
+
+def backtest_job(params: dict) -> dict:
+    prices = load_prices(params)
+    if prices.empty:
+        raise ValueError("No overlapping price data for the requested universe and range")
+    returns = calculate_log_returns(prices)
+    if params.get("train_window"):
+        if len(returns) <= params["train_window"]:
+            raise ValueError("The date range is shorter than the training window")
+        # Fits run in this worker: job workers are already one process per job
+        clusters = walk_forward_clusters(returns, params["method"], params["num_clusters"],
+                                         params["train_window"], params.get("refit_every", 21), max_workers=1)
+    else:
+        clusters = compute_clusters(prices, params["method"], params["num_clusters"])
+
+    cluster_rets = calculate_cluster_returns(returns, clusters)
+    residuals = calculate_residuals(returns, cluster_rets, clusters)
+    z_scores = calculate_z_scores(residuals, params["lookback"])
+    signals = generate_signals(z_scores, params["entry_threshold"])
+    results = run_backtest(returns, signals, clusters)
+
+    cumulative = results["cumulative_returns"]
+    if isinstance(clusters, pd.DataFrame):
+        clusters = membership_clusters(clusters)  # as of the last date
+    return {
+        "n_assets": prices.shape[1],
+        "clusters": {str(c_id): members for c_id, members in clusters.items()},
+        "metrics": {name: _float(value) for name, value in results["metrics"].items()},
+        "equity_curve": {
+            "dates": [d.isoformat() for d in cumulative.index],
+            "values": [_float(v) for v in cumulative.to_numpy()],
+        },
+    }
+
+
+def sweep_job(params: dict) -> dict:
+    prices = load_prices(params)
+    if prices.empty:
+        raise ValueError("No overlapping price data for the requested universe and range")
+    # The grid's clustering keys run in this worker: job workers are already one process per job
+    results = run_sweep(
+        prices, params["methods"], params["num_clusters"], params["lookbacks"], params["entry_thresholds"],
+        train_window=params.get("train_window"), refit_every=params.get("refit_every", 21), max_workers=1,
+    )
+    return {
+        "n_assets": prices.shape[1],
+        "rows": [
+            {name: _float(value) if isinstance(value, float) else value for name, value in row.items()}
+            for row in results.to_dict(orient="records")
+        ],
+    }
+
+
+JOB_KINDS: Dict[str, Callable[[dict], dict]] = {
+    "cluster": cluster_job,
+    "backtest": backtest_job,
+    "sweep": sweep_job,
+}
+
+
+def execute_job(job_id: str, kind: str, params: dict):
+    """Worker-process entry point: run one job and record its outcome."""
+    jobs = get_repository().db[JOBS_COLLECTION]
+    jobs.update_one({"_id": job_id}, {"$set": {"status": "running", "started_at": datetime.utcnow()}})
+    # Workers have their own registry, so per-stage timings travel with the job document
+    timings_before = registry.snapshot()
+    try:
+        result = JOB_KINDS[kind](params)
+    except Exception as e:
+        jobs.update_one({"_id": job_id}, {"$set": {
+            "status": "failed",
+            "error": f"{type(e).__name__}: {e}",
+            "traceback": traceback.format_exc(),
+            "timings": timings_since(timings_before),
+            "finished_at": datetime.utcnow(),
+        }})
+        return
+    jobs.update_one({"_id": job_id}, {"$set": {
+        "status": "done",
+        "result": result,
+        "timings": timings_since(timings_before),
+        "finished_at": datetime.utcnow(),
+    }})
@@ -0,0 +1,148 @@
+"""
+Online z-scores and signals for end-of-day updates.
+
+OnlineSignalEngine keeps, per ticker, the integrated residual (spread) and the last
+`lookback` spread values in a ring buffer with their running count, sum and sum of
+squares. Each new day of residuals is an O(N) update, giving the same z-scores and
+signals as calculate_z_scores / generate_signals over the full history:
+
+    engine = OnlineSignalEngine(residuals.columns, lookback=60, entry_threshold=2.0)
+    engine.run(history)                 # warm up (or OnlineSignalEngine.load(path))
+    z = engine.update(todays_residuals)
+    signals = engine.signals()
+    engine.save(path)
+"""
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app.instrumentation import timed
+
+# Arrays persisted by save() besides the settings
+_STATE = ("total", "buffer", "count", "sum", "sumsq", "anchor", "repeats", "last", "z")
+
+
+def signal_values(z: np.ndarray, entry_threshold: float) -> np.ndarray:
+    """generate_signals on an array: 1 below -entry, -1 above entry, 0 otherwise (and for NaN)."""
+    return np.where(z < -entry_threshold, 1, np.where(z > entry_threshold, -1, 0))
+
+
+class OnlineSignalEngine:
+    """
+    Sums are kept relative to a per-ticker anchor, re-centred on the window mean every
+    `lookback` updates, so the variance does not lose precision as the spread drifts.
+    """
+
+    def __init__(self, tickers: Sequence[str], lookback: int, entry_threshold: float):
+        if lookback < 2:
+            raise ValueError("lookback must be at least 2")
+        self.tickers = list(tickers)
+        self.lookback = lookback
+        self.entry_threshold = entry_threshold
+        n = len(self.tickers)
+        self.total = np.zeros(n)                  # cumulative residual (spread), NaNs skipped
+        self.buffer = np.full((lookback, n), np.nan)  # last `lookback` spread values
+        self.head = 0                             # next ring slot (= oldest value once full)
+        self.steps = 0                            # updates since the last re-centring
+        self.count = np.zeros(n)                  # non-NaN values in the window
+        self.sum = np.zeros(n)                    # sum of (value - anchor) over the window
+        self.sumsq = np.zeros(n)
+        self.anchor = np.full(n, np.nan)
+        self.repeats = np.zeros(n)                # length of the current run of identical values
+        self.last = np.full(n, np.nan)
+        self.z = np.full(n, np.nan)
+        self.date: Optional[pd.Timestamp] = None
+
+    def _recentre(self):
+        present = ~np.isnan(self.buffer)
+        self.count = present.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.anchor = np.where(self.count > 0, np.nansum(self.buffer, axis=0) / self.count, np.nan)
+        dev = np.where(present, self.buffer - self.anchor, 0.0)
+        self.sum = dev.sum(axis=0)
+        self.sumsq = (dev * dev).sum(axis=0)
+        self.steps = 0
+
+    def update(self, residuals: Union[pd.Series, np.ndarray], date=None) -> np.ndarray:
+        """Add one day of residuals (Series aligned by ticker; missing = NaN) and return its z-scores."""
+        if isinstance(residuals, pd.Series):
+            date = residuals.name if date is None else date
+            r = residuals.reindex(self.tickers).to_numpy(dtype=np.float64)
+        else:
+            r = np.asarray(residuals, dtype=np.float64)
+        present = ~np.isnan(r)
+
+        # Spread as residuals.cumsum(): NaN on days without a residual, the sum carries on
+        self.total[present] += r[present]
+        x = np.where(present, self.total, np.nan)
+
+        old = self.buffer[self.head]
+        gone = ~np.isnan(old)
+        dev_old = np.where(gone, old - self.anchor, 0.0)
+        self.count -= gone
+        self.sum -= dev_old
+        self.sumsq -= dev_old * dev_old
+
+        new_anchor = present & np.isnan(self.anchor)
+        self.anchor[new_anchor] = x[new_anchor]
+        dev = np.where(present, x - self.anchor, 0.0)
+        self.count += present
+        self.sum += dev
+        self.sumsq += dev * dev
+
+        self.buffer[self.head] = x
+        self.head = (self.head + 1) % self.lookback
+        self.steps += 1
+        if self.steps >= self.lookback:
+            self._recentre()
+
+        self.repeats = np.where(x == self.last, self.repeats + 1, 1)
+        self.last = x
+
+        n = self.lookback
+        full = self.count == n  # rolling(lookback) needs lookback non-NaN values
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.anchor + self.sum / n
+            var = np.maximum((self.sumsq - self.sum * self.sum / n) / (n - 1), 0.0)
+            z = (x - mean) / np.sqrt(var)
+        # A constant window has zero spread around its mean: 0/0 in the batch version
+        self.z = np.where(full & (self.repeats < n), z, np.nan)
+        self.date = date
+        return self.z
+
+    def signals(self) -> np.ndarray:
+        """Signals for the last update (1 long, -1 short, 0 neutral)."""
+        return signal_values(self.z, self.entry_threshold)
+
+    @timed("analytics.online_signals_run")
+    def run(self, residuals: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Feed a residual frame day by day; returns (z_scores, signals) frames like the batch functions."""
+        values = residuals.reindex(columns=self.tickers).to_numpy(dtype=np.float64)
+        z = np.empty_like(values)
+        for i, row in enumerate(values):
+            z[i] = self.update(row, residuals.index[i])
+        z_scores = pd.DataFrame(z, index=residuals.index, columns=self.tickers)
+        signals = pd.DataFrame(signal_values(z, self.entry_threshold), index=residuals.index, columns=self.tickers)
+        return z_scores, signals
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            tickers=np.array(self.tickers, dtype=str),
+            settings=np.array([self.lookback, self.entry_threshold, self.head, self.steps], dtype=np.float64),
+            date=np.array("" if self.date is None else pd.Timestamp(self.date).isoformat()),
+            **{name: getattr(self, name) for name in _STATE},
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "OnlineSignalEngine":
+        with np.load(path, allow_pickle=False) as data:
+            lookback, entry_threshold, head, steps = data["settings"]
+            engine = cls(data["tickers"].tolist(), int(lookback), float(entry_threshold))
+            engine.head, engine.steps = int(head), int(steps)
+            for name in _STATE:
+                setattr(engine, name, data[name].copy())
+            date = str(data["date"])
+        engine.date = pd.Timestamp(date) if date else None
+        return engine
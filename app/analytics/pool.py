@@ -0,0 +1,11 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def spawn_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool for CPU-bound analytics (job runner, sweeps, walk-forward fits).
+    Workers are spawned, never forked: a forked child would inherit the parent's
+    Mongo clients, event loop and thread locks.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
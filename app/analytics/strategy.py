@@ -1,38 +1,109 @@
+from typing import Dict, List, Tuple, Union
+
 import pandas as pd
 import numpy as np
+from scipy import sparse
+
+from app.instrumentation import timed
+
+# Static clusters (cluster_id -> tickers) or time-varying membership
+# (date x ticker -> cluster_id, NaN = unassigned), e.g. from walk_forward_clusters
+Clusters = Union[dict, pd.DataFrame]
 
 
-def calculate_cluster_returns(returns: pd.DataFrame, clusters: dict) -> pd.DataFrame:
+def membership_matrix(tickers: pd.Index, clusters: dict) -> Tuple[sparse.csr_matrix, list]:
     """
-    Calculate average return for each cluster.
+    Sparse (ticker x cluster) 0/1 matrix for the clusters with at least one ticker in
+    `tickers`, and those cluster ids in dict order (tickers outside `tickers` are dropped).
     """
-    cluster_rets = pd.DataFrame(index=returns.index)
-    
-    for c_id, tickers in clusters.items():
-        # Only use tickers required (some might not be in returns if missing data)
-        valid_tickers = [t for t in tickers if t in returns.columns]
-        if not valid_tickers:
+    rows: List[int] = []
+    cols: List[int] = []
+    ids = []
+    for c_id, members in clusters.items():
+        idx = tickers.get_indexer(members)
+        idx = idx[idx >= 0]
+        if not len(idx):
             continue
-        cluster_rets[c_id] = returns[valid_tickers].mean(axis=1)
-        
-    return cluster_rets
+        rows.extend(idx.tolist())
+        cols.extend([len(ids)] * len(idx))
+        ids.append(c_id)
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(tickers), len(ids)))
+    return matrix, ids
+
+
+def _label_codes(labels: np.ndarray, ids) -> np.ndarray:
+    """Column position in `ids` of every label, -1 for NaN or ids not listed."""
+    ids = np.asarray(ids, dtype=np.float64)
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+    pos = np.searchsorted(sorted_ids, labels).clip(0, max(len(ids) - 1, 0))
+    found = (sorted_ids[pos] == labels) if len(ids) else np.zeros(labels.shape, dtype=bool)
+    return np.where(found, order[pos] if len(ids) else -1, -1)
+
+
+@timed("analytics.calculate_cluster_returns")
+def calculate_cluster_returns(returns: pd.DataFrame, clusters: Clusters) -> pd.DataFrame:
+    """
+    Calculate average return for each cluster (skipping NaN returns, NaN if a cluster
+    has none on a date). With a membership frame, each date averages that date's members.
+    """
+    values = returns.to_numpy(dtype=np.float64)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+
+    if isinstance(clusters, pd.DataFrame):
+        labels = clusters.reindex(index=returns.index, columns=returns.columns).to_numpy(dtype=np.float64)
+        ids = [int(c) for c in np.unique(labels[~np.isnan(labels)])]
+        codes = _label_codes(labels, ids)
+        # One bincount over (date, cluster) cells instead of a mask per cluster
+        keep = (codes >= 0) & present
+        cell = (np.arange(len(values))[:, None] * len(ids) + codes)[keep]
+        size = len(values) * len(ids)
+        sums = np.bincount(cell, weights=values[keep], minlength=size).reshape(len(values), len(ids))
+        counts = np.bincount(cell, minlength=size).reshape(len(values), len(ids))
+    else:
+        # Cluster sums and member counts for every date: two sparse products
+        matrix, ids = membership_matrix(returns.columns, clusters)
+        sums = np.asarray(filled @ matrix)
+        counts = np.asarray(present.astype(np.float64) @ matrix)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return pd.DataFrame(means, index=returns.index, columns=ids)
 
-def calculate_residuals(returns: pd.DataFrame, cluster_returns: pd.DataFrame, clusters: dict) -> pd.DataFrame:
+@timed("analytics.calculate_residuals")
+def calculate_residuals(returns: pd.DataFrame, cluster_returns: pd.DataFrame, clusters: Clusters) -> pd.DataFrame:
     """
     Calculate residuals: r_i - r_cluster_mean
+    With a membership frame, r_cluster_mean is that date's cluster, and residuals are
+    NaN on dates a ticker is unassigned.
     """
-    residuals = pd.DataFrame(index=returns.index)
-    
+    cluster_values = cluster_returns.to_numpy(dtype=np.float64)
+
+    if isinstance(clusters, pd.DataFrame):
+        membership = clusters.reindex(index=returns.index, columns=returns.columns)
+        membership = membership.loc[:, membership.notna().any()]
+        values = returns[membership.columns].to_numpy(dtype=np.float64)
+        codes = _label_codes(membership.to_numpy(dtype=np.float64), cluster_returns.columns)
+        rows = np.arange(len(values))[:, None]
+        out = np.where(codes >= 0, values - cluster_values[rows, codes.clip(0)], np.nan)
+        return pd.DataFrame(out, index=returns.index, columns=membership.columns)
+
+    # Each ticker's cluster column; a ticker listed twice keeps its first position and last cluster
+    position = {c_id: j for j, c_id in enumerate(cluster_returns.columns)}
+    assigned: Dict[str, int] = {}
     for c_id, tickers in clusters.items():
-        if c_id not in cluster_returns.columns:
+        if c_id not in position:
             continue
-            
-        valid_tickers = [t for t in tickers if t in returns.columns]
-        for t in valid_tickers:
-            residuals[t] = returns[t] - cluster_returns[c_id]
-            
-    return residuals
+        for t in tickers:
+            assigned[t] = position[c_id]
+    columns = [t for t in assigned if t in returns.columns]
+    values = returns[columns].to_numpy(dtype=np.float64)
+    # r - cluster_returns @ membership.T: with one cluster per ticker that product is a column gather
+    out = values - cluster_values[:, [assigned[t] for t in columns]]
+    return pd.DataFrame(out, index=returns.index, columns=columns)
 
+@timed("analytics.calculate_z_scores")
 def calculate_z_scores(residuals: pd.DataFrame, lookback: int) -> pd.DataFrame:
     """
     Calculate Z-Score of the integrated residuals (spread).
@@ -41,7 +112,12 @@ def calculate_z_scores(residuals: pd.DataFrame, lookback: int) -> pd.DataFrame:
     """
     # Integrate residuals -> spread
     spread = residuals.cumsum()
-    
+    return spread_z_scores(spread, lookback)
+
+def spread_z_scores(spread: pd.DataFrame, lookback: int) -> pd.DataFrame:
+    """
+    Z-Score of an already integrated spread, so one spread can be scored at several lookbacks.
+    """
     # Rolling stats
     roll_mean = spread.rolling(window=lookback).mean()
     roll_std = spread.rolling(window=lookback).std()
@@ -49,6 +125,7 @@ def calculate_z_scores(residuals: pd.DataFrame, lookback: int) -> pd.DataFrame:
     z_scores = (spread - roll_mean) / roll_std
     return z_scores
     
+@timed("analytics.generate_signals")
 def generate_signals(z_scores: pd.DataFrame, entry_threshold: float) -> pd.DataFrame:
     """
     Long if Z < -entry
@@ -0,0 +1,174 @@
+"""
+Cached parameter sweeps for the cluster stat-arb backtest.
+
+The pipeline's stages depend on nested subsets of the parameters:
+
+    returns, correlation           prices only
+    clusters, residual spread      + (method, num_clusters[, train_window, refit_every])
+    z-scores                       + lookback
+    signals, backtest metrics      + entry_threshold
+
+run_sweep() computes each stage once per distinct upstream key: returns and the
+correlation matrix once per price panel (walk-forward: the window correlations once
+per (train_window, refit_every), with every clustering key fitted on each window),
+then one task per clustering key (in a process pool) that scores every lookback and
+threshold from one residual spread.
+Thresholds share their lookback's z-scores and use the array backtest. A SweepCache
+keeps clusters and metric rows between sweeps, so widening the grid only computes
+the new cells.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.analytics.backtest import backtest_metrics
+from app.analytics.clustering import calculate_log_returns, get_correlation_matrix
+from app.analytics.online import signal_values
+from app.analytics.pool import spawn_pool
+from app.analytics.strategy import calculate_cluster_returns, calculate_residuals, spread_z_scores
+from app.analytics.walkforward import fit_clusters, walk_forward_memberships
+from app.instrumentation import timed
+
+# (method, num_clusters, train_window, refit_every); train_window None = full-sample fit
+ClusterKey = Tuple[str, int, Optional[int], int]
+
+GRID_COLUMNS = ["method", "num_clusters", "lookback", "entry_threshold"]
+
+
+def prices_key(prices: pd.DataFrame) -> str:
+    """Content hash of a price panel (values, dates and tickers)."""
+    digest = hashlib.sha1(pd.util.hash_pandas_object(prices, index=True).to_numpy().tobytes())
+    digest.update("\x1f".join(map(str, prices.columns)).encode())
+    return digest.hexdigest()
+
+
+class SweepCache:
+    """
+    Shared-stage results for the last `max_datasets` price panels: returns, correlation,
+    clusters per ClusterKey and metric rows per full parameter key. Thread-safe, so one
+    instance can serve every dashboard session: each dataset carries a lock that
+    run_sweep holds while it reads and fills the entry, so concurrent sweeps over the
+    same panel run one after the other and the later one reuses the earlier's results.
+    """
+
+    def __init__(self, max_datasets: int = 4):
+        self.max_datasets = max_datasets
+        self._datasets: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dataset(self, key: str) -> dict:
+        with self._lock:
+            entry = self._datasets.get(key)
+            if entry is None:
+                entry = self._datasets[key] = {
+                    "lock": threading.Lock(), "returns": None, "corr": None, "clusters": {}, "metrics": {},
+                }
+                while len(self._datasets) > self.max_datasets:
+                    self._datasets.popitem(last=False)
+            self._datasets.move_to_end(key)
+            return entry
+
+
+def evaluate_clusters(returns: pd.DataFrame, corr_matrix: Optional[pd.DataFrame], key: ClusterKey,
+                      clusters, lookbacks: Sequence[int], thresholds: Sequence[float]):
+    """
+    One clustering key (process-pool entry point): fit the full-sample clusters unless
+    given (walk-forward memberships are always given), build the residual spread once,
+    then score every (lookback, threshold). Returns the clusters and
+    {(lookback, threshold): metrics}.
+    """
+    method, num_clusters, _, _ = key
+    if clusters is None:
+        clusters = fit_clusters(corr_matrix, method, num_clusters)
+
+    cluster_rets = calculate_cluster_returns(returns, clusters)
+    residuals = calculate_residuals(returns, cluster_rets, clusters)
+    spread = residuals.cumsum()
+    values = returns[spread.columns].to_numpy(dtype=np.float64)
+    active = None
+    if isinstance(clusters, pd.DataFrame):
+        active = clusters.reindex(index=returns.index, columns=spread.columns).notna().to_numpy()
+
+    metrics = {}
+    for lookback in lookbacks:
+        z = spread_z_scores(spread, lookback).to_numpy(dtype=np.float64)
+        for threshold in thresholds:
+            metrics[(lookback, threshold)] = backtest_metrics(values, signal_values(z, threshold), active)
+    return clusters, metrics
+
+
+@timed("analytics.run_sweep")
+def run_sweep(prices: pd.DataFrame, methods: Sequence[str], num_clusters: Sequence[int],
+              lookbacks: Sequence[int], entry_thresholds: Sequence[float],
+              train_window: Optional[int] = None, refit_every: int = 21,
+              max_workers: Optional[int] = None, cache: Optional[SweepCache] = None) -> pd.DataFrame:
+    """
+    Backtest metrics for every combination of the grid, as a tidy frame: one row per
+    (method, num_clusters, lookback, entry_threshold) with run_backtest's metric columns.
+    `prices` is the cleaned close panel (as on the Backtest page: ffilled, full columns).
+    """
+    lookbacks = sorted(set(lookbacks))
+    entry_thresholds = sorted(set(entry_thresholds))
+    cluster_keys: List[ClusterKey] = [
+        (method, k, train_window, refit_every) for method in dict.fromkeys(methods) for k in sorted(set(num_clusters))
+    ]
+    data = (cache or SweepCache()).dataset(prices_key(prices))
+    with data["lock"]:
+        if data["returns"] is None:
+            data["returns"] = calculate_log_returns(prices)
+        returns = data["returns"]
+
+        # Only the (lookback, threshold) cells not already cached, grouped by clustering key
+        tasks = []
+        for key in cluster_keys:
+            missing_lb = [lb for lb in lookbacks if any((key, lb, h) not in data["metrics"] for h in entry_thresholds)]
+            if missing_lb:
+                tasks.append((key, missing_lb))
+        unfitted = [key for key, _ in tasks if key not in data["clusters"]]
+        if any(not key[2] for key in unfitted) and data["corr"] is None:
+            data["corr"] = get_correlation_matrix(returns)
+        if train_window and unfitted:
+            # One rolling-correlation pass for every walk-forward key still to fit
+            memberships = walk_forward_memberships(returns, [(key[0], key[1]) for key in unfitted],
+                                                   train_window, refit_every, max_workers)
+            for key in unfitted:
+                data["clusters"][key] = memberships[(key[0], key[1])]
+
+        args = [
+            (returns, None if key[2] else data["corr"], key, data["clusters"].get(key), lbs, entry_thresholds)
+            for key, lbs in tasks
+        ]
+        workers = min(max_workers or os.cpu_count() or 1, len(args))
+        if workers <= 1:
+            results = [evaluate_clusters(*a) for a in args]
+        else:
+            with spawn_pool(workers) as pool:
+                results = list(pool.map(evaluate_clusters, *zip(*args)))
+
+        for (key, _), (clusters, metrics) in zip(tasks, results):
+            data["clusters"][key] = clusters
+            for (lookback, threshold), row in metrics.items():
+                data["metrics"][(key, lookback, threshold)] = row
+
+        rows = [
+            {"method": key[0], "num_clusters": key[1], "lookback": lookback, "entry_threshold": threshold,
+             **data["metrics"][(key, lookback, threshold)]}
+            for key in cluster_keys for lookback in lookbacks for threshold in entry_thresholds
+        ]
+    return pd.DataFrame(rows)
+
+
+def sweep_heatmap(results: pd.DataFrame, metric: str = "Sharpe Ratio", method: Optional[str] = None,
+                  num_clusters: Optional[int] = None) -> pd.DataFrame:
+    """lookback x entry_threshold grid of one metric for one (method, num_clusters) slice."""
+    rows = results
+    if method is not None:
+        rows = rows[rows["method"] == method]
+    if num_clusters is not None:
+        rows = rows[rows["num_clusters"] == num_clusters]
+    return rows.pivot_table(index="lookback", columns="entry_threshold", values=metric, aggfunc="mean")
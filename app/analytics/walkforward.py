@@ -0,0 +1,166 @@
+"""
+Walk-forward re-clustering.
+
+Clusters are fitted on the `train_window` days strictly before each refit date and
+applied out of sample until the next refit, every `refit_every` days. Trailing
+correlations come from one pass of the rolling correlation engine and are streamed
+into a process pool for the clustering fits, so only a few matrices exist at once. Each fit's labels are then matched to the previous fit
+(Hungarian assignment on shared members), so a cluster keeps its id across refits.
+
+The result is a membership frame (date x ticker -> cluster id, NaN = unassigned),
+accepted by calculate_cluster_returns, calculate_residuals and run_backtest.
+"""
+import os
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+
+from app.analytics.clustering import cluster_hierarchical, cluster_spectral
+from app.analytics.correlation import rolling_correlations
+from app.analytics.pool import spawn_pool
+from app.instrumentation import timed
+
+
+def fit_clusters(corr_matrix: pd.DataFrame, method: str, num_clusters: int) -> dict:
+    """Cluster one window's correlation matrix (process-pool entry point)."""
+    # Tickers without variance in the window have no correlations to cluster on
+    valid = ~np.isnan(np.diag(corr_matrix.to_numpy()))
+    corr_matrix = corr_matrix.loc[valid, valid].fillna(0.0)
+    if len(corr_matrix) < 2:
+        return {}
+    num_clusters = min(num_clusters, len(corr_matrix))
+    if method.lower() == "spectral":
+        return cluster_spectral(corr_matrix, num_clusters)
+    return cluster_hierarchical(corr_matrix, num_clusters)
+
+
+def match_labels(previous: Dict[str, int], clusters: dict, next_id: int) -> Dict[str, int]:
+    """
+    Relabel `clusters` (label -> tickers) to the ids of `previous` (ticker -> id) with
+    the largest total member overlap. Clusters left unmatched get new ids from next_id.
+    """
+    labels = list(clusters)
+    prev_ids = sorted(set(previous.values()))
+    assigned: Dict[str, int] = {}
+    if prev_ids and labels:
+        overlap = np.zeros((len(labels), len(prev_ids)))
+        col = {c: j for j, c in enumerate(prev_ids)}
+        for i, label in enumerate(labels):
+            for ticker in clusters[label]:
+                if ticker in previous:
+                    overlap[i, col[previous[ticker]]] += 1
+        rows, cols = linear_sum_assignment(overlap, maximize=True)
+        mapping = {labels[i]: prev_ids[j] for i, j in zip(rows, cols) if overlap[i, j] > 0}
+    else:
+        mapping = {}
+    for label in labels:
+        if label not in mapping:
+            mapping[label] = next_id
+            next_id += 1
+        for ticker in clusters[label]:
+            assigned[ticker] = mapping[label]
+    return assigned
+
+
+def window_correlations(returns: pd.DataFrame, train_window: int,
+                        refit_every: int) -> Iterator[Tuple[int, pd.DataFrame]]:
+    """
+    (first row the fit applies to, trailing correlation) per refit, streamed from one
+    pass of the rolling engine: the matrix ending at row i covers rows (i - train_window, i]
+    and is applied from row i + 1.
+    """
+    for end, corr in rolling_correlations(returns, train_window, step=refit_every):
+        start = returns.index.get_loc(end) + 1
+        if start < len(returns):
+            yield start, corr
+
+
+def fit_window(corr_matrix: pd.DataFrame, specs: Sequence[Tuple[str, int]]) -> List[dict]:
+    """Every (method, num_clusters) fit on one window's correlation matrix (process-pool entry point)."""
+    return [fit_clusters(corr_matrix, method, num_clusters) for method, num_clusters in specs]
+
+
+def fit_stream(windows: Iterable[Tuple[int, pd.DataFrame]], specs: Sequence[Tuple[str, int]],
+               workers: int) -> Iterator[Tuple[int, List[dict]]]:
+    """
+    Fits for each window (one per spec), in order. With several workers, windows are
+    submitted as they are produced and at most 2 * workers matrices are in flight, so
+    memory stays at a few N x N matrices however many refits there are.
+    """
+    if workers <= 1:
+        for start, corr in windows:
+            yield start, fit_window(corr, specs)
+        return
+    with spawn_pool(workers) as pool:
+        in_flight: Deque[Tuple[int, Future]] = deque()
+        for start, corr in windows:
+            in_flight.append((start, pool.submit(fit_window, corr, specs)))
+            if len(in_flight) >= 2 * workers:
+                start, future = in_flight.popleft()
+                yield start, future.result()
+        while in_flight:
+            start, future = in_flight.popleft()
+            yield start, future.result()
+
+
+def membership_frame(returns: pd.DataFrame, fits: Sequence[Tuple[int, dict]]) -> pd.DataFrame:
+    """Membership frame from ordered (first row, clusters) fits, with labels matched across refits."""
+    values = np.full(returns.shape, np.nan)
+    col = {t: j for j, t in enumerate(returns.columns)}
+    previous: Dict[str, int] = {}
+    next_id = 1
+    for k, (start, clusters) in enumerate(fits):
+        end = fits[k + 1][0] if k + 1 < len(fits) else len(returns)
+        previous = match_labels(previous, clusters, next_id)
+        next_id = max([next_id - 1, *previous.values()]) + 1
+        for ticker, cluster_id in previous.items():
+            values[start:end, col[ticker]] = cluster_id
+    return pd.DataFrame(values, index=returns.index, columns=returns.columns)
+
+
+@timed("analytics.walk_forward_clusters")
+def walk_forward_memberships(returns: pd.DataFrame, specs: Sequence[Tuple[str, int]],
+                             train_window: int = 252, refit_every: int = 21,
+                             max_workers: Optional[int] = None) -> Dict[Tuple[str, int], pd.DataFrame]:
+    """
+    Out-of-sample cluster membership for `returns` (dates x tickers) per (method,
+    num_clusters) spec. The window correlations are computed once and every spec is fitted
+    on each of them. Dates before the first full training window are unassigned.
+    max_workers defaults to one process per CPU; with a single worker (or window) the fits
+    run in-process, which is also the faster choice for small universes where a fit costs
+    less than starting a worker.
+    """
+    if train_window < 2 or refit_every < 1:
+        raise ValueError("train_window must be >= 2 and refit_every >= 1")
+    specs = list(dict.fromkeys(specs))
+    if len(returns) <= train_window:
+        return {spec: pd.DataFrame(np.nan, index=returns.index, columns=returns.columns) for spec in specs}
+
+    n_windows = len(range(train_window - 1, len(returns) - 1, refit_every))
+    workers = min(max_workers or os.cpu_count() or 1, n_windows)
+    fits = list(fit_stream(window_correlations(returns, train_window, refit_every), specs, workers))
+    return {
+        spec: membership_frame(returns, [(start, fitted[i]) for start, fitted in fits])
+        for i, spec in enumerate(specs)
+    }
+
+
+def walk_forward_clusters(returns: pd.DataFrame, method: str, num_clusters: int,
+                          train_window: int = 252, refit_every: int = 21,
+                          max_workers: Optional[int] = None) -> pd.DataFrame:
+    """Out-of-sample cluster membership for one (method, num_clusters); see walk_forward_memberships."""
+    spec = (method, num_clusters)
+    return walk_forward_memberships(returns, [spec], train_window, refit_every, max_workers)[spec]
+
+
+def membership_clusters(membership: pd.DataFrame, date=None) -> dict:
+    """Static clusters dict (cluster_id -> tickers) in force on `date` (default: the last date)."""
+    row = membership.iloc[-1] if date is None else membership.loc[date]
+    clusters: Dict[int, list] = {}
+    for ticker, cluster_id in row.dropna().items():
+        clusters.setdefault(int(cluster_id), []).append(ticker)
+    return dict(sorted(clusters.items()))
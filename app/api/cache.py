@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from app.instrumentation import count
+
+
+class ResponseCache:
+    """
+    In-process LRU of rendered response bodies, bounded by total bytes.
+
+    Entries are keyed by ETag, which hashes the normalized request together with the
+    data version it was rendered from, so a version bump simply stops hitting the old
+    entries and LRU eviction reclaims them.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(key: tuple, version: int) -> str:
+        return '"' + hashlib.sha1(repr((key, version)).encode()).hexdigest() + '"'
+
+    def get(self, etag: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(etag)
+            self.hits += 1
+            return entry
+
+    def put(self, etag: str, body: bytes, media_type: str):
+        if len(body) > self.max_bytes:
+            return  # would evict everything else
+        with self._lock:
+            old = self._entries.pop(etag, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[etag] = (body, media_type)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class VersionCache:
+    """
+    Local copy of the data_versions counters, reloaded at most every `ttl` seconds,
+    so version checks (and 304 answers) normally cost no Mongo round trip.
+    A write becomes visible to cached readers within `ttl`.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._versions: Dict[str, int] = {}
+        self._loaded = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def get(self, coll, key: str) -> int:
+        """Current version of `key` (0 if never bumped); coll is the data_versions collection."""
+        if time.monotonic() - self._loaded > self.ttl:
+            async with self._lock:
+                if time.monotonic() - self._loaded > self.ttl:
+                    docs = await coll.find({}, {"version": 1}).to_list(length=None)
+                    self._versions = {d["_id"]: d.get("version", 0) for d in docs}
+                    self._loaded = time.monotonic()
+        return self._versions.get(key, 0)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+async def cached_response(request: Request, cache: ResponseCache, key: tuple, version: int,
+                          render: Callable[[], Awaitable[Tuple[bytes, str]]]) -> Response:
+    """
+    Serve `key` at `version`: 304 if the client already holds it, the cached body if
+    we do, otherwise render() it (body, media_type) and remember the result.
+    """
+    etag = cache.etag(key, version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        count("api.cache.not_modified")
+        return Response(status_code=304, headers=headers)
+
+    entry = cache.get(etag)
+    if entry is None:
+        count("api.cache.miss")
+        entry = await render()
+        cache.put(etag, *entry)
+    else:
+        count("api.cache.hit")
+    body, media_type = entry
+    return Response(body, media_type=media_type, headers=headers)
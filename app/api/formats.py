@@ -0,0 +1,80 @@
+import io
+import json
+from typing import AsyncIterator, List, Sequence
+
+import numpy as np
+import pyarrow as pa
+from pydantic_core import to_json
+
+from app.db.panel import Panel
+from app.db.schema import BarBatch
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NPZ_MEDIA_TYPE = "application/x-npz"
+
+
+async def cursor_batches(cursor, batch_size: int) -> AsyncIterator[List[dict]]:
+    """Drain a Motor cursor batch_size documents at a time."""
+    while True:
+        batch = await cursor.to_list(length=batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+def bar_arrow_schema(fields: Sequence[str]) -> pa.Schema:
+    return pa.schema([("date", pa.timestamp("ms")), *[(f, pa.float64()) for f in fields]])
+
+
+async def ndjson_stream(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """One JSON document per line, one chunk per cursor batch."""
+    async for docs in batches:
+        yield b"".join(to_json(doc) + b"\n" for doc in docs)
+
+
+async def arrow_stream(batches: AsyncIterator[List[dict]], schema: pa.Schema) -> AsyncIterator[bytes]:
+    """Arrow IPC stream: the schema message first, then one record batch per cursor batch."""
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    fields = schema.names[1:]
+    async for docs in batches:
+        writer.write_table(BarBatch.from_docs(docs, fields).to_arrow(include_ticker=False))
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+def panel_to_arrow(panel: Panel) -> bytes:
+    """
+    One Arrow IPC stream: a date column, then one column per (field, ticker). Columns
+    are named by ticker for a single field and "<field>:<ticker>" for several; schema
+    metadata lists the fields and tickers in column order.
+    """
+    single = len(panel.values) == 1
+    names, arrays = ["date"], [pa.array(panel.dates.astype("datetime64[ms]"))]
+    for field, matrix in panel.values.items():
+        for j, ticker in enumerate(panel.tickers):
+            names.append(ticker if single else f"{field}:{ticker}")
+            arrays.append(pa.array(matrix[:, j]))
+    metadata = {"fields": json.dumps(list(panel.values)), "tickers": json.dumps(panel.tickers)}
+    table = pa.Table.from_arrays(arrays, names=names, metadata=metadata)
+
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def panel_to_npz(panel: Panel) -> bytes:
+    """np.load-able archive: dates (datetime64[D]), tickers (str) and one matrix per field."""
+    sink = io.BytesIO()
+    np.savez(sink, dates=panel.dates, tickers=np.array(panel.tickers, dtype=str), **panel.values)
+    return sink.getvalue()
@@ -0,0 +1,83 @@
+import asyncio
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Optional, Set
+
+from app.analytics.jobs import execute_job
+from app.analytics.pool import spawn_pool
+
+
+class JobRunner:
+    """
+    Submits analytics jobs to a process pool so CPU-bound clustering/backtests never
+    block the API event loop. Job state lives in the jobs collection; the workers
+    update it themselves, the runner only records submission, worker crashes and
+    jobs cut short by a shutdown or restart.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.started_at = datetime.utcnow()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Strong references: the event loop only keeps weak ones to running tasks
+        self._watchers: Set[asyncio.Task] = set()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = spawn_pool(self.max_workers)
+        return self._pool
+
+    async def submit(self, jobs_coll, kind: str, params: dict) -> dict:
+        job = {
+            "_id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "queued",
+            "params": params,
+            "created_at": datetime.utcnow(),
+        }
+        await jobs_coll.insert_one(job)
+        future = asyncio.get_running_loop().run_in_executor(self.pool, execute_job, job["_id"], kind, params)
+        watcher = asyncio.ensure_future(self._watch(jobs_coll, job["_id"], future))
+        self._watchers.add(watcher)
+        watcher.add_done_callback(self._watchers.discard)
+        return job
+
+    @staticmethod
+    async def _fail(jobs_coll, query: dict, error: str):
+        await jobs_coll.update_many(
+            {**query, "status": {"$in": ["queued", "running"]}},
+            {"$set": {"status": "failed", "error": error, "finished_at": datetime.utcnow()}},
+        )
+
+    async def _watch(self, jobs_coll, job_id: str, future):
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Queued job dropped by shutdown(), or the watcher itself cancelled
+            await self._fail(jobs_coll, {"_id": job_id}, "Cancelled: the API shut down before the job finished")
+            raise
+        except Exception as e:
+            # The worker died before it could record anything (e.g. BrokenProcessPool)
+            if isinstance(e, BrokenProcessPool):
+                self._pool = None  # start a fresh pool on the next submit
+            await self._fail(jobs_coll, {"_id": job_id}, f"{type(e).__name__}: {e}")
+
+    async def reconcile(self, jobs_coll):
+        """
+        Fail jobs left queued or running by an earlier API process: nothing will ever
+        finish them. Call once at startup, before accepting submissions.
+        """
+        await self._fail(jobs_coll, {"created_at": {"$lt": self.started_at}},
+                         "Interrupted: the API restarted before the job finished")
+
+    async def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        # Record every job this process will not see through while the DB is still connected
+        for watcher in list(self._watchers):
+            watcher.cancel()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
@@ -1,54 +1,291 @@
-from fastapi import FastAPI, Query, HTTPException
-from typing import List, Optional
+from fastapi import FastAPI, Query, HTTPException, Request, Response
+from typing import List, Literal, Optional, Union
+import time
 from datetime import datetime
-from app.db.mongo import db
-from app.db.schema import Bar, Instrument
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+from app.api.cache import ResponseCache, VersionCache, cached_response
+from app.api.jobs import JobRunner
+from app.analytics.jobs import JOBS_COLLECTION
+from app.api.formats import (
+    ARROW_STREAM_MEDIA_TYPE, NDJSON_MEDIA_TYPE, NPZ_MEDIA_TYPE, arrow_stream, bar_arrow_schema, cursor_batches,
+    ndjson_stream, panel_to_arrow, panel_to_npz,
+)
+from app.db.buckets import BUCKET_COLLECTION, bar_store, load_batch, load_panel, row_batches
+from app.db.mongo import db, settings
+from app.db.panel import PANEL_DTYPES, PanelBuilder
+from app.db.schema import (
+    BarBatch, BarColumns, BarRow, BacktestJobRequest, ClusterJobRequest, Coverage, Instrument, Job, SweepJobRequest, BAR_FIELDS, bar_projection,
+)
+from app.db.coverage import COVERAGE_COLLECTION, coverage_query
+from app.db.versions import INSTRUMENTS_VERSION_KEY, VERSIONS_COLLECTION, bars_version_key
+from app.instrumentation import count, registry
+from app.profiling import RunProfiler, profiling_enabled
 
+# Documents per cursor round trip for bar reads
+BARS_BATCH_SIZE = 5000
+
+response_cache = ResponseCache(settings.API_CACHE_MAX_BYTES)
+versions = VersionCache(settings.API_VERSION_TTL)
+job_runner = JobRunner(settings.JOB_WORKERS)
+_instruments_adapter = TypeAdapter(List[Instrument])
+# Whole-process profile (PROFILE=true), written when the API shuts down
+_profiler: Optional[RunProfiler] = None
+
+async def data_version(key: str) -> int:
+    return await versions.get(await db.get_collection(VERSIONS_COLLECTION), key)
+
+def check_bar_fields(fields: Optional[List[str]]):
+    """Reject a `fields` query parameter naming anything outside BAR_FIELDS."""
+    unknown = sorted(set(fields or []) - set(BAR_FIELDS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {unknown}. Valid: {BAR_FIELDS}")
 
 app = FastAPI(title="SSE Statistical Arbitrage API")
 
 @app.on_event("startup")
 async def startup_db_client():
+    global _profiler
+    if profiling_enabled():
+        _profiler = RunProfiler("api").start()
     db.connect()
+    await job_runner.reconcile(await db.get_collection(JOBS_COLLECTION))
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await job_runner.shutdown()
     db.close()
+    if _profiler is not None:
+        report = _profiler.stop()
+        print(f"API profile written to {report.paths[0]} and siblings")
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    # Plain perf_counter: timed()'s per-thread stack would interleave across concurrent requests
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - t0
+    registry.observe("api.request", elapsed)
+    # Route template (/v1/jobs/{job_id}), not the raw path, keeps the series bounded
+    route = request.scope.get("route")
+    if route is not None:
+        registry.observe(f"api.{request.method} {route.path}", elapsed)
+    count(f"api.status.{response.status_code // 100}xx")
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of this API process's stage timers and counters."""
+    return Response(registry.render_prometheus(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
 @app.get("/v1/instruments", response_model=List[Instrument])
-async def get_instruments(exchange: str = "SSE"):
-    collection = await db.get_collection("instruments")
-    cursor = collection.find({"exchange": exchange})
-    instruments = await cursor.to_list(length=None)
-    return instruments
+async def get_instruments(request: Request, exchange: str = "SSE"):
+    async def render():
+        collection = await db.get_collection("instruments")
+        cursor = collection.find({"exchange": exchange}, {"_id": 0})
+        instruments = _instruments_adapter.validate_python(await cursor.to_list(length=None))
+        return _instruments_adapter.dump_json(instruments), "application/json"
 
-@app.get("/v1/bars", response_model=List[Bar])
+    version = await data_version(INSTRUMENTS_VERSION_KEY)
+    return await cached_response(request, response_cache, ("instruments", exchange), version, render)
+
+@app.get(
+    "/v1/bars",
+    response_class=JSONResponse,
+    responses={200: {"model": Union[List[BarRow], BarColumns], "description": "Rows (format=rows) or columns (format=columns)"}},
+)
 async def get_bars(
+    request: Request,
     ticker: str,
     start: datetime,
     end: datetime,
-    fields: Optional[List[str]] = Query(None)
+    fields: Optional[List[str]] = Query(None),
+    format: Literal["rows", "columns"] = "rows",
 ):
-    collection = await db.get_collection("bars_daily")
-    
-    query = {
-        "ticker": ticker,
-        "date": {
-            "$gte": start,
-            "$lte": end
+    """
+    Bars for one ticker, oldest first.
+
+    `fields` is pushed down to Mongo as a projection (date is always included). With
+    BAR_STORAGE=buckets the ticker's year buckets are unpacked and trimmed to [start, end].
+    format="rows" returns one object per bar; format="columns" returns
+    {"ticker": ..., "date": [...], "<field>": [...]}, the compact shape for long ranges.
+    Rows are serialized straight from the cursor, without per-row model validation.
+    Responses are cached per ticker data version and carry an ETag (If-None-Match -> 304).
+    """
+    check_bar_fields(fields)
+
+    async def render():
+        wanted = fields or BAR_FIELDS
+        if settings.BAR_STORAGE == "buckets":
+            batch = await load_batch(await db.get_collection(BUCKET_COLLECTION), ticker, start, end, wanted)
+            if format == "rows":
+                # Without fields, keep the full Bar document shape
+                bars = batch.to_rows(fields) if fields else batch.to_docs()
+                return to_json(bars, inf_nan_mode="null"), "application/json"
+        else:
+            collection = await db.get_collection("bars_daily")
+
+            query = {
+                "ticker": ticker,
+                "date": {
+                    "$gte": start,
+                    "$lte": end
+                }
+            }
+            # Without fields, keep the full Bar document shape
+            projection = bar_projection(fields) if fields else None
+            cursor = collection.find(query, projection).sort("date", 1).batch_size(BARS_BATCH_SIZE)
+
+            if format == "rows":
+                bars = await cursor.to_list(length=None)
+                return to_json(bars), "application/json"
+            batch = BarBatch.concat([
+                BarBatch.from_docs(docs, wanted, ticker=ticker)
+                async for docs in cursor_batches(cursor, BARS_BATCH_SIZE)
+            ])
+
+        columns = {
+            "date": batch.date.astype("datetime64[us]").tolist(),
+            **{f: batch.values[f].tolist() for f in wanted},
         }
-    }
-    
-    cursor = collection.find(query).sort("date", 1)
-    bars = await cursor.to_list(length=None)
-    
-    if not bars:
-        return []
-        
-    return bars
+        return to_json({"ticker": ticker, **columns}, inf_nan_mode="null"), "application/json"
+
+    # Normalized: parsed datetimes, field order kept (it shapes the response)
+    key = ("bars", ticker, start.isoformat(), end.isoformat(), tuple(fields or ()), format)
+    version = await data_version(bars_version_key(ticker, bar_store()))
+    return await cached_response(request, response_cache, key, version, render)
     
+@app.get("/v1/bars/stream")
+async def stream_bars(
+    ticker: str,
+    start: datetime,
+    end: datetime,
+    fields: Optional[List[str]] = Query(None),
+    format: Literal["ndjson", "arrow"] = "ndjson",
+):
+    """
+    Streaming variant of /v1/bars: bars are sent cursor batch by cursor batch (year
+    bucket by year bucket with BAR_STORAGE=buckets), so server memory stays bounded and
+    clients can start on the first rows early.
+    format="arrow" sends an Arrow IPC stream (date + requested fields as float64).
+    """
+    check_bar_fields(fields)
+    fields = fields or BAR_FIELDS
+
+    if settings.BAR_STORAGE == "buckets":
+        # One chunk per year bucket
+        batches = row_batches(await db.get_collection(BUCKET_COLLECTION), ticker, start, end, fields)
+    else:
+        collection = await db.get_collection("bars_daily")
+        query = {"ticker": ticker, "date": {"$gte": start, "$lte": end}}
+        cursor = collection.find(query, bar_projection(fields)).sort("date", 1).batch_size(BARS_BATCH_SIZE)
+        batches = cursor_batches(cursor, BARS_BATCH_SIZE)
+
+    if format == "arrow":
+        return StreamingResponse(arrow_stream(batches, bar_arrow_schema(fields)), media_type=ARROW_STREAM_MEDIA_TYPE)
+    return StreamingResponse(ndjson_stream(batches), media_type=NDJSON_MEDIA_TYPE)
+
+@app.get("/v1/panel")
+async def get_panel(
+    start: datetime,
+    end: datetime,
+    tickers: Optional[List[str]] = Query(None),
+    exchange: Optional[str] = None,
+    fields: List[str] = Query(["close"]),
+    dtype: Literal["float32", "float64"] = "float64",
+    format: Literal["arrow", "npz"] = "arrow",
+):
+    """
+    Dense date x ticker matrix per field (NaN where a ticker has no bar), built from the
+    cursor into preallocated arrays. Select by tickers (column order kept) or exchange.
+    With BAR_STORAGE=buckets the matrices are unpacked from bars_yearly.
+    """
+    if not tickers and not exchange:
+        raise HTTPException(status_code=400, detail="Pass tickers or exchange")
+    check_bar_fields(fields)
+
+    if settings.BAR_STORAGE == "buckets":
+        collection = await db.get_collection(BUCKET_COLLECTION)
+        panel = await load_panel(collection, start, end, fields, tickers or None, exchange, PANEL_DTYPES[dtype])
+    else:
+        collection = await db.get_collection("bars_daily")
+        query = {"date": {"$gte": start, "$lte": end}}
+        if tickers:
+            query["ticker"] = {"$in": tickers}
+        if exchange:
+            query["exchange"] = exchange
+        cursor = collection.find(query, bar_projection(fields, keys=["date", "ticker"])).batch_size(BARS_BATCH_SIZE)
+
+        builder = PanelBuilder(fields, tickers or None, PANEL_DTYPES[dtype])
+        async for docs in cursor_batches(cursor, BARS_BATCH_SIZE):
+            builder.add(docs)
+        panel = builder.build()
+
+    if format == "npz":
+        return Response(panel_to_npz(panel), media_type=NPZ_MEDIA_TYPE)
+    return Response(panel_to_arrow(panel), media_type=ARROW_STREAM_MEDIA_TYPE)
+
+@app.get("/v1/coverage", response_model=List[Coverage])
+async def get_coverage(
+    exchange: Optional[str] = None,
+    tickers: Optional[List[str]] = Query(None),
+    store: Optional[Literal["bars_daily", "bars_yearly"]] = None,
+):
+    """
+    Stored date range and bar count per ticker, from the write-time coverage metadata.
+    `store` defaults to the collection BAR_STORAGE serves bars from.
+    """
+    collection = await db.get_collection(COVERAGE_COLLECTION)
+    cursor = collection.find(coverage_query(store or bar_store(), exchange, tickers), {"_id": 0}).sort("ticker", 1)
+    return await cursor.to_list(length=None)
+
+async def submit_job(kind: str, request) -> dict:
+    jobs_coll = await db.get_collection(JOBS_COLLECTION)
+    job = await job_runner.submit(jobs_coll, kind, request.model_dump())
+    return {"job_id": job["_id"], "status": job["status"]}
+
+@app.post("/v1/jobs/cluster", status_code=202)
+async def submit_cluster_job(request: ClusterJobRequest):
+    """Cluster the universe's correlation matrix in a worker process; poll /v1/jobs/{job_id}."""
+    if not request.tickers and not request.exchange:
+        raise HTTPException(status_code=400, detail="Pass tickers or exchange")
+    return await submit_job("cluster", request)
+
+@app.post("/v1/jobs/backtest", status_code=202)
+async def submit_backtest_job(request: BacktestJobRequest):
+    """Cluster, then backtest the residual mean-reversion strategy, in a worker process."""
+    if not request.tickers and not request.exchange:
+        raise HTTPException(status_code=400, detail="Pass tickers or exchange")
+    return await submit_job("backtest", request)
+
+@app.post("/v1/jobs/sweep", status_code=202)
+async def submit_sweep_job(request: SweepJobRequest):
+    """Backtest every combination of the parameter grid; the result is one metrics row per combination."""
+    if not request.tickers and not request.exchange:
+        raise HTTPException(status_code=400, detail="Pass tickers or exchange")
+    return await submit_job("sweep", request)
+
+@app.get("/v1/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    collection = await db.get_collection(JOBS_COLLECTION)
+    job = await collection.find_one({"_id": job_id}, {"result": 0, "traceback": 0})
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.get("/v1/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    collection = await db.get_collection(JOBS_COLLECTION)
+    job = await collection.find_one({"_id": job_id}, {"status": 1, "result": 1, "error": 1})
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail={"status": job["status"], "error": job.get("error")})
+    return job["result"]
+
 # Analytics endpoints could be added here or just imported in dashboard
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""
+Bucketed columnar storage for daily bars.
+
+Instead of one document per ticker-day (bars_daily), bars_yearly holds one document
+per ticker per calendar year. Dates and each OHLCV field are packed little-endian
+NumPy buffers stored as BSON Binary:
+
+    {
+        "_id": "600000.SH:2023", "ticker": "600000.SH", "exchange": "SSE", "year": 2023,
+        "n": 242, "dates": <int32 days since epoch>, "open": <float64>, ..., "volume": <float64>,
+        "source": "yahoo", "updated_at": ...
+    }
+
+A year of bars is ~250x fewer documents, and readers unpack straight into NumPy
+without building a dict per bar. With BAR_STORAGE=buckets every bar read (panels,
+single-ticker bars and the coverage store) comes from here instead of bars_daily.
+"""
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from bson import Binary
+from pymongo import ReplaceOne
+
+from app.db.mongo import settings
+from app.db.panel import Panel
+from app.db.schema import BAR_FIELDS, BarBatch
+
+BUCKET_COLLECTION = "bars_yearly"
+BUCKET_FIELDS = BAR_FIELDS
+
+_DATE_DTYPE = np.dtype("<i4")   # days since 1970-01-01
+_VALUE_DTYPE = np.dtype("<f8")
+
+
+def bar_store() -> str:
+    """The bar collection reads and coverage lookups use, per the BAR_STORAGE setting."""
+    return BUCKET_COLLECTION if settings.BAR_STORAGE == "buckets" else "bars_daily"
+
+
+def bucket_id(ticker: str, year: int) -> str:
+    return f"{ticker}:{year}"
+
+
+def pack_bucket(ticker: str, exchange: str, year: int, frame: pd.DataFrame, source: str = "yahoo") -> dict:
+    """Pack one ticker-year of a normalized bar frame (date index, BUCKET_FIELDS columns)."""
+    days = frame.index.values.astype("datetime64[D]").astype(_DATE_DTYPE)
+    doc = {
+        "_id": bucket_id(ticker, year),
+        "ticker": ticker,
+        "exchange": exchange,
+        "year": int(year),
+        "n": int(len(frame)),
+        "dates": Binary(days.tobytes()),
+    }
+    for field in BUCKET_FIELDS:
+        doc[field] = Binary(frame[field].to_numpy(dtype=_VALUE_DTYPE).tobytes())
+    doc["source"] = source
+    doc["updated_at"] = datetime.utcnow()
+    return doc
+
+
+def unpack_dates(doc: dict) -> np.ndarray:
+    """Bucket dates as datetime64[D]."""
+    return np.frombuffer(doc["dates"], dtype=_DATE_DTYPE).astype("datetime64[D]")
+
+
+def unpack_field(doc: dict, field: str) -> np.ndarray:
+    return np.frombuffer(doc[field], dtype=_VALUE_DTYPE)
+
+
+def unpack_bucket(doc: dict, fields: Sequence[str] = BUCKET_FIELDS) -> pd.DataFrame:
+    """Bucket document -> normalized bar frame (read-only views over the BSON buffers)."""
+    index = pd.DatetimeIndex(unpack_dates(doc).astype("datetime64[ns]"), name="date")
+    return pd.DataFrame({field: unpack_field(doc, field) for field in fields}, index=index)
+
+
+def merge_bucket(existing: Optional[dict], frame: pd.DataFrame, ticker: str, exchange: str, year: int,
+                 source: str = "yahoo") -> dict:
+    """Merge new bars into an existing bucket; new values win on overlapping dates."""
+    if existing is not None and existing.get("n"):
+        frame = pd.concat([unpack_bucket(existing), frame])
+        frame = frame[~frame.index.duplicated(keep="last")].sort_index()
+    return pack_bucket(ticker, exchange, year, frame, source)
+
+
+def split_by_year(frame: pd.DataFrame) -> Iterable[Tuple[int, pd.DataFrame]]:
+    if frame.empty:
+        return []
+    return frame.groupby(frame.index.year)
+
+
+async def bucket_write_ops(coll, frames: Dict[str, Tuple[str, pd.DataFrame]],
+                           source: str = "yahoo") -> Tuple[List[ReplaceOne], Dict[str, int]]:
+    """
+    Build upserts for many tickers at once.
+    frames: ticker -> (exchange, normalized frame). Existing buckets touched by the new
+    bars are read back in a single $in query and merged before replacing.
+    Also returns ticker -> number of bars the merge added (for coverage counts).
+    """
+    by_bucket: Dict[str, Tuple[str, str, int, pd.DataFrame]] = {}
+    for ticker, (exchange, frame) in frames.items():
+        for year, part in split_by_year(frame):
+            by_bucket[bucket_id(ticker, year)] = (ticker, exchange, int(year), part)
+    if not by_bucket:
+        return [], {}
+
+    existing = {
+        doc["_id"]: doc
+        for doc in await coll.find({"_id": {"$in": list(by_bucket)}}).to_list(length=None)
+    }
+    ops = []
+    added: Dict[str, int] = {}
+    for _id, (ticker, exchange, year, part) in by_bucket.items():
+        before = existing.get(_id)
+        doc = merge_bucket(before, part, ticker, exchange, year, source)
+        ops.append(ReplaceOne({"_id": _id}, doc, upsert=True))
+        added[ticker] = added.get(ticker, 0) + doc["n"] - (before or {}).get("n", 0)
+    return ops, added
+
+
+def _bucket_query(start: datetime, end: datetime, tickers: Optional[Sequence[str]] = None,
+                  exchange: Optional[str] = None) -> dict:
+    query = {"year": {"$gte": start.year, "$lte": end.year}}
+    if tickers is not None:
+        query["ticker"] = {"$in": list(tickers)}
+    if exchange is not None:
+        query["exchange"] = exchange
+    return query
+
+
+def bucket_panel_query(start: datetime, end: datetime, fields: Sequence[str] = ("close",),
+                       tickers: Optional[Sequence[str]] = None,
+                       exchange: Optional[str] = None) -> Tuple[dict, dict]:
+    """(query, projection) reading just the buckets and buffers panel_from_buckets needs."""
+    return _bucket_query(start, end, tickers, exchange), {"ticker": 1, "dates": 1, **{f: 1 for f in fields}}
+
+
+def bucket_ticker_query(ticker: str, start: datetime, end: datetime,
+                        fields: Sequence[str] = BUCKET_FIELDS) -> Tuple[dict, dict]:
+    """(query, projection) for one ticker's year buckets overlapping [start, end]."""
+    projection = {"ticker": 1, "exchange": 1, "source": 1, "year": 1, "dates": 1, **{f: 1 for f in fields}}
+    return _bucket_query(start, end, [ticker]), projection
+
+
+def batch_from_buckets(docs: Iterable[dict], ticker: str, start: datetime, end: datetime,
+                       fields: Sequence[str] = BUCKET_FIELDS) -> BarBatch:
+    """One ticker's bars within [start, end], oldest first, unpacked from its year buckets."""
+    lo = np.datetime64(pd.Timestamp(start).date(), "D")
+    hi = np.datetime64(pd.Timestamp(end).date(), "D")
+    parts = []
+    for doc in sorted(docs, key=lambda d: d["year"]):
+        dates = unpack_dates(doc)
+        mask = (dates >= lo) & (dates <= hi)
+        if mask.any():
+            parts.append(BarBatch(
+                np.full(int(mask.sum()), ticker, dtype=object),
+                dates[mask].astype("datetime64[ns]"),
+                {f: unpack_field(doc, f)[mask] for f in fields},
+                doc.get("exchange", "SSE"),
+                doc.get("source", "yahoo"),
+            ))
+    return BarBatch.concat(parts) if parts else BarBatch.empty(fields)
+
+
+async def load_batch(coll, ticker: str, start: datetime, end: datetime,
+                     fields: Sequence[str] = BUCKET_FIELDS) -> BarBatch:
+    """batch_from_buckets over an async (Motor) bars_yearly collection."""
+    query, projection = bucket_ticker_query(ticker, start, end, fields)
+    return batch_from_buckets(await coll.find(query, projection).to_list(length=None), ticker, start, end, fields)
+
+
+async def row_batches(coll, ticker: str, start: datetime, end: datetime,
+                      fields: Sequence[str] = BUCKET_FIELDS) -> AsyncIterator[List[dict]]:
+    """One ticker's bars as projected rows (date + fields), one list per year bucket, oldest first."""
+    query, projection = bucket_ticker_query(ticker, start, end, fields)
+    async for doc in coll.find(query, projection).sort("year", 1):
+        rows = batch_from_buckets([doc], ticker, start, end, fields).to_rows(fields)
+        if rows:
+            yield rows
+
+
+def panel_from_buckets(docs: Iterable[dict], start: datetime, end: datetime, fields: Sequence[str] = ("close",),
+                       tickers: Optional[Sequence[str]] = None, dtype=np.float64) -> Panel:
+    """
+    Date x ticker matrices for `fields`, filled straight from the packed buffers into
+    preallocated arrays (NaN where a ticker has no bar). Column order follows PanelBuilder:
+    `tickers` as given, otherwise every ticker found, sorted.
+    """
+    lo = np.datetime64(pd.Timestamp(start).date(), "D")
+    hi = np.datetime64(pd.Timestamp(end).date(), "D")
+
+    parts: List[Tuple[str, np.ndarray, Dict[str, np.ndarray]]] = []
+    for doc in docs:
+        dates = unpack_dates(doc)
+        mask = (dates >= lo) & (dates <= hi)
+        if mask.any():
+            parts.append((doc["ticker"], dates[mask], {f: unpack_field(doc, f)[mask] for f in fields}))
+
+    names = list(dict.fromkeys(tickers)) if tickers is not None else sorted({t for t, _, _ in parts})
+    all_dates = np.unique(np.concatenate([d for _, d, _ in parts])) if parts else np.array([], dtype="datetime64[D]")
+    col_pos = {t: j for j, t in enumerate(names)}
+    values = {f: np.full((len(all_dates), len(names)), np.nan, dtype=dtype) for f in fields}
+    for ticker, dates, vals in parts:
+        j = col_pos.get(ticker)
+        if j is None:
+            continue
+        rows = np.searchsorted(all_dates, dates)
+        for f in fields:
+            values[f][rows, j] = vals[f]
+    return Panel(all_dates, names, values)
+
+
+async def load_panel(coll, start: datetime, end: datetime, fields: Sequence[str] = ("close",),
+                     tickers: Optional[Sequence[str]] = None, exchange: Optional[str] = None,
+                     dtype=np.float64) -> Panel:
+    """panel_from_buckets over an async (Motor) bars_yearly collection."""
+    query, projection = bucket_panel_query(start, end, fields, tickers, exchange)
+    return panel_from_buckets(await coll.find(query, projection).to_list(length=None), start, end, fields, tickers, dtype)
+
+
+async def load_dates(coll, start: datetime, end: datetime, tickers: Optional[Sequence[str]] = None,
+                     exchange: Optional[str] = None) -> Dict[str, pd.DatetimeIndex]:
+    """Stored dates per ticker within [start, end], reading only the packed date arrays."""
+    docs = await coll.find(_bucket_query(start, end, tickers, exchange), {"ticker": 1, "dates": 1}).to_list(length=None)
+    lo = np.datetime64(pd.Timestamp(start).date(), "D")
+    hi = np.datetime64(pd.Timestamp(end).date(), "D")
+
+    parts: Dict[str, List[np.ndarray]] = {}
+    for doc in docs:
+        dates = unpack_dates(doc)
+        parts.setdefault(doc["ticker"], []).append(dates[(dates >= lo) & (dates <= hi)])
+    return {
+        ticker: pd.DatetimeIndex(np.sort(np.concatenate(arrs)).astype("datetime64[ns]"))
+        for ticker, arrs in parts.items()
+    }
+
+
+async def create_bucket_indexes(database):
+    coll = database[BUCKET_COLLECTION]
+    await coll.create_index([("ticker", 1), ("year", 1)])
+    await coll.create_index([("exchange", 1), ("year", 1)])
@@ -0,0 +1,196 @@
+"""
+Per-ticker coverage metadata, maintained at write time.
+
+Every bar write also updates one small document per (store, ticker) in the coverage
+collection, so "what date range do we hold?" is an index lookup instead of a $group
+over the whole bar collection:
+
+    {
+        "_id": "bars_daily:600000.SH", "store": "bars_daily", "ticker": "600000.SH",
+        "exchange": "SSE", "min_date": ..., "max_date": ..., "bar_count": 1942,
+        "updated_at": ...
+    }
+
+min/max only ever widen ($min/$max) and bar_count is incremented by the number of
+bars the write actually added, so overlapping rewrites do not inflate it.
+
+Ranges that were fetched and confirmed to hold no bars (trading suspensions, dates
+before a listing) are kept in an optional "empty_ranges" list of closed-open
+[start, end) pairs, so incremental backfills stop planning them again. A ticker with
+no bars at all can have a document holding only empty_ranges; coverage_query skips
+those.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+
+from app.db.schema import BarBatch
+
+COVERAGE_COLLECTION = "coverage"
+
+# Closed-open day range [start, end)
+DayRange = Tuple[datetime, datetime]
+
+
+@dataclass
+class CoverageDelta:
+    exchange: str
+    min_date: datetime
+    max_date: datetime
+    added: int = 0
+
+
+def coverage_id(store: str, ticker: str) -> str:
+    return f"{store}:{ticker}"
+
+
+def merge_ranges(ranges: Sequence[DayRange]) -> List[DayRange]:
+    """Merge overlapping or adjacent ranges."""
+    merged: List[DayRange] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(want: DayRange, have: Sequence[DayRange]) -> List[DayRange]:
+    """Parts of `want` not covered by the (merged, sorted) `have` ranges."""
+    start, end = want
+    missing: List[DayRange] = []
+    for h_start, h_end in have:
+        if h_end <= start or h_start >= end:
+            continue
+        if h_start > start:
+            missing.append((start, h_start))
+        start = max(start, h_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+def delta_from_batch(batch: BarBatch, added: int) -> CoverageDelta:
+    """Coverage change for one ticker's written (non-empty) BarBatch, `added` bars of which were new."""
+    return CoverageDelta(
+        batch.exchange,
+        batch.date.min().astype("datetime64[us]").item(),
+        batch.date.max().astype("datetime64[us]").item(),
+        added,
+    )
+
+
+def coverage_ops(store: str, deltas: Dict[str, CoverageDelta]) -> List[UpdateOne]:
+    now = datetime.utcnow()
+    return [
+        UpdateOne(
+            {"_id": coverage_id(store, ticker)},
+            {
+                "$min": {"min_date": d.min_date},
+                "$max": {"max_date": d.max_date},
+                "$inc": {"bar_count": d.added},
+                "$set": {"store": store, "ticker": ticker, "exchange": d.exchange, "updated_at": now},
+            },
+            upsert=True,
+        )
+        for ticker, d in deltas.items()
+    ]
+
+
+async def write_coverage(coll, store: str, deltas: Dict[str, CoverageDelta]):
+    ops = coverage_ops(store, deltas)
+    if ops:
+        await coll.bulk_write(ops, ordered=False)
+
+
+def coverage_query(store: str = "bars_daily", exchange: Optional[str] = None,
+                   tickers: Optional[Iterable[str]] = None) -> dict:
+    # Documents holding only empty_ranges describe no stored bars
+    query = {"store": store, "min_date": {"$exists": True}}
+    if exchange is not None:
+        query["exchange"] = exchange
+    if tickers is not None:
+        query["_id"] = {"$in": [coverage_id(store, t) for t in tickers]}
+    return query
+
+
+def overall_range(docs: Iterable[dict]) -> Optional[dict]:
+    """{"min_date", "max_date"} across coverage documents (None if there are none)."""
+    docs = list(docs)
+    if not docs:
+        return None
+    return {
+        "min_date": min(d["min_date"] for d in docs),
+        "max_date": max(d["max_date"] for d in docs),
+    }
+
+
+async def load_empty_ranges(coll, store: str, tickers: Optional[Iterable[str]] = None,
+                            exchange: Optional[str] = None) -> Dict[str, List[DayRange]]:
+    """ticker -> merged ranges confirmed to hold no bars."""
+    query = {"store": store, "empty_ranges": {"$exists": True}}
+    if exchange is not None:
+        query["exchange"] = exchange
+    if tickers is not None:
+        query["_id"] = {"$in": [coverage_id(store, t) for t in tickers]}
+    return {
+        doc["ticker"]: [(s, e) for s, e in doc["empty_ranges"]]
+        async for doc in coll.find(query, {"ticker": 1, "empty_ranges": 1})
+    }
+
+
+async def write_empty_ranges(coll, store: str, exchange: str, ranges: Dict[str, List[DayRange]]):
+    """Merge newly confirmed empty ranges into the tickers' coverage documents."""
+    ranges = {t: rs for t, rs in ranges.items() if rs}
+    if not ranges:
+        return
+    existing = await load_empty_ranges(coll, store, ranges)
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {"_id": coverage_id(store, ticker)},
+            {"$set": {
+                "store": store, "ticker": ticker, "exchange": exchange, "updated_at": now,
+                "empty_ranges": [list(r) for r in merge_ranges(existing.get(ticker, []) + rs)],
+            }},
+            upsert=True,
+        )
+        for ticker, rs in ranges.items()
+    ]
+    await coll.bulk_write(ops, ordered=False)
+
+
+async def rebuild_coverage(bars_coll, coverage_coll, store: str = "bars_daily"):
+    """
+    Recompute coverage for a daily-bar collection with one full $group. Only needed
+    once for bars written before coverage tracking existed. Recorded empty_ranges are kept.
+    """
+    pipeline = [
+        {"$group": {
+            "_id": "$ticker",
+            "exchange": {"$first": "$exchange"},
+            "min_date": {"$min": "$date"},
+            "max_date": {"$max": "$date"},
+            "bar_count": {"$sum": 1},
+        }},
+    ]
+    now = datetime.utcnow()
+    ops = []
+    async for row in bars_coll.aggregate(pipeline, allowDiskUse=True):
+        doc = {
+            "store": store, "ticker": row["_id"], "exchange": row["exchange"],
+            "min_date": row["min_date"], "max_date": row["max_date"],
+            "bar_count": row["bar_count"], "updated_at": now,
+        }
+        ops.append(UpdateOne({"_id": coverage_id(store, row["_id"])}, {"$set": doc}, upsert=True))
+    await coverage_coll.delete_many({"store": store, "empty_ranges": {"$exists": False}})
+    await coverage_coll.update_many({"store": store}, {"$unset": {"min_date": "", "max_date": "", "bar_count": ""}})
+    if ops:
+        await coverage_coll.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def create_coverage_indexes(database):
+    await database[COVERAGE_COLLECTION].create_index([("store", 1), ("exchange", 1)])
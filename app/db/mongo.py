@@ -5,6 +5,31 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     MONGO_URI: str = "mongodb://localhost:27017"
     MONGO_DB_NAME: str = "oakcean"
+    # Local Parquet bar cache used by Direct-Fetch mode (empty string disables it)
+    BAR_CACHE_DIR: str = ".cache/bars"
+    # Yahoo request budget, shared by every process using the same state file
+    YAHOO_RATE_PER_SEC: float = 2.0
+    YAHOO_BURST: float = 10.0
+    YAHOO_RATE_STATE: str = ".cache/yahoo_rate.json"
+    YAHOO_RETRIES: int = 3
+    # Provision bars_daily as a native time-series collection (timeField=date, metaField=ticker).
+    # Only applies when the collection is created; an existing collection keeps its type.
+    BARS_TIMESERIES: bool = False
+    # Where date x ticker panels are read from: "docs" (bars_daily) or "buckets"
+    # (bars_yearly, written by backfill_bars --storage buckets)
+    BAR_STORAGE: str = "docs"
+    # API response cache: total bytes of rendered bodies kept in memory, and how long
+    # (seconds) data-version counters are trusted before re-reading them
+    API_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    API_VERSION_TTL: float = 5.0
+    # Worker processes for /v1/jobs (clustering, backtests)
+    JOB_WORKERS: int = 2
+    # Opt-in profiling (app/profiling.py): reports for scripts, the API process and
+    # dashboard runs land in PROFILE_DIR. PROFILER: cprofile, or pyinstrument if installed
+    PROFILE: bool = False
+    PROFILE_DIR: str = ".cache/profiles"
+    PROFILE_TOP_N: int = 40
+    PROFILER: str = "cprofile"
 
     class Config:
         env_file = ".env"
@@ -39,9 +64,28 @@ class Database:
         await instruments.create_index("ticker", unique=True)
         
         # Bars indexes
+        if settings.BARS_TIMESERIES and "bars_daily" not in await self.db.list_collection_names():
+            # Bars are bucketed server-side per ticker; daily data fits the "hours" granularity
+            await self.db.create_collection(
+                "bars_daily",
+                timeseries={"timeField": "date", "metaField": "ticker", "granularity": "hours"},
+            )
         bars = self.db["bars_daily"]
         # _id is already unique by definition, but we want fast lookups by ticker+date
         await bars.create_index([("ticker", 1), ("date", 1)])
         await bars.create_index([("exchange", 1), ("date", 1)])
 
+        # Bucketed storage (one packed document per ticker-year), see app/db/buckets.py
+        from app.db.buckets import create_bucket_indexes
+        from app.db.coverage import create_coverage_indexes
+        await create_bucket_indexes(self.db)
+        await create_coverage_indexes(self.db)
+
+    async def is_timeseries(self, collection_name: str) -> bool:
+        """Whether the collection was provisioned as a time-series collection."""
+        if self.db is None:
+            self.connect()
+        infos = await self.db.list_collections(filter={"name": collection_name}).to_list(length=1)
+        return bool(infos) and infos[0].get("type") == "timeseries"
+
 db = Database()
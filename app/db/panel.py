@@ -0,0 +1,121 @@
+"""
+Dense date x ticker panels built straight from bar documents.
+
+Documents can arrive in any order and in batches (cursor pages, provider chunks):
+PanelBuilder keeps only compact per-batch code/value arrays, then scatters them once
+into preallocated (dates x tickers) matrices, one per field. This replaces
+pd.DataFrame(docs).pivot(...) without materializing an intermediate frame.
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.db.schema import BarBatch
+from app.instrumentation import timed
+
+PANEL_DTYPES = {"float32": np.float32, "float64": np.float64}
+
+
+@dataclass
+class Panel:
+    dates: np.ndarray              # datetime64[D], ascending
+    tickers: List[str]
+    values: Dict[str, np.ndarray]  # field -> (len(dates), len(tickers)), NaN where there is no bar
+
+    def frame(self, field: str) -> pd.DataFrame:
+        index = pd.DatetimeIndex(self.dates.astype("datetime64[ns]"), name="date")
+        return pd.DataFrame(self.values[field], index=index, columns=pd.Index(self.tickers, name="ticker"))
+
+    def frames(self) -> Dict[str, pd.DataFrame]:
+        return {field: self.frame(field) for field in self.values}
+
+
+class PanelBuilder:
+    """
+    Accumulates bar documents (date, ticker and the panel fields) into a Panel.
+    With tickers given, columns follow that order and other tickers are ignored;
+    otherwise columns are every ticker seen, sorted.
+    """
+
+    def __init__(self, fields: Sequence[str] = ("close",), tickers: Optional[Sequence[str]] = None,
+                 dtype=np.float64):
+        self.fields = list(fields)
+        self.dtype = np.dtype(dtype)
+        self.fixed = tickers is not None
+        self.tickers: List[str] = list(dict.fromkeys(tickers or []))
+        self._col: Dict[str, int] = {t: j for j, t in enumerate(self.tickers)}
+        self._dates: List[np.ndarray] = []
+        self._cols: List[np.ndarray] = []
+        self._values: Dict[str, List[np.ndarray]] = {f: [] for f in self.fields}
+
+    def _column(self, ticker: str) -> int:
+        j = self._col.get(ticker)
+        if j is None:
+            if self.fixed:
+                return -1
+            j = self._col[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+        return j
+
+    def add(self, docs: Sequence[dict]) -> "PanelBuilder":
+        if not docs:
+            return self
+        cols = np.fromiter((self._column(d["ticker"]) for d in docs), dtype=np.int64, count=len(docs))
+        keep = cols >= 0
+        dates = np.array([d["date"] for d in docs], dtype="datetime64[D]")
+        self._dates.append(dates[keep])
+        self._cols.append(cols[keep])
+        for field in self.fields:
+            # Missing / None values become NaN
+            vals = np.array([d.get(field) for d in docs], dtype=np.float64)
+            self._values[field].append(vals[keep])
+        return self
+
+    def add_batch(self, batch: BarBatch) -> "PanelBuilder":
+        """Columnar fast path: no per-document loop beyond mapping tickers to columns."""
+        if not len(batch):
+            return self
+        codes = {t: self._column(t) for t in batch.tickers}
+        cols = np.array([codes[t] for t in batch.ticker.tolist()], dtype=np.int64)
+        keep = cols >= 0
+        self._dates.append(batch.date[keep].astype("datetime64[D]"))
+        self._cols.append(cols[keep])
+        for field in self.fields:
+            self._values[field].append(batch.values[field][keep])
+        return self
+
+    def add_batches(self, batches: Iterable[Sequence[dict]]) -> "PanelBuilder":
+        for docs in batches:
+            self.add(docs)
+        return self
+
+    @timed("panel.build")
+    def build(self) -> Panel:
+        if not self._dates:
+            empty = np.empty((0, len(self.tickers)), dtype=self.dtype)
+            tickers = self.tickers if self.fixed else sorted(self.tickers)
+            return Panel(np.array([], dtype="datetime64[D]"), tickers, {f: empty.copy() for f in self.fields})
+
+        dates = np.concatenate(self._dates)
+        cols = np.concatenate(self._cols)
+        all_dates, rows = np.unique(dates, return_inverse=True)
+
+        tickers = self.tickers
+        if not self.fixed:
+            order = np.argsort(tickers, kind="stable")
+            tickers = [tickers[j] for j in order]
+            cols = np.argsort(order)[cols]
+
+        values = {}
+        for field in self.fields:
+            matrix = np.full((len(all_dates), len(tickers)), np.nan, dtype=self.dtype)
+            matrix[rows, cols] = np.concatenate(self._values[field])
+            values[field] = matrix
+        return Panel(all_dates, tickers, values)
+
+
+def build_panel(docs: Sequence[dict], fields: Sequence[str] = ("close",),
+                tickers: Optional[Sequence[str]] = None, dtype=np.float64) -> Panel:
+    return PanelBuilder(fields, tickers, dtype).add(docs).build()
@@ -0,0 +1,135 @@
+import threading
+from datetime import datetime
+from itertools import islice
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+from pymongo import MongoClient
+
+from app.db.mongo import settings
+from app.db.buckets import (BUCKET_COLLECTION, bar_store, batch_from_buckets, bucket_panel_query,
+                             bucket_ticker_query, panel_from_buckets)
+from app.db.coverage import COVERAGE_COLLECTION, coverage_query, overall_range
+from app.db.panel import Panel, PanelBuilder
+from app.db.schema import BAR_FIELDS, bar_projection
+from app.instrumentation import timed
+
+# Documents per cursor round trip for multi-ticker reads
+READ_BATCH_SIZE = 10000
+
+
+class BarRepository:
+    """
+    Synchronous, pooled read access to the bar store for long-lived callers (the dashboard).
+
+    Wraps one thread-safe pymongo MongoClient, so every page and widget interaction
+    reuses the same connection pool instead of opening a client (and event loop) per
+    call and paying the TCP/handshake/server-selection cost each time.
+    """
+
+    def __init__(self, uri: Optional[str] = None, db_name: Optional[str] = None,
+                 server_selection_timeout_ms: int = 2000, max_pool_size: int = 20):
+        self.client = MongoClient(
+            uri or settings.MONGO_URI,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            maxPoolSize=max_pool_size,
+        )
+        self.db = self.client[db_name or settings.MONGO_DB_NAME]
+
+    def close(self):
+        self.client.close()
+
+    def ping(self) -> bool:
+        """Whether MongoDB is reachable."""
+        try:
+            self.client.admin.command("ping")
+            return True
+        except Exception:
+            return False
+
+    @timed("repository.instruments")
+    def instruments(self, exchange: str = "SSE", active_only: bool = True) -> List[dict]:
+        query = {"exchange": exchange}
+        if active_only:
+            query["is_active"] = True
+        return list(self.db["instruments"].find(query, {"_id": 0, "ticker": 1}))
+
+    @timed("repository.bars")
+    def bars(self, ticker: str, start: datetime, end: datetime,
+             fields: Sequence[str] = BAR_FIELDS) -> List[dict]:
+        """One ticker's bars within [start, end], sorted by date (unpacked from bars_yearly with BAR_STORAGE=buckets)."""
+        if settings.BAR_STORAGE == "buckets":
+            query, projection = bucket_ticker_query(ticker, start, end, fields)
+            docs = self.db[BUCKET_COLLECTION].find(query, projection)
+            return batch_from_buckets(docs, ticker, start, end, fields).to_rows(fields)
+        query = {"ticker": ticker, "date": {"$gte": start, "$lte": end}}
+        return list(self.db["bars_daily"].find(query, bar_projection(list(fields))).sort("date", 1))
+
+    @timed("repository.panel")
+    def panel(self, start: datetime, end: datetime, fields: Sequence[str] = ("close",),
+              exchange: Optional[str] = None, tickers: Optional[Sequence[str]] = None,
+              dtype=np.float64) -> Panel:
+        """
+        Date x ticker matrices for `fields`, filled batch by batch from the cursor.
+        With BAR_STORAGE=buckets they are unpacked from bars_yearly instead.
+        """
+        if settings.BAR_STORAGE == "buckets":
+            query, projection = bucket_panel_query(start, end, fields, tickers, exchange)
+            docs = self.db[BUCKET_COLLECTION].find(query, projection)
+            return panel_from_buckets(docs, start, end, fields, tickers, dtype)
+
+        query = {"date": {"$gte": start, "$lte": end}}
+        if tickers is not None:
+            query["ticker"] = {"$in": list(tickers)}
+        if exchange is not None:
+            query["exchange"] = exchange
+        cursor = self.db["bars_daily"].find(
+            query, bar_projection(list(fields), keys=["date", "ticker"]), batch_size=READ_BATCH_SIZE
+        )
+        return PanelBuilder(fields, tickers, dtype).add_batches(_batches(cursor, READ_BATCH_SIZE)).build()
+
+    @timed("repository.coverage")
+    def coverage(self, exchange: Optional[str] = None, tickers: Optional[Sequence[str]] = None) -> List[dict]:
+        """Per-ticker coverage documents for the configured bar store (see app.db.coverage)."""
+        return list(self.db[COVERAGE_COLLECTION].find(coverage_query(bar_store(), exchange, tickers), {"_id": 0}))
+
+    @timed("repository.date_range")
+    def date_range(self, ticker: Optional[str] = None) -> Optional[dict]:
+        """
+        {"min_date", "max_date"} of stored bars, for one ticker or the whole collection.
+        Read from the coverage metadata; only falls back to scanning bars_daily when no
+        coverage has been recorded yet (bars written before it was tracked). Bucket writes
+        always record coverage, so bars_yearly is never scanned.
+        """
+        store = bar_store()
+        found = overall_range(self.coverage(tickers=[ticker] if ticker else None))
+        if found or store != "bars_daily" or self.db[COVERAGE_COLLECTION].find_one({"store": store}, {"_id": 1}):
+            return found
+
+        pipeline = [{"$match": {"ticker": ticker}}] if ticker else []
+        pipeline.append({"$group": {"_id": None, "min_date": {"$min": "$date"}, "max_date": {"$max": "$date"}}})
+        result = list(self.db["bars_daily"].aggregate(pipeline))
+        if result and result[0]["min_date"]:
+            return result[0]
+        return None
+
+
+def _batches(cursor, size: int) -> Iterator[List[dict]]:
+    while True:
+        batch = list(islice(cursor, size))
+        if not batch:
+            return
+        yield batch
+
+
+_shared: Optional[BarRepository] = None
+_shared_lock = threading.Lock()
+
+
+def get_repository() -> BarRepository:
+    """The process-wide repository, created on first use."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = BarRepository()
+        return _shared
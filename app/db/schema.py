@@ -1,8 +1,20 @@
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, List, Literal
+from typing import Annotated, Any, Dict, Optional, List, Literal, Sequence
+import numpy as np
+import pandas as pd
 from pydantic import BaseModel, Field
 
+# Numeric bar fields, in storage order
+BAR_FIELDS = ["open", "high", "low", "close", "adj_close", "volume"]
 
+def bar_projection(fields: Optional[List[str]] = None, keys: List[str] = ["date"]) -> dict:
+    """
+    Mongo projection for bar reads: the key fields plus the requested bar fields
+    (all of BAR_FIELDS if None). _id is left out, so reads never carry the string id.
+    """
+    wanted = [f for f in (fields or BAR_FIELDS) if f in BAR_FIELDS]
+    return {"_id": 0, **{k: 1 for k in keys}, **{f: 1 for f in wanted}}
 
 class Instrument(BaseModel):
     ticker: str
@@ -28,8 +40,233 @@ class Bar(BaseModel):
     class Config:
         populate_by_name = True
 
+class BarRow(BaseModel):
+    """One /v1/bars row: date plus the requested fields (the full Bar document when fields is omitted)."""
+    date: datetime
+    open: Optional[float] = None
+    high: Optional[float] = None
+    low: Optional[float] = None
+    close: Optional[float] = None
+    adj_close: Optional[float] = None
+    volume: Optional[float] = None
+
+class BarColumns(BaseModel):
+    """/v1/bars?format=columns: one array per requested field, aligned with date (NaN -> null)."""
+    ticker: str
+    date: List[datetime]
+    open: Optional[List[Optional[float]]] = None
+    high: Optional[List[Optional[float]]] = None
+    low: Optional[List[Optional[float]]] = None
+    close: Optional[List[Optional[float]]] = None
+    adj_close: Optional[List[Optional[float]]] = None
+    volume: Optional[List[Optional[float]]] = None
+
+@dataclass
+class BarBatch:
+    """
+    Columnar bars for one or many tickers: one NumPy array per column instead of a
+    Bar object (with its own datetime, string id and updated_at) per row.
+
+    ticker: str per row (object array); date: datetime64[ns]; values: field -> float64.
+    Frame and Arrow conversions wrap the arrays without copying; Mongo documents
+    (same keys and order as Bar.model_dump(by_alias=True)) are only built at write time.
+    """
+    ticker: np.ndarray
+    date: np.ndarray
+    values: Dict[str, np.ndarray]
+    exchange: str = "SSE"
+    source: str = "yahoo"
+
+    def __len__(self) -> int:
+        return len(self.date)
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.values)
+
+    @property
+    def tickers(self) -> List[str]:
+        return list(dict.fromkeys(self.ticker.tolist()))
+
+    # --- Construction ---
+
+    @classmethod
+    def empty(cls, fields: Sequence[str] = BAR_FIELDS, exchange: str = "SSE", source: str = "yahoo") -> "BarBatch":
+        return cls(np.array([], dtype=object), np.array([], dtype="datetime64[ns]"),
+                   {f: np.array([], dtype=np.float64) for f in fields}, exchange, source)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, ticker: str, exchange: str = "SSE", source: str = "yahoo") -> "BarBatch":
+        """Wrap a normalized bar frame (date index, float64 field columns) for one ticker."""
+        index = frame.index
+        if getattr(index, "tz", None) is not None:
+            index = index.tz_localize(None)  # keep the exchange-local calendar date
+        return cls(
+            np.full(len(frame), ticker, dtype=object),
+            np.asarray(index.values, dtype="datetime64[ns]"),
+            {f: frame[f].to_numpy(dtype=np.float64) for f in frame.columns},
+            exchange,
+            source,
+        )
+
+    @classmethod
+    def from_docs(cls, docs: Sequence[dict], fields: Sequence[str] = BAR_FIELDS, ticker: Optional[str] = None,
+                  exchange: Optional[str] = None, source: Optional[str] = None) -> "BarBatch":
+        """Bar documents (e.g. a cursor batch, possibly projected) -> columns. Missing values become NaN."""
+        if not docs:
+            return cls.empty(fields, exchange or "SSE", source or "yahoo")
+        first = docs[0]
+        return cls(
+            np.array([d.get("ticker", ticker) for d in docs], dtype=object),
+            np.array([d["date"] for d in docs], dtype="datetime64[ns]"),
+            {f: np.array([d.get(f) for d in docs], dtype=np.float64) for f in fields},
+            exchange or first.get("exchange", "SSE"),
+            source or first.get("source", "yahoo"),
+        )
+
+    @classmethod
+    def from_bars(cls, bars: Sequence["Bar"]) -> "BarBatch":
+        return cls.from_docs([bar.model_dump(by_alias=True) for bar in bars])
+
+    @classmethod
+    def concat(cls, batches: Sequence["BarBatch"]) -> "BarBatch":
+        batches = [b for b in batches if len(b)] or list(batches[:1])
+        if not batches:
+            return cls.empty()
+        first = batches[0]
+        return cls(
+            np.concatenate([b.ticker for b in batches]),
+            np.concatenate([b.date for b in batches]),
+            {f: np.concatenate([b.values[f] for b in batches]) for f in first.values},
+            first.exchange,
+            first.source,
+        )
+
+    # --- Slicing ---
+
+    def take(self, rows) -> "BarBatch":
+        return BarBatch(self.ticker[rows], self.date[rows], {f: v[rows] for f, v in self.values.items()},
+                        self.exchange, self.source)
+
+    def split(self) -> Dict[str, "BarBatch"]:
+        """ticker -> that ticker's rows (the batch itself if it holds a single ticker)."""
+        tickers = self.tickers
+        if len(tickers) <= 1:
+            return {t: self for t in tickers}
+        return {t: self.take(self.ticker == t) for t in tickers}
+
+    # --- Conversion ---
+
+    def to_frame(self) -> pd.DataFrame:
+        """Normalized bar frame indexed by date (plus a ticker column for multi-ticker batches)."""
+        columns = dict(self.values)
+        if len(self.tickers) > 1:
+            columns = {"ticker": self.ticker, **columns}
+        return pd.DataFrame(columns, index=pd.DatetimeIndex(self.date, name="date"), copy=False)
+
+    def to_arrow(self, include_ticker: bool = True):
+        """pyarrow.Table with date (timestamp[ms]), optionally ticker, and the float64 fields."""
+        import pyarrow as pa
+
+        columns = {"date": pa.array(self.date.astype("datetime64[ms]"))}
+        if include_ticker:
+            columns["ticker"] = pa.array(self.ticker.tolist(), type=pa.string())
+        for f, v in self.values.items():
+            columns[f] = pa.array(v)
+        return pa.table(columns)
+
+    def to_rows(self, fields: Optional[Sequence[str]] = None) -> List[dict]:
+        """date plus `fields` (default: all) per bar, the shape of a bar_projection read."""
+        fields = list(fields or self.values)
+        dates = self.date.astype("datetime64[us]").tolist()
+        columns = [self.values[f].tolist() for f in fields]
+        return [dict(zip(["date", *fields], row)) for row in zip(dates, *columns)]
+
+    def to_docs(self, updated_at: Optional[datetime] = None) -> List[dict]:
+        """Mongo-ready bar documents, keys and order as Bar.model_dump(by_alias=True)."""
+        if not len(self):
+            return []
+        now = updated_at or datetime.utcnow()
+        days = np.datetime_as_string(self.date, unit="D").tolist()
+        dates = self.date.astype("datetime64[us]").tolist()
+        columns = [self.values[f].tolist() for f in BAR_FIELDS]
+        exchange, source = self.exchange, self.source
+        return [
+            {
+                "_id": f"{t}:{ds}",
+                "ticker": t,
+                "exchange": exchange,
+                "date": d,
+                "open": op,
+                "high": hi,
+                "low": lo,
+                "close": cl,
+                "adj_close": ac,
+                "volume": vo,
+                "source": source,
+                "updated_at": now,
+            }
+            for t, d, ds, op, hi, lo, cl, ac, vo in zip(self.ticker.tolist(), dates, days, *columns)
+        ]
+
+    def to_bars(self, validate: bool = False) -> List["Bar"]:
+        docs = self.to_docs()
+        if validate:
+            return [Bar(**doc) for doc in docs]
+        return [Bar.model_construct(**doc) for doc in docs]
+
+class Coverage(BaseModel):
+    store: str = "bars_daily"
+    ticker: str
+    exchange: str = "SSE"
+    min_date: datetime
+    max_date: datetime
+    bar_count: int
+    updated_at: datetime
+
 class BarRequest(BaseModel):
     ticker: str
     start_date: datetime
     end_date: datetime
-    fields: List[str] = ["open", "high", "low", "close", "volume"]
\ No newline at end of file
+    fields: List[str] = ["open", "high", "low", "close", "volume"]
+
+class ClusterJobRequest(BaseModel):
+    start: datetime
+    end: datetime
+    exchange: Optional[str] = "SSE"
+    tickers: Optional[List[str]] = None
+    method: Literal["hierarchical", "spectral"] = "hierarchical"
+    num_clusters: int = Field(5, ge=2)
+
+class BacktestJobRequest(ClusterJobRequest):
+    lookback: int = Field(60, ge=2)
+    entry_threshold: float = Field(2.0, gt=0)
+    # Walk-forward clustering: fit on the trailing train_window days, refit every
+    # refit_every days. None clusters once on the full sample (lookahead bias).
+    train_window: Optional[int] = Field(None, ge=20)
+    refit_every: int = Field(21, ge=1)
+
+class SweepJobRequest(BaseModel):
+    start: datetime
+    end: datetime
+    exchange: Optional[str] = "SSE"
+    tickers: Optional[List[str]] = None
+    methods: List[Literal["hierarchical", "spectral"]] = Field(["hierarchical"], min_length=1)
+    num_clusters: List[Annotated[int, Field(ge=2)]] = Field([5], min_length=1)
+    lookbacks: List[Annotated[int, Field(ge=2)]] = Field([60], min_length=1)
+    entry_thresholds: List[Annotated[float, Field(gt=0)]] = Field([2.0], min_length=1)
+    train_window: Optional[int] = Field(None, ge=20)
+    refit_every: int = Field(21, ge=1)
+
+class Job(BaseModel):
+    id: str = Field(alias="_id")
+    kind: Literal["cluster", "backtest", "sweep"]
+    status: Literal["queued", "running", "done", "failed"]
+    params: Dict[str, Any]
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    timings: Optional[List[Dict[str, Any]]] = None
+    class Config:
+        populate_by_name = True
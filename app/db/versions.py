@@ -0,0 +1,27 @@
+"""
+Data-version counters for cache invalidation.
+
+data_versions holds one counter per cacheable unit of data: "<store>:<ticker>" for
+bars (bumped by every backfill write touching the ticker) and "instruments" for the
+instrument master. Readers that cache derived responses key them on these counters.
+"""
+from typing import Iterable, List
+
+from pymongo import UpdateOne
+
+VERSIONS_COLLECTION = "data_versions"
+INSTRUMENTS_VERSION_KEY = "instruments"
+
+
+def bars_version_key(ticker: str, store: str = "bars_daily") -> str:
+    return f"{store}:{ticker}"
+
+
+def bump_ops(keys: Iterable[str]) -> List[UpdateOne]:
+    return [UpdateOne({"_id": key}, {"$inc": {"version": 1}}, upsert=True) for key in dict.fromkeys(keys)]
+
+
+async def bump_versions(coll, keys: Iterable[str]):
+    ops = bump_ops(keys)
+    if ops:
+        await coll.bulk_write(ops, ordered=False)
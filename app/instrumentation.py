@@ -0,0 +1,187 @@
+"""
+Lightweight in-process timers and counters.
+
+    with timed("repository.panel"):
+        ...
+
+    @timed("analytics.cluster_spectral")
+    def cluster_spectral(...):
+        ...
+
+    count("provider.cache.upstream_ranges", len(plan))
+
+Everything lands in one process-wide registry, rendered as Prometheus text by the
+API's /metrics endpoint. Timings of a single run (e.g. one dashboard button press)
+are also collected into the registry returned by collect_timings().
+"""
+import functools
+import inspect
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+METRIC_PREFIX = "oakcean"
+
+
+@dataclass
+class TimerStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    last: float = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timers: Dict[str, TimerStats] = {}
+        self.counters: Dict[str, float] = {}
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self.timers.setdefault(name, TimerStats()).observe(seconds)
+
+    def inc(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> Dict[str, TimerStats]:
+        with self._lock:
+            return {name: TimerStats(**vars(t)) for name, t in self.timers.items()}
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            timers = sorted(self.timers.items())
+            counters = sorted(self.counters.items())
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_seconds Time spent per instrumented stage.",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds summary",
+        ]
+        for name, t in timers:
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{name}"}} {t.count}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{name}"}} {t.total:.6f}')
+        lines += [
+            f"# HELP {METRIC_PREFIX}_stage_seconds_max Slowest single call per stage.",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds_max gauge",
+        ]
+        lines += [f'{METRIC_PREFIX}_stage_seconds_max{{stage="{name}"}} {t.max:.6f}' for name, t in timers]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_events_total Instrumented event counts.",
+            f"# TYPE {METRIC_PREFIX}_events_total counter",
+        ]
+        lines += [f'{METRIC_PREFIX}_events_total{{event="{name}"}} {value:g}' for name, value in counters]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+_run_registry: ContextVar[Optional[Registry]] = ContextVar("run_registry", default=None)
+
+
+def observe(name: str, seconds: float):
+    """Record a timing in the process registry and in the run collecting in this context, if any."""
+    registry.observe(name, seconds)
+    run = _run_registry.get()
+    if run is not None:
+        run.observe(name, seconds)
+
+
+def collect_timings() -> Registry:
+    """
+    Start collecting the timings observed in the current context (thread or asyncio task)
+    into a fresh registry, alongside the process-wide one, until stop_collecting().
+    Unlike diffing registry snapshots, concurrent runs elsewhere in the process do not leak in.
+    """
+    run = Registry()
+    _run_registry.set(run)
+    return run
+
+
+def stop_collecting():
+    _run_registry.set(None)
+
+
+class timed:
+    """
+    Time a block (context manager) or every call of a function (decorator, sync or async).
+    The context-manager form keeps its start times per thread, so do not hold it across
+    an await; decorate the coroutine function instead.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._local = threading.local()
+
+    def __enter__(self):
+        stack = getattr(self._local, "starts", None)
+        if stack is None:
+            stack = self._local.starts = []
+        stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self._local.starts.pop())
+        return False
+
+    def __call__(self, fn):
+        name = self.name
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    observe(name, time.perf_counter() - t0)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - t0)
+        return wrapper
+
+
+def count(name: str, n: float = 1):
+    registry.inc(name, n)
+
+
+def stage_rows(timers: Dict[str, TimerStats]) -> List[dict]:
+    """Per-stage rows (calls, total and mean seconds), e.g. from a collect_timings() registry's snapshot()."""
+    rows = []
+    for name, t in sorted(timers.items()):
+        if t.count <= 0:
+            continue
+        rows.append({
+            "stage": name,
+            "calls": t.count,
+            "total_s": round(t.total, 4),
+            "mean_s": round(t.total / t.count, 4),
+        })
+    return rows
+
+
+def timings_since(before: Optional[Dict[str, TimerStats]] = None) -> List[dict]:
+    """Per-stage rows accumulated in the process registry since an earlier snapshot()."""
+    before = before or {}
+    diff = {}
+    for name, t in registry.snapshot().items():
+        prev = before.get(name, TimerStats())
+        diff[name] = TimerStats(count=t.count - prev.count, total=t.total - prev.total)
+    return stage_rows(diff)
@@ -0,0 +1,270 @@
+"""
+Opt-in run profiling for scripts, the API and dashboard runs.
+
+    with profile_run("backfill_bars"):   # no-op unless PROFILE=true (or enabled=True)
+        ...
+
+One profiled run writes, under PROFILE_DIR:
+
+    <name>-<timestamp>.prof         cProfile stats (snakeviz, pstats, flameprof)
+    <name>-<timestamp>.folded       collapsed stacks (flamegraph.pl, speedscope, inferno)
+    <name>-<timestamp>.top.txt      top-N functions by cumulative and by own time
+    <name>-<timestamp>.memory.txt   tracemalloc peak / current and top-N allocation sites
+
+cProfile covers the calling thread, and with threads=True (CLI scripts only) also the
+threads started while the run is active (e.g. the backfill fetch pool). That hooks the
+process-global threading.setprofile, so in long-lived processes (API, dashboard) it would
+pick up other requests' and sessions' threads. With PROFILER=pyinstrument and
+pyinstrument installed, the calling thread is sampled instead and .html / .speedscope.json replace .prof and .folded.
+
+tracemalloc is process-global too: overlapping runs (two dashboard sessions) share one
+trace, started by the first and stopped by the last. Its peak then covers both runs, so
+their reports leave peak memory out.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.db.mongo import settings
+
+# pstats function key: (filename, lineno, funcname)
+Func = Tuple[str, int, str]
+
+# Profiled runs currently relying on tracemalloc, and whether the first of them started it
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_runs: List["RunProfiler"] = []
+_tracemalloc_owned = False
+
+
+@dataclass
+class ProfileReport:
+    name: str
+    paths: List[str] = field(default_factory=list)
+    peak_bytes: Optional[int] = None   # None when the run overlapped another profiled run
+    elapsed: float = 0.0
+
+    def summary(self) -> str:
+        peak = "n/a" if self.peak_bytes is None else f"{self.peak_bytes / 2**20:.1f} MiB"
+        return f"{self.elapsed:.1f}s, peak {peak}"
+
+
+def profiling_enabled() -> bool:
+    return settings.PROFILE
+
+
+def _label(func: Func) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        return name  # built-in, e.g. "<method 'sort' of 'list' objects>"
+    return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+
+def folded_stacks(stats: pstats.Stats, min_fraction: float = 1e-4) -> Dict[str, int]:
+    """
+    Collapsed stacks ("a;b;c" -> microseconds of own time) rebuilt from cProfile's
+    caller/callee edges. cProfile only records one level of callers, so a function's
+    own time is split across its call paths in proportion to each path's share of
+    its cumulative time. Paths under min_fraction of the total are dropped.
+    """
+    entries = stats.stats
+    callees: Dict[Func, Dict[Func, float]] = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[func] = edge[3]
+
+    roots = [f for f, (_, _, _, _, callers) in entries.items() if not callers]
+    total = sum(entries[f][3] for f in roots) or 1.0
+    cutoff = total * min_fraction
+    folded: Dict[str, int] = {}
+
+    def walk(func: Func, path: List[Func], seconds: float):
+        _, _, tt, ct, _ = entries[func]
+        share = seconds / ct if ct > 0 else 0.0
+        own = int(tt * share * 1e6)
+        if own > 0:
+            key = ";".join(_label(f) for f in path)
+            folded[key] = folded.get(key, 0) + own
+        for callee, edge_ct in callees.get(func, {}).items():
+            sub = edge_ct * share
+            if callee in path or sub < cutoff:
+                continue
+            path.append(callee)
+            walk(callee, path, sub)
+            path.pop()
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 10000))
+    try:
+        for root in roots:
+            walk(root, [root], entries[root][3])
+    finally:
+        sys.setrecursionlimit(limit)
+    return folded
+
+
+def top_report(stats: pstats.Stats, n: int) -> str:
+    out = io.StringIO()
+    stats.stream = out
+    for key in ("cumulative", "tottime"):
+        out.write(f"==== top {n} by {key} ====\n")
+        stats.sort_stats(key).print_stats(n)
+    return out.getvalue()
+
+
+def memory_report(snapshot: Optional[tracemalloc.Snapshot], current: int, peak: Optional[int], n: int) -> str:
+    if peak is None:
+        lines = ["peak traced memory:    n/a (another profiled run overlapped this one)"]
+    else:
+        lines = [f"peak traced memory:    {peak / 2**20:.1f} MiB"]
+    lines.append(f"current traced memory: {current / 2**20:.1f} MiB")
+    if snapshot is None:
+        return "\n".join(lines + ["", "tracemalloc was not tracing; no allocation sites"]) + "\n"
+    lines += ["", f"==== top {n} allocation sites still held at the end of the run ===="]
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    lines += [str(stat) for stat in snapshot.statistics("lineno")[:n]]
+    return "\n".join(lines) + "\n"
+
+
+class RunProfiler:
+    """Start/stop form of profile_run(), for lifecycles that are not one `with` block (API startup/shutdown)."""
+
+    def __init__(self, name: str, out_dir: Optional[str] = None, top_n: Optional[int] = None,
+                 profiler: Optional[str] = None, threads: bool = False):
+        self.name = name
+        self.threads = threads
+        self.out_dir = out_dir or settings.PROFILE_DIR
+        self.top_n = top_n or settings.PROFILE_TOP_N
+        self.kind = (profiler or settings.PROFILER).lower()
+        self._profiles: List[cProfile.Profile] = []
+        self._sampler = None
+        self._shared_trace = False
+        self._t0 = 0.0
+
+    def _thread_hook(self, *_):
+        # First profile event in a thread started during the run: hand it its own cProfile
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        self._profiles.append(profile)
+        profile.enable()
+
+    def _start_tracemalloc(self):
+        global _tracemalloc_owned
+        with _tracemalloc_lock:
+            if _tracemalloc_runs:
+                # Never reset the peak under a run already in flight
+                for run in _tracemalloc_runs:
+                    run._shared_trace = True
+                self._shared_trace = True
+            else:
+                _tracemalloc_owned = not tracemalloc.is_tracing()
+                if _tracemalloc_owned:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+            _tracemalloc_runs.append(self)
+
+    def _stop_tracemalloc(self) -> Tuple[Optional[tracemalloc.Snapshot], int, Optional[int]]:
+        global _tracemalloc_owned
+        with _tracemalloc_lock:
+            snapshot, current, peak = None, 0, None
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+            _tracemalloc_runs.remove(self)
+            if not _tracemalloc_runs and _tracemalloc_owned:
+                tracemalloc.stop()
+                _tracemalloc_owned = False
+        return snapshot, current, None if self._shared_trace else peak
+
+    def start(self) -> "RunProfiler":
+        self._start_tracemalloc()
+        self._t0 = time.perf_counter()
+
+        if self.kind == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                print("pyinstrument is not installed; profiling with cProfile instead")
+                self.kind = "cprofile"
+            else:
+                self._sampler = Profiler()
+                self._sampler.start()
+                return self
+
+        profile = cProfile.Profile()
+        self._profiles.append(profile)
+        if self.threads:
+            threading.setprofile(self._thread_hook)
+        profile.enable()
+        return self
+
+    def stop(self) -> ProfileReport:
+        if self._sampler is not None:
+            self._sampler.stop()
+        else:
+            if self.threads:
+                threading.setprofile(None)
+            # Per-thread profiles too. Before Python 3.12, disable() only affects the calling
+            # thread, so a still-running thread keeps its profile until it exits.
+            for profile in self._profiles:
+                profile.disable()
+        elapsed = time.perf_counter() - self._t0
+
+        snapshot, current, peak = self._stop_tracemalloc()
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        stem = os.path.join(self.out_dir, f"{self.name}-{datetime.now():%Y%m%d-%H%M%S}")
+        report = ProfileReport(self.name, peak_bytes=peak, elapsed=elapsed)
+
+        def write(suffix: str, text: str):
+            with open(stem + suffix, "w") as f:
+                f.write(text)
+            report.paths.append(stem + suffix)
+
+        if self._sampler is not None:
+            from pyinstrument.renderers import SpeedscopeRenderer
+            write(".html", self._sampler.output_html())
+            write(".speedscope.json", self._sampler.output(SpeedscopeRenderer()))
+            write(".top.txt", self._sampler.output_text(unicode=True, show_all=False))
+        else:
+            stats = pstats.Stats(self._profiles[0])
+            for profile in self._profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(stem + ".prof")
+            report.paths.append(stem + ".prof")
+            folded = folded_stacks(stats)
+            write(".folded", "".join(f"{stack} {us}\n" for stack, us in sorted(folded.items())))
+            write(".top.txt", top_report(stats, self.top_n))
+        write(".memory.txt", memory_report(snapshot, current, peak, self.top_n))
+        return report
+
+
+@contextmanager
+def profile_run(name: str, enabled: Optional[bool] = None, **options):
+    """
+    Profile the enclosed block when enabled (default: the PROFILE setting) and write the
+    reports on exit, also when the block raises. Yields a ProfileReport filled in on exit,
+    or None when profiling is off.
+    """
+    if not (profiling_enabled() if enabled is None else enabled):
+        yield None
+        return
+    profiler = RunProfiler(name, **options).start()
+    report = ProfileReport(name)
+    try:
+        yield report
+    finally:
+        result = profiler.stop()
+        report.paths, report.peak_bytes, report.elapsed = result.paths, result.peak_bytes, result.elapsed
+        print(f"Profile '{name}': {result.summary()} -> {os.path.dirname(result.paths[0])}")
@@ -1,16 +1,76 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
-from app.db.schema import Instrument, Bar
+from typing import Callable, Dict, List, Sequence
+from app.db.schema import Instrument, Bar, BarBatch
+
+class ProviderError(Exception):
+    """Upstream data source failed (network error, throttling, or an implausibly empty response)."""
+
+
+class EmptyResponseError(ProviderError):
+    """
+    Upstream answered without an error but returned nothing for a whole group of tickers.
+    Worth a retry, but not evidence of throttling, so rate limiters should not back off on it.
+    """
+
 
 class DataProvider(ABC):
-    
+
     @abstractmethod
     def get_instruments(self) -> List[Instrument]:
         """Fetch list of available instruments."""
         pass
-    
+
     @abstractmethod
     def fetch_bars(self, ticker: str, start: datetime, end: datetime) -> List[Bar]:
         """Fetch historical bars for a given ticker."""
         pass
+
+    def fetch_bar_docs(self, ticker: str, start: datetime, end: datetime) -> List[dict]:
+        """Fetch historical bars as Mongo-ready documents. Override to skip Bar construction."""
+        return [bar.model_dump(by_alias=True) for bar in self.fetch_bars(ticker, start, end)]
+
+    def fetch_batch(self, ticker: str, start: datetime, end: datetime) -> BarBatch:
+        """Fetch historical bars as a columnar BarBatch. Override to skip per-bar documents."""
+        return BarBatch.from_docs(self.fetch_bar_docs(ticker, start, end), ticker=ticker)
+
+    def fetch_bars_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                        chunk_size: int = 50, max_workers: int = 4) -> Dict[str, List[Bar]]:
+        """
+        Fetch historical bars for many tickers.
+        Tickers are split into chunks of chunk_size, and at most max_workers chunks run at once.
+        Returns a dict ticker -> bars (empty list if nothing was found).
+        """
+        def fetch_chunk(chunk: List[str]) -> Dict[str, List[Bar]]:
+            return {t: self.fetch_bars(t, start, end) for t in chunk}
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
+
+    def fetch_bar_docs_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                            chunk_size: int = 50, max_workers: int = 4) -> Dict[str, List[dict]]:
+        """Same as fetch_bars_many, returning Mongo-ready documents."""
+        def fetch_chunk(chunk: List[str]) -> Dict[str, List[dict]]:
+            return {t: self.fetch_bar_docs(t, start, end) for t in chunk}
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
+
+    def fetch_batches_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                           chunk_size: int = 50, max_workers: int = 4) -> Dict[str, BarBatch]:
+        """Same as fetch_bars_many, returning one BarBatch per ticker."""
+        def fetch_chunk(chunk: List[str]) -> Dict[str, BarBatch]:
+            return {t: self.fetch_batch(t, start, end) for t in chunk}
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
+
+    @staticmethod
+    def _run_chunked(fetch_chunk: Callable[[List[str]], Dict[str, list]], tickers: Sequence[str],
+                     chunk_size: int, max_workers: int) -> Dict[str, list]:
+        tickers = list(dict.fromkeys(tickers))  # de-duplicate, keep order
+        chunk_size = max(1, chunk_size)
+        chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+        results: Dict[str, list] = {}
+        if not chunks:
+            return results
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+            for chunk_result in pool.map(fetch_chunk, chunks):
+                results.update(chunk_result)
+        return results
@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import pandas as pd
+
+from app.providers.base import DataProvider
+from app.db.coverage import DayRange, merge_ranges, subtract_ranges
+from app.providers.yahoo import docs_to_frame, frame_to_bars, frame_to_docs
+from app.db.schema import Instrument, Bar, BarBatch
+from app.instrumentation import count, timed
+
+
+def _day(dt: datetime) -> datetime:
+    """Floor to midnight and drop tz: the cache works in whole exchange days."""
+    return datetime(dt.year, dt.month, dt.day)
+
+
+class CachingProvider(DataProvider):
+    """
+    Read-through bar cache around another DataProvider.
+
+    Bars are kept as one Parquet partition per ticker under cache_dir, next to a
+    coverage index (coverage.json) recording which day ranges have been fetched.
+    Requests only go upstream for the ranges the index does not cover yet.
+    Today's bar is never marked as covered, since it may still be forming, and neither
+    is anything after the last bar an upstream answer contained.
+    """
+
+    def __init__(self, upstream: DataProvider, cache_dir: str):
+        self.upstream = upstream
+        self.source = getattr(upstream, "source", "cache")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.cache_dir / "coverage.json"
+        self._lock = threading.RLock()
+        self._coverage: Dict[str, List[DayRange]] = self._load_index()
+
+    # --- Coverage index ---
+
+    def _load_index(self) -> Dict[str, List[DayRange]]:
+        if not self._index_path.exists():
+            return {}
+        try:
+            raw = json.loads(self._index_path.read_text())
+        except (OSError, ValueError):
+            # Corrupt index: forget coverage, partitions get refreshed on next read
+            return {}
+        return {
+            ticker: [(datetime.fromisoformat(s), datetime.fromisoformat(e)) for s, e in ranges]
+            for ticker, ranges in raw.items()
+        }
+
+    def _save_index(self):
+        raw = {
+            ticker: [[s.isoformat(), e.isoformat()] for s, e in ranges]
+            for ticker, ranges in self._coverage.items()
+        }
+        self._atomic_write(self._index_path, lambda path: path.write_text(json.dumps(raw)))
+
+    def coverage(self, ticker: str) -> List[DayRange]:
+        with self._lock:
+            return list(self._coverage.get(ticker, []))
+
+    def missing(self, ticker: str, start: datetime, end: datetime) -> List[DayRange]:
+        """Day ranges within [start, end) that would have to be fetched upstream."""
+        want = (_day(start), _day(end))
+        if want[0] >= want[1]:
+            return []
+        return subtract_ranges(want, self.coverage(ticker))
+
+    # --- Partitions ---
+
+    def _partition_path(self, ticker: str) -> Path:
+        return self.cache_dir / f"{ticker}.parquet"
+
+    @staticmethod
+    def _atomic_write(path: Path, write):
+        # Write to a temp file and rename, so readers in other processes never see a partial file
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        write(tmp)
+        os.replace(tmp, path)
+
+    def _read_partition(self, ticker: str) -> pd.DataFrame:
+        path = self._partition_path(ticker)
+        if not path.exists():
+            return docs_to_frame([])
+        return pd.read_parquet(path)
+
+    def _store(self, ticker: str, fetched: pd.DataFrame, ranges: Sequence[DayRange]):
+        """
+        Merge freshly fetched bars into the partition and mark `ranges` as covered.
+        A range is only covered up to the last bar the upstream returned in it: an empty
+        answer may be a ticker dropped from a grouped download or a throttled call, so it
+        is never recorded as held and the range is asked for again next time.
+        """
+        with self._lock:
+            if not fetched.empty:
+                frame = pd.concat([self._read_partition(ticker), fetched])
+                frame = frame[~frame.index.duplicated(keep="last")].sort_index()
+                self._atomic_write(self._partition_path(ticker), lambda path: frame.to_parquet(path))
+
+            # The current day is still trading; leave it uncovered so it gets refetched
+            today = _day(datetime.utcnow())
+            covered = []
+            for s, e in ranges:
+                returned = fetched.index[(fetched.index >= s) & (fetched.index < e)]
+                if returned.empty:
+                    continue
+                e = min(e, _day(returned.max()) + timedelta(days=1), today)
+                if s < e:
+                    covered.append((s, e))
+            if covered:
+                self._coverage[ticker] = merge_ranges(self._coverage.get(ticker, []) + covered)
+                self._save_index()
+
+    @timed("provider.cache.read")
+    def _read_range(self, ticker: str, start: datetime, end: datetime) -> pd.DataFrame:
+        with self._lock:
+            frame = self._read_partition(ticker)
+        return frame[(frame.index >= _day(start)) & (frame.index < _day(end))]
+
+    # --- DataProvider interface ---
+
+    def get_instruments(self) -> List[Instrument]:
+        return self.upstream.get_instruments()
+
+    def _fill(self, tickers: List[str], start: datetime, end: datetime, chunk_size: int, max_workers: int):
+        """Fetch whatever the cache is missing for [start, end) and store it."""
+        # Group tickers by identical missing range so the upstream can batch them
+        plan: Dict[DayRange, List[str]] = defaultdict(list)
+        for ticker in tickers:
+            for rng in self.missing(ticker, start, end):
+                plan[rng].append(ticker)
+
+        count("provider.cache.requested_tickers", len(tickers))
+        count("provider.cache.upstream_ranges", sum(len(group) for group in plan.values()))
+        for (range_start, range_end), group in plan.items():
+            fetched = self.upstream.fetch_batches_many(
+                group, range_start, range_end, chunk_size=chunk_size, max_workers=max_workers
+            )
+            for ticker in group:
+                batch = fetched.get(ticker)
+                frame = batch.to_frame() if batch is not None else docs_to_frame([])
+                self._store(ticker, frame, [(range_start, range_end)])
+
+    def fetch_batches_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                           chunk_size: int = 50, max_workers: int = 4) -> Dict[str, BarBatch]:
+        tickers = list(dict.fromkeys(tickers))
+        self._fill(tickers, start, end, chunk_size, max_workers)
+        return {
+            ticker: BarBatch.from_frame(self._read_range(ticker, start, end), ticker, source=self.source)
+            for ticker in tickers
+        }
+
+    def fetch_batch(self, ticker: str, start: datetime, end: datetime) -> BarBatch:
+        return self.fetch_batches_many([ticker], start, end)[ticker]
+
+    def fetch_bar_docs_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                            chunk_size: int = 50, max_workers: int = 4) -> Dict[str, List[dict]]:
+        tickers = list(dict.fromkeys(tickers))
+        self._fill(tickers, start, end, chunk_size, max_workers)
+        return {
+            ticker: frame_to_docs(self._read_range(ticker, start, end), ticker, source=self.source)
+            for ticker in tickers
+        }
+
+    def fetch_bar_docs(self, ticker: str, start: datetime, end: datetime) -> List[dict]:
+        return self.fetch_bar_docs_many([ticker], start, end)[ticker]
+
+    def fetch_bars(self, ticker: str, start: datetime, end: datetime) -> List[Bar]:
+        self._fill([ticker], start, end, 50, 1)
+        return frame_to_bars(self._read_range(ticker, start, end), ticker, source=self.source)
+
+    def fetch_bars_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                        chunk_size: int = 50, max_workers: int = 4) -> Dict[str, List[Bar]]:
+        self._fill(list(dict.fromkeys(tickers)), start, end, chunk_size, max_workers)
+        return {
+            ticker: frame_to_bars(self._read_range(ticker, start, end), ticker, source=self.source)
+            for ticker in dict.fromkeys(tickers)
+        }
@@ -1,95 +1,67 @@
-import asyncio
-import pandas as pd
 from datetime import datetime
-from typing import List, Optional
-import yfinance as yf
-from motor.motor_asyncio import AsyncIOMotorClient
+from typing import Dict, List, Optional, Sequence
 from app.db.mongo import settings
-from app.db.schema import Instrument, Bar
+from app.db.panel import Panel, PanelBuilder
+from app.db.repository import get_repository
+from app.db.schema import Instrument, Bar, BarBatch
+from app.providers.yahoo import YahooProvider
+from app.providers.cache import CachingProvider
+from app.providers.ratelimit import RateLimitedProvider, yahoo_bucket
 
-async def check_mongo_connection() -> bool:
-    """Check if MongoDB is reachable."""
-    try:
-        client = AsyncIOMotorClient(settings.MONGO_URI, serverSelectionTimeoutMS=2000)
-        await client.admin.command('ping')
-        client.close()
-        return True
-    except Exception:
-        return False
+def check_mongo_connection() -> bool:
+    """Check if MongoDB is reachable (over the shared connection pool)."""
+    return get_repository().ping()
+
+# Same download/parse path as the backfill, tagged as a direct fetch.
+# auto_adjust=True: close is split/dividend adjusted, adj_close mirrors it.
+_direct_provider = RateLimitedProvider(
+    YahooProvider(source="yahoo_direct", auto_adjust=True, verbose=False),
+    yahoo_bucket(),
+    retries=settings.YAHOO_RETRIES,
+)
+if settings.BAR_CACHE_DIR:
+    # Read-through Parquet cache: repeat sessions and restarts only fetch ranges not seen yet
+    _direct_provider = CachingProvider(_direct_provider, settings.BAR_CACHE_DIR)
 
 def fetch_bars_direct(ticker: str, start: datetime, end: datetime) -> List[Bar]:
     """Fetch bars directly from Yahoo Finance without DB."""
-    # Convert ticker format (SH -> SS for Yahoo)
-    y_ticker = ticker.replace(".SH", ".SS") if ticker.endswith(".SH") else ticker
-    
-    df = yf.download(y_ticker, start=start.strftime("%Y-%m-%d"), end=end.strftime("%Y-%m-%d"), progress=False)
-    
-    if df.empty:
-        return []
-    
-    # yfinance often returns MultiIndex columns even for single tickers
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = df.columns.get_level_values(0)
-        
-    df = df.reset_index()
-    bars = []
-    for _, row in df.iterrows():
-        try:
-            # Handle potential MultiIndex/Series from yfinance
-            def get_val(col, default_col=None):
-                if col not in row and default_col in row:
-                    col = default_col
-                if col not in row:
-                    return 0.0
-                val = row[col]
-                return float(val.iloc[0]) if isinstance(val, pd.Series) else float(val)
+    return _direct_provider.fetch_bars(ticker, start, end)
+
+def fetch_bar_docs_direct(ticker: str, start: datetime, end: datetime) -> List[dict]:
+    """Fetch bars directly from Yahoo Finance as plain dicts (same shape as Bar.model_dump(by_alias=True))."""
+    return _direct_provider.fetch_bar_docs(ticker, start, end)
 
-            d = row['Date'].iloc[0] if isinstance(row['Date'], pd.Series) else row['Date']
-            d = d.to_pydatetime()
-            
-            bars.append(Bar(
-                _id=f"{ticker}:{d.strftime('%Y-%m-%d')}",
-                ticker=ticker,
-                exchange="SSE",
-                date=d,
-                open=get_val('Open'),
-                high=get_val('High'),
-                low=get_val('Low'),
-                close=get_val('Close'),
-                adj_close=get_val('Adj Close', 'Close'),
-                volume=get_val('Volume'),
-                source="yahoo_direct"
-            ))
-        except Exception:
-            continue
-    return bars
+def fetch_bar_docs_direct_many(tickers: List[str], start: datetime, end: datetime,
+                               chunk_size: int = 50, max_workers: int = 4) -> List[dict]:
+    """Fetch many tickers directly from Yahoo Finance with grouped downloads. Returns a flat list of bar dicts."""
+    docs_by_ticker = _direct_provider.fetch_bar_docs_many(tickers, start, end, chunk_size=chunk_size, max_workers=max_workers)
+    return [doc for t in tickers for doc in docs_by_ticker.get(t, [])]
 
-async def get_fallback_instruments() -> List[Instrument]:
+def fetch_batches_direct_many(tickers: List[str], start: datetime, end: datetime,
+                              chunk_size: int = 50, max_workers: int = 4) -> Dict[str, BarBatch]:
+    """Fetch many tickers directly from Yahoo Finance as columnar BarBatches (ticker -> batch)."""
+    return _direct_provider.fetch_batches_many(tickers, start, end, chunk_size=chunk_size, max_workers=max_workers)
+
+def fetch_panel_direct(tickers: List[str], start: datetime, end: datetime,
+                       fields: Sequence[str] = ("close",)) -> Panel:
+    """Date x ticker panel for a small demo universe, fetched directly from Yahoo Finance."""
+    # Grouped yf.download calls instead of one request per ticker
+    batches = fetch_batches_direct_many(tickers, start, end, chunk_size=10, max_workers=3)
+    builder = PanelBuilder(fields)
+    for batch in batches.values():
+        builder.add_batch(batch)
+    return builder.build()
+
+def get_fallback_instruments() -> List[Instrument]:
     """Return a hardcoded sample universe if DB is down."""
     from scripts.load_instruments import STOCK_CONNECT_SSE_SAMPLE
     return [
         Instrument(ticker=t, exchange="SSE", is_active=True, source="hardcoded_fallback")
         for t in STOCK_CONNECT_SSE_SAMPLE[:100] # Use top 100 for demo
     ]
-async def get_db_overall_range() -> dict:
+def get_db_overall_range() -> Optional[dict]:
     """Get the min and max date available in the entire database."""
     try:
-        client = AsyncIOMotorClient(settings.MONGO_URI, serverSelectionTimeoutMS=2000)
-        db = client[settings.MONGO_DB_NAME]
-        coll = db["bars_daily"]
-        
-        pipeline = [
-            {"$group": {
-                "_id": None,
-                "min_date": {"$min": "$date"},
-                "max_date": {"$max": "$date"}
-            }}
-        ]
-        result = await coll.aggregate(pipeline).to_list(length=1)
-        client.close()
-        
-        if result and result[0]["min_date"]:
-            return result[0]
-        return None
+        return get_repository().date_range()
     except Exception:
         return None
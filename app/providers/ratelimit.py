@@ -0,0 +1,196 @@
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+from app.providers.base import DataProvider, EmptyResponseError
+from app.db.mongo import settings
+from app.db.schema import Instrument, Bar, BarBatch
+from app.instrumentation import count, timed
+
+try:
+    import fcntl
+except ImportError:  # Windows: the bucket is still shared across threads, not processes
+    fcntl = None
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter, safe across threads.
+
+    With state_path set, the bucket state lives in a small JSON file guarded by an
+    exclusive flock, so every process pointing at the same file (backfill, dashboard,
+    API workers) draws from one budget.
+
+    The refill rate adapts AIMD-style: penalize() halves it after a throttle/failure,
+    reward() creeps it back up towards max_rate, so callers settle near the highest
+    rate the upstream tolerates.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, state_path: Optional[str] = None,
+                 min_rate: Optional[float] = None):
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.capacity = capacity or max(1.0, rate)
+        self.state_path = state_path if fcntl else None
+        self._lock = threading.Lock()
+        self._state = {"tokens": self.capacity, "ts": time.time(), "rate": rate}
+        if self.state_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+
+    def _update(self, fn: Callable[[dict], float]) -> float:
+        """Apply fn to the refilled state under both the thread and file locks."""
+        with self._lock:
+            if not self.state_path:
+                return self._apply(self._state, fn)
+
+            with open(self.state_path, "a+") as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    fh.seek(0)
+                    try:
+                        state = json.loads(fh.read() or "null") or dict(self._state)
+                    except ValueError:
+                        state = dict(self._state)
+                    result = self._apply(state, fn)
+                    fh.seek(0)
+                    fh.truncate()
+                    fh.write(json.dumps(state))
+                    fh.flush()
+                    return result
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _apply(self, state: dict, fn: Callable[[dict], float]) -> float:
+        now = time.time()
+        state["rate"] = min(max(state.get("rate", self.max_rate), self.min_rate), self.max_rate)
+        state["tokens"] = min(self.capacity, state["tokens"] + (now - state["ts"]) * state["rate"])
+        state["ts"] = now
+        return fn(state)
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until `tokens` are available (capped at capacity), then take them."""
+        tokens = min(tokens, self.capacity)
+
+        def take(state: dict) -> float:
+            if state["tokens"] >= tokens:
+                state["tokens"] -= tokens
+                return 0.0
+            return (tokens - state["tokens"]) / state["rate"]
+
+        while True:
+            wait = self._update(take)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def penalize(self):
+        def halve(state: dict) -> float:
+            state["rate"] = max(self.min_rate, state["rate"] / 2)
+            return state["rate"]
+        return self._update(halve)
+
+    def reward(self, step: Optional[float] = None):
+        step = step if step is not None else self.max_rate / 20
+
+        def bump(state: dict) -> float:
+            state["rate"] = min(self.max_rate, state["rate"] + step)
+            return state["rate"]
+        return self._update(bump)
+
+    @property
+    def rate(self) -> float:
+        return self._update(lambda state: state["rate"])
+
+
+def yahoo_bucket() -> TokenBucket:
+    """The Yahoo request budget configured in settings."""
+    return TokenBucket(settings.YAHOO_RATE_PER_SEC, settings.YAHOO_BURST, settings.YAHOO_RATE_STATE or None)
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 30.0) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(max_delay, base * 2^attempt)]."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class RateLimitedProvider(DataProvider):
+    """
+    Wraps a DataProvider with a shared TokenBucket and jittered exponential retries.
+
+    Every upstream call costs one token per ticker requested. A call that raises is
+    retried up to `retries` times, and slows the shared bucket down unless it merely came
+    back empty (EmptyResponseError); on_retry(tickers, attempt, error) is invoked before
+    each retry so callers can count them. The last error is re-raised once retries
+    are exhausted, leaving requeue/drop decisions to the caller.
+    """
+
+    def __init__(self, upstream: DataProvider, bucket: TokenBucket, retries: int = 3,
+                 base_delay: float = 1.0, max_delay: float = 30.0,
+                 on_retry: Optional[Callable[[List[str], int, Exception], None]] = None):
+        self.upstream = upstream
+        self.source = getattr(upstream, "source", "yahoo")
+        self.bucket = bucket
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_retry = on_retry
+
+    def _call(self, tickers: List[str], fn: Callable, *args, **kwargs):
+        attempt = 0
+        while True:
+            with timed("provider.rate_limit_wait"):
+                self.bucket.acquire(len(tickers))
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                # Back off globally: every thread/process sharing the bucket slows down.
+                # An empty answer is not a throttling signal, so the shared rate is left alone.
+                if not isinstance(e, EmptyResponseError):
+                    self.bucket.penalize()
+                if attempt >= self.retries:
+                    count("provider.failed_calls")
+                    raise
+                count("provider.retries")
+                if self.on_retry:
+                    self.on_retry(tickers, attempt + 1, e)
+                time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                attempt += 1
+                continue
+            self.bucket.reward()
+            return result
+
+    def get_instruments(self) -> List[Instrument]:
+        return self.upstream.get_instruments()
+
+    def fetch_bars(self, ticker: str, start: datetime, end: datetime) -> List[Bar]:
+        return self._call([ticker], self.upstream.fetch_bars, ticker, start, end)
+
+    def fetch_bar_docs(self, ticker: str, start: datetime, end: datetime) -> List[dict]:
+        return self._call([ticker], self.upstream.fetch_bar_docs, ticker, start, end)
+
+    def fetch_batch(self, ticker: str, start: datetime, end: datetime) -> BarBatch:
+        return self._call([ticker], self.upstream.fetch_batch, ticker, start, end)
+
+    def fetch_bars_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                        chunk_size: int = 50, max_workers: int = 4) -> Dict[str, List[Bar]]:
+        def fetch_chunk(chunk: List[str]) -> Dict[str, List[Bar]]:
+            return self._call(chunk, self.upstream.fetch_bars_many, chunk, start, end,
+                              chunk_size=len(chunk), max_workers=1)
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
+
+    def fetch_bar_docs_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                            chunk_size: int = 50, max_workers: int = 4) -> Dict[str, List[dict]]:
+        def fetch_chunk(chunk: List[str]) -> Dict[str, List[dict]]:
+            return self._call(chunk, self.upstream.fetch_bar_docs_many, chunk, start, end,
+                              chunk_size=len(chunk), max_workers=1)
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
+
+    def fetch_batches_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                           chunk_size: int = 50, max_workers: int = 4) -> Dict[str, BarBatch]:
+        def fetch_chunk(chunk: List[str]) -> Dict[str, BarBatch]:
+            return self._call(chunk, self.upstream.fetch_batches_many, chunk, start, end,
+                              chunk_size=len(chunk), max_workers=1)
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
@@ -0,0 +1,187 @@
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.providers.base import DataProvider
+from app.providers.yahoo import frame_to_bars, frame_to_docs
+from app.db.schema import Instrument, Bar, BarBatch, BAR_FIELDS
+from app.instrumentation import timed
+
+# Independent random streams per component, so every array is prefix-stable:
+# extending the history never changes the bars already generated.
+_MARKET, _CLUSTERS, _ASSIGN = 0, 1, 2
+_PARAMS, _IDIO, _JUMP_AT, _JUMP_SIZE, _SUSP_AT, _SUSP_LEN, _INTRADAY, _VOLUME = range(8)
+
+
+def _naive(dt: datetime) -> pd.Timestamp:
+    ts = pd.Timestamp(dt)
+    return ts.tz_convert(None) if ts.tz is not None else ts
+
+
+class SyntheticProvider(DataProvider):
+    """
+    Deterministic, seeded OHLCV generator for offline scale testing.
+
+    Returns follow a factor model: market factor + one planted cluster factor per
+    stock + idiosyncratic noise with occasional jumps. Daily moves are capped at
+    +/- limit_pct (A-share price limits), and stocks are randomly suspended for a
+    few days at a time (no bars are emitted while suspended, the price is frozen).
+    The same (seed, start, n_tickers, n_clusters) always yields the same bars.
+    """
+
+    def __init__(self, n_tickers: int = 2000, n_clusters: int = 20, seed: int = 42,
+                 start: datetime = datetime(2016, 1, 1), end: Optional[datetime] = None,
+                 exchange: str = "SYN", limit_pct: float = 0.10,
+                 suspension_rate: float = 0.002, jump_rate: float = 0.01):
+        self.n_tickers = n_tickers
+        self.n_clusters = n_clusters
+        self.seed = seed
+        self.exchange = exchange
+        self.limit_pct = limit_pct
+        self.suspension_rate = suspension_rate
+        self.jump_rate = jump_rate
+        self.source = "synthetic"
+
+        end = end or datetime.utcnow()
+        self.dates = pd.bdate_range(start, end, name="date")
+
+        T = len(self.dates)
+        self._market = self._rng(_MARKET).standard_normal(T) * 0.012
+        self._cluster_factors = self._rng(_CLUSTERS).standard_normal((T, n_clusters)) * 0.010
+        # Planted cluster membership: shuffled so clusters don't line up with ticker order
+        self.cluster_of = self._rng(_ASSIGN).permutation(n_tickers) % n_clusters
+
+        self._frame = lru_cache(maxsize=512)(self._generate)
+
+    def _rng(self, *key: int) -> np.random.Generator:
+        return np.random.default_rng([self.seed, *key])
+
+    def _ticker_rng(self, idx: int, component: int) -> np.random.Generator:
+        # Offset by 16 so ticker streams never collide with the global ones
+        return self._rng(16 + idx, component)
+
+    # --- Tickers ---
+
+    def ticker(self, idx: int) -> str:
+        return f"SYN{idx:05d}.SH"
+
+    def index_of(self, ticker: str) -> Optional[int]:
+        if not (ticker.startswith("SYN") and ticker.endswith(".SH")):
+            return None
+        try:
+            idx = int(ticker[3:-3])
+        except ValueError:
+            return None
+        return idx if 0 <= idx < self.n_tickers else None
+
+    def true_clusters(self) -> Dict[int, List[str]]:
+        """Planted cluster id -> tickers, to score clustering output against."""
+        clusters: Dict[int, List[str]] = {}
+        for idx, c in enumerate(self.cluster_of):
+            clusters.setdefault(int(c), []).append(self.ticker(idx))
+        return clusters
+
+    # --- Generation ---
+
+    @timed("provider.synthetic.generate")
+    def _generate(self, idx: int) -> pd.DataFrame:
+        T = len(self.dates)
+        limit = self.limit_pct
+
+        beta, gamma, vol, log_p0, log_v0 = self._ticker_rng(idx, _PARAMS).random(5)
+        beta = 0.6 + 0.8 * beta
+        gamma = 0.5 + 1.0 * gamma
+        vol = 0.010 + 0.015 * vol
+
+        jumps = np.where(
+            self._ticker_rng(idx, _JUMP_AT).random(T) < self.jump_rate,
+            self._ticker_rng(idx, _JUMP_SIZE).standard_normal(T) * 0.08,
+            0.0,
+        )
+        ret = (
+            beta * self._market
+            + gamma * self._cluster_factors[:, self.cluster_of[idx]]
+            + vol * self._ticker_rng(idx, _IDIO).standard_normal(T)
+            + jumps
+        )
+        # Offset volatility drag so prices wander instead of decaying towards the 0.01 tick
+        ret += 0.5 * ((beta * 0.012) ** 2 + (gamma * 0.010) ** 2 + vol ** 2 + self.jump_rate * 0.08 ** 2)
+        # Price limits: large moves lock at limit-up / limit-down
+        ret = np.clip(ret, -limit, limit)
+
+        # Suspensions: geometric durations (mean ~5 days), price frozen meanwhile
+        suspended = np.zeros(T, dtype=bool)
+        starts = np.flatnonzero(self._ticker_rng(idx, _SUSP_AT).random(T) < self.suspension_rate)
+        lengths = self._ticker_rng(idx, _SUSP_LEN).geometric(0.2, size=T)
+        for t in starts:
+            suspended[t:t + lengths[t]] = True
+        ret[suspended] = 0.0
+
+        p0 = np.exp(np.log(3.0) + log_p0 * np.log(30.0))  # 3 .. 90 CNY
+        close = p0 * np.exp(np.cumsum(np.log1p(ret)))
+        prev_close = np.concatenate([[p0], close[:-1]])
+        up_limit = prev_close * (1 + limit)
+        down_limit = prev_close * (1 - limit)
+
+        noise = self._ticker_rng(idx, _INTRADAY).standard_normal((T, 3))
+        open_ = np.clip(prev_close * (1 + 0.3 * ret + 0.003 * noise[:, 0]), down_limit, up_limit)
+        high = np.minimum(np.maximum(open_, close) * (1 + 0.005 * np.abs(noise[:, 1])), up_limit)
+        low = np.maximum(np.minimum(open_, close) * (1 - 0.005 * np.abs(noise[:, 2])), down_limit)
+
+        # Locked limit days trade thin; normal days scale with the size of the move
+        locked = np.abs(ret) >= limit - 1e-12
+        v0 = np.exp(np.log(1e5) + log_v0 * np.log(1e3))  # 1e5 .. 1e8 shares
+        volume = v0 * np.exp(0.3 * self._ticker_rng(idx, _VOLUME).standard_normal(T)) * (1 + 10 * np.abs(ret))
+        volume = np.floor(np.where(locked, 0.3 * volume, volume))
+
+        frame = pd.DataFrame(
+            {
+                "open": open_,
+                "high": high,
+                "low": low,
+                "close": close,
+                "adj_close": close,
+                "volume": volume,
+            },
+            index=self.dates,
+        )[BAR_FIELDS]
+        return frame[~suspended]
+
+    def frame(self, ticker: str, start: datetime, end: datetime) -> pd.DataFrame:
+        """Normalized bar frame for [start, end), same shape as yahoo.normalize_frame."""
+        idx = self.index_of(ticker)
+        if idx is None:
+            return pd.DataFrame(columns=BAR_FIELDS, index=pd.DatetimeIndex([], name="date"), dtype="float64")
+        frame = self._frame(idx)
+        return frame[(frame.index >= _naive(start)) & (frame.index < _naive(end))]
+
+    def panel(self, start: datetime, end: datetime, field: str = "close",
+              tickers: Optional[List[str]] = None) -> pd.DataFrame:
+        """Date x ticker matrix for one field (NaN on suspended days), skipping the bar documents."""
+        tickers = tickers or [self.ticker(i) for i in range(self.n_tickers)]
+        dates = self.dates[(self.dates >= _naive(start)) & (self.dates < _naive(end))]
+        values = np.full((len(dates), len(tickers)), np.nan)
+        for j, ticker in enumerate(tickers):
+            col = self.frame(ticker, start, end)[field]
+            values[dates.get_indexer(col.index), j] = col.to_numpy()
+        return pd.DataFrame(values, index=dates, columns=tickers)
+
+    # --- DataProvider interface ---
+
+    def get_instruments(self) -> List[Instrument]:
+        return [
+            Instrument(ticker=self.ticker(i), exchange=self.exchange, name=f"Synthetic {i}", source=self.source)
+            for i in range(self.n_tickers)
+        ]
+
+    def fetch_bar_docs(self, ticker: str, start: datetime, end: datetime) -> List[dict]:
+        return frame_to_docs(self.frame(ticker, start, end), ticker, exchange=self.exchange, source=self.source)
+
+    def fetch_bars(self, ticker: str, start: datetime, end: datetime) -> List[Bar]:
+        return frame_to_bars(self.frame(ticker, start, end), ticker, exchange=self.exchange, source=self.source)
+
+    def fetch_batch(self, ticker: str, start: datetime, end: datetime) -> BarBatch:
+        return BarBatch.from_frame(self.frame(ticker, start, end), ticker, exchange=self.exchange, source=self.source)
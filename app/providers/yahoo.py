@@ -1,95 +1,215 @@
 import yfinance as yf
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence
 import pandas as pd
-from app.providers.base import DataProvider
-from app.db.schema import Instrument, Bar
+from app.providers.base import DataProvider, EmptyResponseError, ProviderError
+from app.db.schema import Instrument, Bar, BarBatch, BAR_FIELDS
+from app.instrumentation import count, timed
+
+# yfinance column name -> Bar field
+YAHOO_COLUMNS = {
+    "Open": "open",
+    "High": "high",
+    "Low": "low",
+    "Close": "close",
+    "Adj Close": "adj_close",
+    "Volume": "volume",
+}
+
+# Substrings of yfinance's per-ticker error messages for throttled or failed requests,
+# as opposed to "possibly delisted; no price data found" for a genuinely empty range
+FAILURE_MARKERS = ("RateLimit", "Rate limited", "Too Many Requests", "timed out", "Connection")
+
+
+def to_yahoo_ticker(ticker: str) -> str:
+    """Convert Tushare-style tickers (600000.SH) to Yahoo format (600000.SS)."""
+    if ticker.endswith(".SH"):
+        return ticker.replace(".SH", ".SS")
+    # Yahoo uses .SZ for Shenzhen as well
+    return ticker
+
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalize a single-ticker yfinance frame in one pass.
+    Returns a float64 frame with BAR_FIELDS columns and a 'date' DatetimeIndex,
+    with non-trading (NaN) rows dropped.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=BAR_FIELDS, index=pd.DatetimeIndex([], name="date"), dtype="float64")
+
+    # yfinance often returns MultiIndex columns (Price, Ticker) even for single tickers
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.copy()
+        df.columns = df.columns.get_level_values(0)
+
+    df = df.rename(columns=YAHOO_COLUMNS)
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    # Some yf versions return rows with NaN if no trading
+    if "open" in df.columns:
+        df = df[df["open"].notna()]
+
+    out = pd.DataFrame(index=pd.DatetimeIndex(df.index, name="date"))
+    for field in BAR_FIELDS:
+        if field in df.columns:
+            out[field] = df[field]
+        elif field == "adj_close" and "close" in df.columns:
+            # auto_adjust=True drops 'Adj Close'; close is already adjusted
+            out[field] = df["close"]
+        else:
+            out[field] = 0.0
+    return out.astype("float64")
+
+
+def split_frame(df: pd.DataFrame, y_tickers: Sequence[str]) -> Dict[str, pd.DataFrame]:
+    """
+    Split a multi-ticker yfinance frame into one raw frame per Yahoo ticker.
+    Works for both group_by='ticker' (Ticker, Price) and the default (Price, Ticker) column layouts.
+    Tickers missing from the download map to an empty frame.
+    """
+    empty = pd.DataFrame()
+    if df.empty:
+        return {t: empty for t in y_tickers}
+
+    if not isinstance(df.columns, pd.MultiIndex):
+        # A single ticker can come back with flat columns
+        if len(y_tickers) == 1:
+            return {y_tickers[0]: df}
+        return {t: empty for t in y_tickers}
+
+    price_level = 0 if set(df.columns.get_level_values(0)) & set(YAHOO_COLUMNS) else 1
+    ticker_level = 1 - price_level
+    available = set(df.columns.get_level_values(ticker_level))
+
+    return {
+        t: (df.xs(t, axis=1, level=ticker_level) if t in available else empty)
+        for t in y_tickers
+    }
+
+
+def download_errors(y_tickers: Sequence[str]) -> Dict[str, str]:
+    """
+    Per-ticker errors yfinance recorded for the last download (it logs them instead of raising).
+    Best effort: the record is module-global, so concurrent downloads can overwrite it.
+    """
+    errors = getattr(getattr(yf, "shared", None), "_ERRORS", None) or {}
+    return {t: str(errors[t]) for t in y_tickers if t in errors}
+
+
+def frame_to_docs(frame: pd.DataFrame, ticker: str, exchange: str = "SSE", source: str = "yahoo") -> List[dict]:
+    """
+    Convert a normalized frame into Mongo-ready bar documents without per-row validation.
+    Keys and order match Bar.model_dump(by_alias=True).
+    """
+    return BarBatch.from_frame(frame, ticker, exchange, source).to_docs()
+
+
+def frame_to_bars(frame: pd.DataFrame, ticker: str, exchange: str = "SSE", source: str = "yahoo", validate: bool = False) -> List[Bar]:
+    """
+    Convert a normalized frame into Bar models.
+    Values are already float64 from normalize_frame, so validation is skipped unless requested.
+    """
+    return BarBatch.from_frame(frame, ticker, exchange, source).to_bars(validate)
+
+
+def docs_to_frame(docs: List[dict]) -> pd.DataFrame:
+    """Inverse of frame_to_docs: bar documents -> normalized float64 frame indexed by date."""
+    return BarBatch.from_docs(docs).to_frame()
+
 
 class YahooProvider(DataProvider):
-    
+
+    def __init__(self, source: str = "yahoo", auto_adjust: bool = False, verbose: bool = True):
+        self.source = source
+        self.auto_adjust = auto_adjust
+        self.verbose = verbose
+
     def get_instruments(self) -> List[Instrument]:
         # Yahoo doesn't have an API to list all tickers for an exchange easily.
         # This usually relies on an external list or the Stock Connect list provided in the MVP scaffold logic via scripts.
-        # We will return common SSE indices/stocks as a fallback or this might not be fully implemented here 
+        # We will return common SSE indices/stocks as a fallback or this might not be fully implemented here
         # but the load_instruments script handles the source.
         # For strict interface compliance, we return an empty list or a hardcoded example.
         # In reality, the script provided by the user (stub) loads from HKEX or manual list.
         return []
 
-    def fetch_bars(self, ticker: str, start: datetime, end: datetime) -> List[Bar]:
-        
+    def download(self, ticker: str, start: datetime, end: datetime) -> pd.DataFrame:
+        """Download and normalize bars for one ticker (see normalize_frame)."""
+        return self.download_many([ticker], start, end)[ticker]
+
+    @timed("provider.yahoo.download")
+    def download_many(self, tickers: Sequence[str], start: datetime, end: datetime) -> Dict[str, pd.DataFrame]:
+        """
+        Download a group of tickers with a single yf.download call and split the result per ticker.
+        Returns a dict ticker -> normalized frame (see normalize_frame).
+        """
         # Yahoo expects YYYY-MM-DD
         start_str = start.strftime("%Y-%m-%d")
         end_str = end.strftime("%Y-%m-%d")
-        
-        # yfinance download
+
         # Ticker format: 600000.SS for Shanghai in Yahoo.
         # User input might be 600000.SH (Tushare convention).
-        # We need to convert.
-        if ticker.endswith(".SH"):
-            y_ticker = ticker.replace(".SH", ".SS")
-        elif ticker.endswith(".SZ"):
-            y_ticker = ticker.replace(".SZ", ".SZ") # Yahoo uses .SZ for Shenzhen
-        else:
-            y_ticker = ticker
-            
-        print(f"Fetching {y_ticker} from {start_str} to {end_str} via Yahoo...")
-        df = yf.download(y_ticker, start=start_str, end=end_str, progress=False, auto_adjust=False)
-        
-        if df.empty:
-            print(f"No data found for {ticker}")
-            return []
-        
-        bars = []
-        # yfinance returns MultiIndex columns if multiple tickers, but here we ask for one.
-        # If the columns are tuples like ('Close', '600000.SS'), flatten or access properly.
-        # Recent yf versions might just be simple columns if single ticker.
-        
-        # Reset index to get Date as column
-        df = df.reset_index()
-        
-        for _, row in df.iterrows():
-            # Handle possible MultiIndex columns issue by checking simple access or .iloc
-            # With one ticker, it should be simple.
-            
-            # yfinance often returns numpy types, convert to python native
-            try:
-                # Basic normalization
-                if isinstance(row['Date'], pd.Series):
-                     d = row['Date'].iloc[0].to_pydatetime()
-                else:
-                     d = row['Date'].to_pydatetime()
-                # Some yf versions return rows with NaN if no trading.
-                # If 'Open' is a Series, check if all/any are NaN or just take the scalar.
-                val_to_check = row['Open'].iloc[0] if isinstance(row['Open'], pd.Series) else row['Open']
-                if pd.isna(val_to_check):
-                    continue
-                
-                # Handling multi-level if necessary, usually with one ticker it's fine.
-                # Just to be safe with yf versioning:
-                op = float(row['Open'].iloc[0]) if isinstance(row['Open'], pd.Series) else float(row['Open'])
-                hi = float(row['High'].iloc[0]) if isinstance(row['High'], pd.Series) else float(row['High'])
-                lo = float(row['Low'].iloc[0]) if isinstance(row['Low'], pd.Series) else float(row['Low'])
-                cl = float(row['Close'].iloc[0]) if isinstance(row['Close'], pd.Series) else float(row['Close'])
-                ac = float(row['Adj Close'].iloc[0]) if isinstance(row['Adj Close'], pd.Series) else float(row['Adj Close'])
-                vo = float(row['Volume'].iloc[0]) if isinstance(row['Volume'], pd.Series) else float(row['Volume'])
-                
-                bar = Bar(
-                    _id=f"{ticker}:{d.strftime('%Y-%m-%d')}",
-                    ticker=ticker,
-                    exchange="SSE",
-                    date=d,
-                    open=op,
-                    high=hi,
-                    low=lo,
-                    close=cl,
-                    adj_close=ac,
-                    volume=vo,
-                    source="yahoo"
-                )
-                bars.append(bar)
-            except Exception as e:
-                print(f"Error parsing row: {e}")
-                continue
-                
-        return bars
+        y_tickers = {t: to_yahoo_ticker(t) for t in tickers}
+
+        if self.verbose:
+            label = next(iter(y_tickers.values())) if len(y_tickers) == 1 else f"{len(y_tickers)} tickers"
+            print(f"Fetching {label} from {start_str} to {end_str} via Yahoo...")
+
+        # threads=False: parallelism is managed by fetch_bars_many, not by yfinance
+        df = yf.download(
+            list(y_tickers.values()), start=start_str, end=end_str,
+            progress=False, auto_adjust=self.auto_adjust, group_by="ticker", threads=False
+        )
+        raw = split_frame(df, list(y_tickers.values()))
+
+        frames = {}
+        for ticker, y_ticker in y_tickers.items():
+            frames[ticker] = normalize_frame(raw[y_ticker])
+            if frames[ticker].empty and self.verbose:
+                print(f"No data found for {ticker}")
+
+        # yfinance logs errors (incl. throttling) instead of raising: surface those as failed calls
+        count("provider.yahoo.tickers", len(frames))
+        failed = {t: e for t, e in download_errors(list(y_tickers.values())).items()
+                  if any(marker in e for marker in FAILURE_MARKERS)}
+        if failed:
+            raise ProviderError(f"Yahoo failed for {len(failed)} of {len(frames)} tickers: {next(iter(failed.values()))}")
+
+        # Nothing at all for a multi-ticker group over a week or more of trading days is
+        # implausible. A single ticker legitimately has no bars while suspended or before listing.
+        if (len(frames) > 1 and all(f.empty for f in frames.values())
+                and len(pd.bdate_range(start_str, end_str, inclusive="left")) >= 5):
+            raise EmptyResponseError(f"Yahoo returned no data for {len(frames)} tickers ({start_str} to {end_str})")
+        return frames
+
+    def fetch_bar_docs(self, ticker: str, start: datetime, end: datetime) -> List[dict]:
+        """Fetch bars as Mongo-ready documents, skipping Bar construction."""
+        return frame_to_docs(self.download(ticker, start, end), ticker, source=self.source)
+
+    def fetch_bars(self, ticker: str, start: datetime, end: datetime) -> List[Bar]:
+        return frame_to_bars(self.download(ticker, start, end), ticker, source=self.source)
+
+    def fetch_batch(self, ticker: str, start: datetime, end: datetime) -> BarBatch:
+        return BarBatch.from_frame(self.download(ticker, start, end), ticker, source=self.source)
+
+    def fetch_bars_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                        chunk_size: int = 50, max_workers: int = 4) -> Dict[str, List[Bar]]:
+        def fetch_chunk(chunk: List[str]) -> Dict[str, List[Bar]]:
+            frames = self.download_many(chunk, start, end)
+            return {t: frame_to_bars(f, t, source=self.source) for t, f in frames.items()}
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
+
+    def fetch_bar_docs_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                            chunk_size: int = 50, max_workers: int = 4) -> Dict[str, List[dict]]:
+        def fetch_chunk(chunk: List[str]) -> Dict[str, List[dict]]:
+            frames = self.download_many(chunk, start, end)
+            return {t: frame_to_docs(f, t, source=self.source) for t, f in frames.items()}
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
+
+    def fetch_batches_many(self, tickers: Sequence[str], start: datetime, end: datetime,
+                           chunk_size: int = 50, max_workers: int = 4) -> Dict[str, BarBatch]:
+        def fetch_chunk(chunk: List[str]) -> Dict[str, BarBatch]:
+            frames = self.download_many(chunk, start, end)
+            return {t: BarBatch.from_frame(f, t, source=self.source) for t, f in frames.items()}
+        return self._run_chunked(fetch_chunk, tickers, chunk_size, max_workers)
@@ -1,7 +1,6 @@
 import streamlit as st
 import sys
 import os
-import asyncio
 
 # Add root directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -24,14 +23,13 @@ Welcome to the Shanghai Stock Exchange Statistical Arbitrage Platform. This syst
 - **📊 Data Explorer**: View historical OHLCV data for SSE stocks.
 - **🧬 Clustering**: Analyze correlations and group stocks using Hierarchical or Spectral clustering.
 - **🧪 Backtest**: Run Mean-Reversion strategies on generated clusters.
+- **🗺️ Parameter Sweep**: Backtest a grid of clustering and signal parameters and compare them on a heatmap.
 
 ### 🛠 System Status
 """)
 
 # Quick connectivity check
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-db_available = loop.run_until_complete(check_mongo_connection())
+db_available = check_mongo_connection()
 
 # Sidebar Data Source Selection
 st.sidebar.markdown("### 🔌 Data Source")
@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-import asyncio
 from datetime import datetime, timedelta
 import sys
 import os
@@ -9,7 +8,10 @@ import os
 # Add root directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-from app.providers.fallback import check_mongo_connection, fetch_bars_direct, get_fallback_instruments, get_db_overall_range
+from app.providers.base import ProviderError
+from app.providers.fallback import check_mongo_connection, fetch_bar_docs_direct, get_fallback_instruments, get_db_overall_range
+from app.instrumentation import collect_timings
+from dashboard.resources import bar_repository, show_stage_timings
 
 st.set_page_config(page_title="Data Explorer", page_icon="🔍", layout="wide")
 
@@ -17,9 +19,7 @@ st.title("🔍 Data Explorer")
 
 # --- Fallback Check ---
 if "db_connected" not in st.session_state:
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    st.session_state["db_connected"] = loop.run_until_complete(check_mongo_connection())
+    st.session_state["db_connected"] = check_mongo_connection()
 
 if not st.session_state["db_connected"]:
     st.warning("⚠️ **Direct-Fetch Mode Active**: Data is being fetched directly from Yahoo Finance. No local database is being used.")
@@ -30,60 +30,21 @@ else:
 @st.cache_data(ttl=300)
 def load_instruments():
     if not st.session_state["db_connected"]:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        return loop.run_until_complete(get_fallback_instruments())
-        
-    async def _fetch():
-        from motor.motor_asyncio import AsyncIOMotorClient
-        from app.db.mongo import settings
-        
-        client = AsyncIOMotorClient(settings.MONGO_URI)
-        db = client[settings.MONGO_DB_NAME]
-        
-        coll = db["instruments"]
-        await coll.create_index("ticker", unique=True)
-        cursor = coll.find({"exchange": "SSE", "is_active": True})
-        
-        result = await cursor.to_list(length=None)
-        client.close()
-        return result
-    
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    return loop.run_until_complete(_fetch())
+        return get_fallback_instruments()
+    return bar_repository().instruments("SSE")
 
 @st.cache_data(ttl=60)
 def load_bars(ticker, start, end):
     if not st.session_state["db_connected"]:
         # Direct fetch from Yahoo
-        data = fetch_bars_direct(ticker, start, end)
+        data = fetch_bar_docs_direct(ticker, start, end)
         if data:
-            return pd.DataFrame([b.model_dump(by_alias=True) for b in data])
+            return pd.DataFrame(data)
         return pd.DataFrame()
 
-    async def _fetch():
-        from motor.motor_asyncio import AsyncIOMotorClient
-        from app.db.mongo import settings
-        
-        client = AsyncIOMotorClient(settings.MONGO_URI)
-        db = client[settings.MONGO_DB_NAME]
-        
-        coll = db["bars_daily"]
-        cursor = coll.find({
-            "ticker": ticker, 
-            "date": {"$gte": start, "$lte": end}
-        }).sort("date", 1)
-        
-        result = await cursor.to_list(length=None)
-        client.close()
-        return result
-    
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    data = loop.run_until_complete(_fetch())
+    data = bar_repository().bars(ticker, start, end, ["open", "high", "low", "close", "adj_close", "volume"])
     if data:
-        return pd.DataFrame([d for d in data])
+        return pd.DataFrame(data)
     return pd.DataFrame()
 
 # --- UI Controls ---
@@ -96,9 +57,7 @@ lookback_years = st.sidebar.selectbox(
 )
 
 if st.session_state["db_connected"]:
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    db_range = loop.run_until_complete(get_db_overall_range())
+    db_range = get_db_overall_range()
     if db_range:
         st.sidebar.caption(f"📦 **DB Coverage**: {db_range['min_date'].date()} to {db_range['max_date'].date()}")
     else:
@@ -121,30 +80,7 @@ def get_date_range(ticker, years):
             "max_date": datetime.utcnow()
         }
 
-    async def _fetch():
-        from motor.motor_asyncio import AsyncIOMotorClient
-        from app.db.mongo import settings
-        
-        client = AsyncIOMotorClient(settings.MONGO_URI)
-        db = client[settings.MONGO_DB_NAME]
-        coll = db["bars_daily"]
-        
-        # Get min and max date
-        pipeline = [
-            {"$match": {"ticker": ticker}},
-            {"$group": {
-                "_id": None,
-                "min_date": {"$min": "$date"},
-                "max_date": {"$max": "$date"}
-            }}
-        ]
-        result = await coll.aggregate(pipeline).to_list(length=1)
-        client.close()
-        return result[0] if result else None
-
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    return loop.run_until_complete(_fetch())
+    return bar_repository().date_range(ticker)
 
 col1, col2 = st.columns(2)
 
@@ -182,11 +118,16 @@ else:
 # --- Visualization ---
 
 if st.button("Load Data"):
+    run_timings = collect_timings()
     # Convert date to datetime
     start_dt = datetime.combine(start_date, datetime.min.time())
     end_dt = datetime.combine(end_date, datetime.max.time())
     
-    df = load_bars(ticker, start_dt, end_dt)
+    try:
+        df = load_bars(ticker, start_dt, end_dt)
+    except ProviderError as e:
+        st.error(f"Yahoo Finance fetch failed after retries: {e}")
+        st.stop()
     
     if not df.empty:
         st.write(f"Loaded {len(df)} bars.")
@@ -211,3 +152,5 @@ if st.button("Load Data"):
             
     else:
         st.info("No data found for the selected range.")
+
+    show_stage_timings(run_timings)
@@ -1,8 +1,6 @@
 import streamlit as st
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import asyncio
 from datetime import datetime, timedelta
 import sys
 import os
@@ -10,7 +8,10 @@ import os
 # Add root directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-from app.providers.fallback import check_mongo_connection, fetch_bars_direct, get_fallback_instruments, get_db_overall_range
+from app.providers.base import ProviderError
+from app.providers.fallback import check_mongo_connection, fetch_panel_direct, get_fallback_instruments, get_db_overall_range
+from app.instrumentation import collect_timings
+from dashboard.resources import bar_repository, profile_toggle, profiled_run, show_stage_timings
 from app.analytics.clustering import calculate_log_returns, get_correlation_matrix, cluster_hierarchical, cluster_spectral
 
 st.set_page_config(page_title="Clustering Analysis", page_icon="🧬", layout="wide")
@@ -18,9 +19,7 @@ st.title("🧬 Clustering Analysis")
 
 # --- Fallback Check ---
 if "db_connected" not in st.session_state:
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    st.session_state["db_connected"] = loop.run_until_complete(check_mongo_connection())
+    st.session_state["db_connected"] = check_mongo_connection()
 
 if not st.session_state["db_connected"]:
     st.warning("⚠️ **Direct-Fetch Mode Active**: Data is being fetched directly from Yahoo Finance. **Note: This process is intensive and will take a few minutes.**")
@@ -32,46 +31,15 @@ else:
 def load_all_prices(exchange, start, end):
     if not st.session_state["db_connected"]:
         # Demo Mode: Use a subset of tickers and fetch directly
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        instruments = loop.run_until_complete(get_fallback_instruments())
+        instruments = get_fallback_instruments()
         tickers = [i.ticker for i in instruments][:30] # Limit to 30 for demo speed
-        
-        all_bars = []
-        progress_bar = st.progress(0, text="Fetching data from Yahoo Finance...")
-        for i, t in enumerate(tickers):
-            progress_bar.progress((i + 1) / len(tickers), text=f"Fetching {t} ({i+1}/{len(tickers)})")
-            bars = fetch_bars_direct(t, start, end)
-            all_bars.extend([b.model_dump(by_alias=True) for b in bars])
-        progress_bar.empty()
-        return tickers, all_bars
-
-    async def _fetch():
-        from motor.motor_asyncio import AsyncIOMotorClient
-        from app.db.mongo import settings
-
-        client = AsyncIOMotorClient(settings.MONGO_URI)
-        db = client[settings.MONGO_DB_NAME]
+        return tickers, fetch_panel_direct(tickers, start, end, ["close", "volume"]).frames()
 
-        # Find all tickers first
-        instruments = db["instruments"]
-        tickers_cursor = instruments.find({"exchange": exchange, "is_active": True})
-        tickers = [i["ticker"] for i in await tickers_cursor.to_list(length=None)]
-        
-        # Load bars
-        bars_coll = db["bars_daily"]
-        query = {
-            "exchange": exchange, 
-            "date": {"$gte": start, "$lte": end}
-        }
-        cursor = bars_coll.find(query)
-        data = await cursor.to_list(length=None)
-        client.close()
-        return tickers, data
-        
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    return loop.run_until_complete(_fetch())
+    repo = bar_repository()
+    tickers = [i["ticker"] for i in repo.instruments(exchange)]
+    # Only what the analysis needs: close for returns, volume for the heatmap ranking
+    panel = repo.panel(start, end, ["close", "volume"], exchange=exchange)
+    return tickers, panel.frames()
 
 # --- UI ---
 st.sidebar.markdown("### 📅 Time Range")
@@ -83,9 +51,7 @@ lookback_years = st.sidebar.selectbox(
 )
 
 if st.session_state["db_connected"]:
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    db_range = loop.run_until_complete(get_db_overall_range())
+    db_range = get_db_overall_range()
     if db_range:
         st.sidebar.caption(f"📦 **DB Coverage**: {db_range['min_date'].date()} to {db_range['max_date'].date()}")
     else:
@@ -107,22 +73,27 @@ with col3:
 
 num_clusters = st.slider("Number of Clusters", 2, 20, 5)
 
-if st.button("Run Clustering"):
+profile = profile_toggle()
+
+def run_clustering():
+    run_timings = collect_timings()
     with st.spinner("Loading data..."):
         start_dt = datetime.combine(start_date, datetime.min.time())
         end_dt = datetime.combine(end_date, datetime.max.time())
-        tickers, data = load_all_prices(exchange, start_dt, end_dt)
+        try:
+            tickers, panels = load_all_prices(exchange, start_dt, end_dt)
+        except ProviderError as e:
+            st.error(f"Yahoo Finance fetch failed after retries: {e}")
+            st.stop()
         
-        if not data:
+        if panels["close"].empty:
             st.error("No data found.")
             st.stop()
         
         st.warning("Note: Clustering is performed on ALL available stocks. The Heatmap below shows only the Top 50 by volume for readability.")
             
-        df_raw = pd.DataFrame(data)
-        # Pivot to Price Matrix (Date x Ticker)
-        prices = df_raw.pivot(index="date", columns="ticker", values="close")
-        prices = prices.sort_index()
+        # Price Matrix (Date x Ticker)
+        prices = panels["close"]
         
         # Handle missing data: ffill then clean drop
         prices = prices.ffill().dropna(axis=1, how='any') 
@@ -141,7 +112,7 @@ if st.button("Run Clustering"):
         st.subheader("Correlation Heatmap (Top 50 Active Stocks)")
         
         # Calculate volume just for ranking display
-        volumes = df_raw.pivot(index="date", columns="ticker", values="volume")
+        volumes = panels["volume"]
         avg_vol = volumes.mean().sort_values(ascending=False)
         # Intersection of valid prices and volume data
         valid_tickers = [t for t in avg_vol.index if t in corr_matrix.index]
@@ -165,3 +136,9 @@ if st.button("Run Clustering"):
         for c_id, members in clusters.items():
             st.markdown(f"**Cluster {c_id}** ({len(members)} assets)")
             st.code(", ".join(members))
+
+    show_stage_timings(run_timings)
+
+if st.button("Run Clustering"):
+    with profiled_run("clustering", profile):
+        run_clustering()
@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import asyncio
 from datetime import datetime, timedelta
 import sys
 import os
@@ -13,17 +12,19 @@ from app.db.mongo import db
 from app.analytics.clustering import calculate_log_returns, get_correlation_matrix, cluster_hierarchical, cluster_spectral
 from app.analytics.strategy import calculate_cluster_returns, calculate_residuals, calculate_z_scores, generate_signals
 from app.analytics.backtest import run_backtest
+from app.analytics.walkforward import membership_clusters, walk_forward_clusters
 
-from app.providers.fallback import check_mongo_connection, fetch_bars_direct, get_fallback_instruments, get_db_overall_range
+from app.providers.base import ProviderError
+from app.providers.fallback import check_mongo_connection, fetch_panel_direct, get_fallback_instruments, get_db_overall_range
+from app.instrumentation import collect_timings
+from dashboard.resources import bar_repository, profile_toggle, profiled_run, show_stage_timings
 
 st.set_page_config(page_title="Backtest", page_icon="🧪", layout="wide")
 st.title("🧪 Strategy Backtest")
 
 # --- Fallback Check ---
 if "db_connected" not in st.session_state:
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    st.session_state["db_connected"] = loop.run_until_complete(check_mongo_connection())
+    st.session_state["db_connected"] = check_mongo_connection()
 
 if not st.session_state["db_connected"]:
     st.warning("⚠️ **Direct-Fetch Mode Active**: Data is being fetched directly from Yahoo Finance. **Note: Backtest will be limited to a sample of 30 stocks for speed.**")
@@ -35,40 +36,11 @@ else:
 def load_data_for_backtest(exchange, start, end):
     if not st.session_state["db_connected"]:
         # Demo Mode: Sample 30 stocks
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        instruments = loop.run_until_complete(get_fallback_instruments())
+        instruments = get_fallback_instruments()
         tickers = [i.ticker for i in instruments][:30]
-        
-        all_bars = []
-        progress_bar = st.progress(0, text="Fetching backtest data from Yahoo...")
-        for i, t in enumerate(tickers):
-            progress_bar.progress((i + 1) / len(tickers), text=f"Fetching {t} ({i+1}/{len(tickers)})")
-            bars = fetch_bars_direct(t, start, end)
-            all_bars.extend([b.model_dump(by_alias=True) for b in bars])
-        progress_bar.empty()
-        return all_bars
-
-    async def _fetch():
-        from motor.motor_asyncio import AsyncIOMotorClient
-        from app.db.mongo import settings
-
-        client = AsyncIOMotorClient(settings.MONGO_URI)
-        db = client[settings.MONGO_DB_NAME]
-        
-        bars_coll = db["bars_daily"]
-        query = {
-            "exchange": exchange, 
-            "date": {"$gte": start, "$lte": end}
-        }
-        cursor = bars_coll.find(query)
-        data = await cursor.to_list(length=None)
-        client.close()
-        return data
-        
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    return loop.run_until_complete(_fetch())
+        return fetch_panel_direct(tickers, start, end).frame("close")
+
+    return bar_repository().panel(start, end, ["close"], exchange=exchange).frame("close")
 
 # --- Parameters ---
 with st.sidebar:
@@ -83,9 +55,7 @@ with st.sidebar:
     )
     
     if st.session_state["db_connected"]:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        db_range = loop.run_until_complete(get_db_overall_range())
+        db_range = get_db_overall_range()
         if db_range:
             st.sidebar.caption(f"📦 **DB Coverage**: {db_range['min_date'].date()} to {db_range['max_date'].date()}")
         else:
@@ -97,45 +67,60 @@ with st.sidebar:
     st.subheader("Clustering")
     method = st.selectbox("Method", ["Hierarchical", "Spectral"])
     num_clusters = st.slider("Num Clusters", 2, 20, 5)
+    fit_mode = st.radio("Fit", ["Walk-forward", "Full sample"],
+                        help="Walk-forward fits on a trailing window and trades out of sample. "
+                             "Full sample fits once on all dates (lookahead bias).")
+    if fit_mode == "Walk-forward":
+        train_window = st.slider("Training Window (days)", 60, 504, 252)
+        refit_every = st.slider("Refit Every (days)", 5, 126, 21)
     
     st.subheader("Strategy")
     lookback = st.slider("Z-Score Lookback", 5, 252, 60)
     entry_threshold = st.slider("Entry Threshold (Z)", 0.5, 3.0, 2.0)
     st.info("💡 **Why 2.0?** A Z-score of 2.0 represents a 95% statistical outlier. This ensures you trade significant divergences, reducing noise and transaction costs.")
 
-if st.button("Run Backtest"):
+profile = profile_toggle()
+
+def run_backtest_page():
+    run_timings = collect_timings()
     # 1. Load Data
     start_dt = datetime.combine(start_date, datetime.min.time())
     end_dt = datetime.combine(end_date, datetime.max.time())
     
     with st.spinner("Loading data..."):
-        data = load_data_for_backtest("SSE", start_dt, end_dt)
-        if not data:
+        try:
+            prices = load_data_for_backtest("SSE", start_dt, end_dt)
+        except ProviderError as e:
+            st.error(f"Yahoo Finance fetch failed after retries: {e}")
+            st.stop()
+        if prices.empty:
             st.error("No data found.")
             st.stop()
             
-        df_raw = pd.DataFrame(data)
-        prices = df_raw.pivot(index="date", columns="ticker", values="close").sort_index().ffill().dropna(axis=1)
+        prices = prices.ffill().dropna(axis=1)
         
         if prices.empty:
             st.error("Not enough valid data.")
             st.stop()
             
-    # 2. Train Clustering (Rolling? Or Static?)
-    # MVP: Static clustering based on first half or whole period? 
-    # Spec implies: "Given the cluster... devise strategy". 
-    # Usually clustering is recomputed. For MVP, let's compute on entire dataset (lookahead bias warning, but simpler)
-    # OR better: Compute clustering on first N days? 
-    # Let's Stick to "Compute on Whole" for MVP simplicity, noting the bias.
-    
+    # 2. Train Clustering
+    # Walk-forward: membership changes at each refit and is only known out of sample.
+    # Full sample: one static fit on every date (lookahead bias, kept for comparison).
     with st.spinner("Clustering..."):
         returns = calculate_log_returns(prices)
-        corr_matrix = get_correlation_matrix(returns)
-        
-        if method == "Hierarchical":
-            clusters = cluster_hierarchical(corr_matrix, num_clusters)
+
+        if fit_mode == "Walk-forward":
+            if len(returns) <= train_window:
+                st.error("The date range is shorter than the training window.")
+                st.stop()
+            clusters = walk_forward_clusters(returns, method, num_clusters, train_window, refit_every)
         else:
-            clusters = cluster_spectral(corr_matrix, num_clusters)
+            corr_matrix = get_correlation_matrix(returns)
+
+            if method == "Hierarchical":
+                clusters = cluster_hierarchical(corr_matrix, num_clusters)
+            else:
+                clusters = cluster_spectral(corr_matrix, num_clusters)
             
     # 3. Strategy
     with st.spinner("Simulating Strategy..."):
@@ -168,5 +153,17 @@ if st.button("Run Backtest"):
     col4.metric("Avg Daily Turnover", f"{metrics['Daily Turnover']:.4f}")
     
     with st.expander("Clustering Details"):
-        for c_id, members in clusters.items():
+        if isinstance(clusters, pd.DataFrame):
+            n_fits = -(-(len(returns) - train_window) // refit_every)
+            st.caption(f"{n_fits} walk-forward fits; clusters in force on the last date:")
+            static_clusters = membership_clusters(clusters)
+        else:
+            static_clusters = clusters
+        for c_id, members in static_clusters.items():
             st.write(f"Cluster {c_id}: {members}")
+
+    show_stage_timings(run_timings)
+
+if st.button("Run Backtest"):
+    with profiled_run("backtest", profile):
+        run_backtest_page()
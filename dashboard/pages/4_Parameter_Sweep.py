@@ -0,0 +1,134 @@
+import streamlit as st
+import plotly.express as px
+from datetime import datetime, timedelta
+import sys
+import os
+
+# Add root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from app.analytics.sweep import GRID_COLUMNS, run_sweep, sweep_heatmap
+
+from app.providers.base import ProviderError
+from app.providers.fallback import check_mongo_connection, fetch_panel_direct, get_fallback_instruments, get_db_overall_range
+from app.instrumentation import collect_timings
+from dashboard.resources import bar_repository, profile_toggle, profiled_run, show_stage_timings, sweep_cache
+
+st.set_page_config(page_title="Parameter Sweep", page_icon="🗺️", layout="wide")
+st.title("🗺️ Parameter Sweep")
+
+# --- Fallback Check ---
+if "db_connected" not in st.session_state:
+    st.session_state["db_connected"] = check_mongo_connection()
+
+if not st.session_state["db_connected"]:
+    st.warning("⚠️ **Direct-Fetch Mode Active**: Data is being fetched directly from Yahoo Finance. **Note: The sweep will be limited to a sample of 30 stocks for speed.**")
+else:
+    st.success("✅ **Local Database Mode Active**: Data is being served from MongoDB.")
+
+METRICS = ["Sharpe Ratio", "Total Return", "Annualized Return", "Max Drawdown", "Daily Turnover"]
+
+# --- Helper ---
+@st.cache_data(ttl=300)
+def load_data_for_sweep(exchange, start, end):
+    if not st.session_state["db_connected"]:
+        # Demo Mode: Sample 30 stocks
+        instruments = get_fallback_instruments()
+        tickers = [i.ticker for i in instruments][:30]
+        return fetch_panel_direct(tickers, start, end).frame("close")
+
+    return bar_repository().panel(start, end, ["close"], exchange=exchange).frame("close")
+
+# --- Parameters ---
+with st.sidebar:
+    st.header("Settings")
+
+    st.subheader("Data")
+    lookback_years = st.selectbox("Lookback Years", options=list(range(1, 9)), index=1)
+
+    if st.session_state["db_connected"]:
+        db_range = get_db_overall_range()
+        if db_range:
+            st.sidebar.caption(f"📦 **DB Coverage**: {db_range['min_date'].date()} to {db_range['max_date'].date()}")
+        else:
+            st.sidebar.caption("📦 **DB Coverage**: No data found.")
+
+    start_date = st.date_input("Start Date", datetime.utcnow() - timedelta(days=365*lookback_years))
+    end_date = st.date_input("End Date", datetime.utcnow())
+
+    st.subheader("Grid")
+    methods = st.multiselect("Methods", ["Hierarchical", "Spectral"], default=["Hierarchical"])
+    num_clusters = st.multiselect("Num Clusters", list(range(2, 21)), default=[5, 10])
+    lookbacks = st.multiselect("Z-Score Lookbacks", [5, 10, 20, 40, 60, 90, 120, 180, 252], default=[20, 60, 120])
+    entry_thresholds = st.multiselect("Entry Thresholds (Z)", [0.5, 1.0, 1.5, 2.0, 2.5, 3.0], default=[1.0, 1.5, 2.0, 2.5])
+
+    walk_forward = st.checkbox("Walk-forward clustering", value=False,
+                               help="Fit clusters on a trailing window and refit periodically instead of once on the full sample.")
+    if walk_forward:
+        train_window = st.slider("Training Window (days)", 60, 504, 252)
+        refit_every = st.slider("Refit Every (days)", 5, 126, 21)
+    else:
+        train_window, refit_every = None, 21
+
+profile = profile_toggle()
+
+n_cells = len(methods) * len(num_clusters) * len(lookbacks) * len(entry_thresholds)
+st.caption(f"{n_cells} parameter combinations. Returns, correlation and clusters are computed once per "
+           "distinct upstream setting and reused across thresholds, lookbacks and later sweeps.")
+
+if st.button("Run Sweep", disabled=n_cells == 0):
+    with profiled_run("sweep", profile):
+        run_timings = collect_timings()
+        start_dt = datetime.combine(start_date, datetime.min.time())
+        end_dt = datetime.combine(end_date, datetime.max.time())
+
+        with st.spinner("Loading data..."):
+            try:
+                prices = load_data_for_sweep("SSE", start_dt, end_dt)
+            except ProviderError as e:
+                st.error(f"Yahoo Finance fetch failed after retries: {e}")
+                st.stop()
+            prices = prices.ffill().dropna(axis=1)
+            if prices.empty:
+                st.error("Not enough valid data.")
+                st.stop()
+            if walk_forward and len(prices) <= train_window + 1:
+                st.error("The date range is shorter than the training window.")
+                st.stop()
+
+        with st.spinner(f"Backtesting {n_cells} combinations..."):
+            st.session_state["sweep_results"] = run_sweep(
+                prices, methods, num_clusters, lookbacks, entry_thresholds,
+                train_window=train_window, refit_every=refit_every, cache=sweep_cache(),
+            )
+
+        show_stage_timings(run_timings)
+
+# --- Results (kept across reruns so the heatmap selectors do not recompute) ---
+results = st.session_state.get("sweep_results")
+if results is not None and not results.empty:
+    st.subheader("Heatmap")
+    col1, col2, col3 = st.columns(3)
+    metric = col1.selectbox("Metric", METRICS)
+    method = col2.selectbox("Method", results["method"].unique().tolist())
+    k = col3.selectbox("Num Clusters", sorted(results["num_clusters"].unique().tolist()))
+
+    grid = sweep_heatmap(results, metric, method, k)
+    fig = px.imshow(
+        grid,
+        text_auto=".2f",
+        aspect="auto",
+        color_continuous_scale="RdYlGn_r" if metric == "Daily Turnover" else "RdYlGn",
+        labels={"x": "Entry Threshold (Z)", "y": "Z-Score Lookback", "color": metric},
+    )
+    fig.update_xaxes(type="category")
+    fig.update_yaxes(type="category")
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Best Combinations")
+    best = results.sort_values(metric, ascending=metric == "Daily Turnover").head(10)
+    st.dataframe(best, hide_index=True)
+
+    with st.expander("All Results"):
+        st.dataframe(results.sort_values(GRID_COLUMNS), hide_index=True)
+        st.download_button("Download CSV", results.to_csv(index=False), "sweep.csv", "text/csv")
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+from app.analytics.sweep import SweepCache
+from app.db.repository import BarRepository, get_repository
+from app.instrumentation import Registry, stage_rows, stop_collecting
+from app.profiling import profile_run, profiling_enabled
+
+
+@st.cache_resource
+def bar_repository() -> BarRepository:
+    """Shared by every page and session: one MongoDB connection pool per dashboard process."""
+    return get_repository()
+
+
+def show_stage_timings(run: Registry):
+    """Table of the instrumented stages (loads, panel builds, analytics) this run collected via collect_timings()."""
+    stop_collecting()
+    rows = stage_rows(run.snapshot())
+    if rows:
+        with st.expander("⏱ Stage timings"):
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
+
+
+def profile_toggle() -> bool:
+    """Sidebar switch for profiling this page's runs; defaults to the PROFILE setting."""
+    return st.sidebar.checkbox("Profile runs", value=profiling_enabled(),
+                               help="Write cProfile, flamegraph and tracemalloc reports for each run to PROFILE_DIR")
+
+
+@contextmanager
+def profiled_run(name: str, enabled: bool):
+    with profile_run(name, enabled=enabled) as report:
+        yield
+    if report is not None:
+        st.caption(f"Profile: {report.summary()}, reports in `{report.paths[0].rsplit('.', 1)[0]}.*`")
+
+
+@st.cache_resource
+def sweep_cache() -> SweepCache:
+    """Returns, correlations, clusters and metric rows shared by every parameter sweep in this process."""
+    return SweepCache()
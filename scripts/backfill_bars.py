@@ -1,71 +1,440 @@
 import asyncio
 import argparse
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 
-from app.db.mongo import db
+import numpy as np
+import pandas as pd
+from pymongo import ReplaceOne
+
+from app.db.mongo import db, settings
+from app.db.buckets import BUCKET_COLLECTION, bucket_write_ops, load_dates
+from app.db.coverage import (COVERAGE_COLLECTION, delta_from_batch, load_empty_ranges, rebuild_coverage,
+                             subtract_ranges, write_coverage, write_empty_ranges)
+from app.db.schema import BarBatch
+from app.db.versions import VERSIONS_COLLECTION, bars_version_key, bump_versions
 from app.providers.yahoo import YahooProvider
+from app.providers.synthetic import SyntheticProvider
+from app.providers.ratelimit import RateLimitedProvider, yahoo_bucket
+from app.profiling import profile_run
+
+# Longest market closure (Spring Festival / Golden Week) plus a weekend.
+# A head gap shorter than this is a holiday, not missing data.
+MAX_HOLIDAY_GAP = timedelta(days=10)
+
+# An empty answer for the last few days may just mean they are not published yet,
+# so only older parts of an empty range are recorded as confirmed empty.
+EMPTY_SETTLE = timedelta(days=3)
+
+DateRange = Tuple[datetime, datetime]
+
+
+def missing_ranges(calendar: pd.DatetimeIndex, stored: pd.DatetimeIndex, start: datetime, end: datetime,
+                   checked: Sequence[DateRange] = ()) -> List[DateRange]:
+    """
+    Work out which [start, end) ranges must be fetched for one ticker.
+    calendar: known trading days for the exchange (sorted, normalized).
+    stored: dates already held for the ticker within [start, end].
+    checked: merged ranges already fetched and confirmed empty (suspensions), which are skipped.
+    Covers the head (before the first stored bar), interior gaps against the calendar,
+    and the tail after the stored high-water mark.
+    """
+    if checked:
+        return [part for rng in missing_ranges(calendar, stored, start, end) for part in subtract_ranges(rng, checked)]
+
+    if stored.empty:
+        return [(start, end)]
+
+    one_day = timedelta(days=1)
+    first, last = stored.min().to_pydatetime(), stored.max().to_pydatetime()
+    ranges: List[DateRange] = []
+
+    # Head: nothing in the DB reaches back to the window start
+    cal_first = min(calendar.min().to_pydatetime(), first) if not calendar.empty else first
+    if cal_first - start > MAX_HOLIDAY_GAP:
+        ranges.append((start, cal_first))
+
+    # Interior (and head days other tickers have): calendar days in the window we don't hold
+    in_window = calendar[(calendar >= start) & (calendar <= last)]
+    missing = in_window.difference(stored)
+    if not missing.empty:
+        # Group consecutive calendar positions into runs
+        pos = in_window.get_indexer(missing)
+        run_ids = (pd.Series(pos).diff() != 1).cumsum().to_numpy()
+        for run in pd.Series(missing).groupby(run_ids):
+            days = run[1]
+            ranges.append((days.iloc[0].to_pydatetime(), days.iloc[-1].to_pydatetime() + one_day))
+
+    # Tail: top up after the high-water mark
+    if last + one_day < end:
+        ranges.append((last + one_day, end))
+
+    return ranges
+
+
+def plan_from_stored(calendar: pd.DatetimeIndex, stored_by_ticker: Dict[str, pd.DatetimeIndex],
+                     tickers: List[str], start: datetime, end: datetime,
+                     checked_by_ticker: Optional[Dict[str, List[DateRange]]] = None) -> Dict[DateRange, List[str]]:
+    """
+    Build fetch requests grouped by identical date range, so tickers that only need
+    the same nightly top-up share one grouped download.
+    """
+    plan: Dict[DateRange, List[str]] = defaultdict(list)
+    empty = pd.DatetimeIndex([])
+    checked_by_ticker = checked_by_ticker or {}
+    for ticker in tickers:
+        stored = stored_by_ticker.get(ticker, empty)
+        for rng in missing_ranges(calendar, stored, start, end, checked_by_ticker.get(ticker, ())):
+            plan[rng].append(ticker)
+    return plan
+
+
+async def plan_incremental(bars_coll, exchange: str, tickers: List[str], start: datetime, end: datetime,
+                           coverage_coll=None) -> Dict[DateRange, List[str]]:
+    """Incremental plan against bars_daily (one document per ticker-day)."""
+    window = {"$gte": start, "$lte": end}
+
+    # Per-ticker high-water marks in one aggregation
+    stats = await bars_coll.aggregate([
+        {"$match": {"exchange": exchange, "date": window}},
+        {"$group": {"_id": "$ticker", "min_date": {"$min": "$date"}, "max_date": {"$max": "$date"}, "count": {"$sum": 1}}},
+    ]).to_list(length=None)
+    stats = {s["_id"]: s for s in stats}
+
+    # Exchange trading calendar = every date any ticker has a bar for (index-covered distinct)
+    calendar = pd.DatetimeIndex(sorted(await bars_coll.distinct("date", {"exchange": exchange, "date": window})))
+
+    stored_by_ticker: Dict[str, pd.DatetimeIndex] = {}
+    for ticker in tickers:
+        st = stats.get(ticker)
+        if st is None:
+            continue
+        span = calendar[(calendar >= st["min_date"]) & (calendar <= st["max_date"])]
+        if st["count"] >= len(span):
+            # No interior gaps: the ticker holds every calendar day in its span
+            stored_by_ticker[ticker] = span
+        else:
+            # Only gapped tickers pay for a full date listing (covered by the ticker+date index)
+            cursor = bars_coll.find({"ticker": ticker, "date": window}, {"date": 1, "_id": 0})
+            stored_by_ticker[ticker] = pd.DatetimeIndex([d["date"] for d in await cursor.to_list(length=None)])
+
+    checked = await load_empty_ranges(coverage_coll, bars_coll.name, exchange=exchange) if coverage_coll is not None else None
+    return plan_from_stored(calendar, stored_by_ticker, tickers, start, end, checked)
+
+
+async def plan_incremental_buckets(buckets_coll, exchange: str, tickers: List[str], start: datetime, end: datetime,
+                                   coverage_coll=None) -> Dict[DateRange, List[str]]:
+    """Incremental plan against bars_yearly: the packed date arrays are cheap to read in full."""
+    stored_by_ticker = await load_dates(buckets_coll, start, end, exchange=exchange)
+    calendar = pd.DatetimeIndex([])
+    if stored_by_ticker:
+        calendar = pd.DatetimeIndex(np.unique(np.concatenate([d.values for d in stored_by_ticker.values()])))
+    checked = await load_empty_ranges(coverage_coll, buckets_coll.name, exchange=exchange) if coverage_coll is not None else None
+    return plan_from_stored(calendar, stored_by_ticker, tickers, start, end, checked)
+
+
+@dataclass
+class PipelineStats:
+    started: float = field(default_factory=time.perf_counter)
+    fetch_done: float = 0.0
+    fetch_busy: float = 0.0
+    fetch_calls: int = 0
+    fetch_errors: int = 0
+    tickers_fetched: int = 0
+    bars_fetched: int = 0
+    write_busy: float = 0.0
+    write_calls: int = 0
+    write_errors: int = 0
+    bars_written: int = 0
+    retried: Set[str] = field(default_factory=set)
+    dropped: Set[str] = field(default_factory=set)
+
+    def report(self):
+        wall = time.perf_counter() - self.started
+        fetch_wall = (self.fetch_done or time.perf_counter()) - self.started
+
+        def rate(n, secs):
+            return n / secs if secs > 0 else 0.0
+
+        print("--- Pipeline summary ---")
+        print(f"Fetch: {self.fetch_calls} calls, {self.tickers_fetched} tickers, {self.bars_fetched} bars "
+              f"in {fetch_wall:.1f}s wall / {self.fetch_busy:.1f}s worker time "
+              f"({rate(self.tickers_fetched, fetch_wall):.1f} tickers/s, {rate(self.bars_fetched, fetch_wall):.0f} bars/s), "
+              f"{self.fetch_errors} failed calls")
+        print(f"Write: {self.write_calls} bulk writes, {self.bars_written} bars in {self.write_busy:.1f}s "
+              f"({rate(self.bars_written, self.write_busy):.0f} bars/s), {self.write_errors} failed writes")
+        print(f"Total: {wall:.1f}s ({rate(self.bars_written, wall):.0f} bars/s end-to-end)")
+        print(f"Retried: {len(self.retried)} tickers, dropped: {len(self.dropped)} tickers")
+        if self.dropped:
+            print(f"Dropped tickers: {', '.join(sorted(self.dropped))}")
+
+
+async def fetch_stage(provider, work: List[Tuple[DateRange, List[str]]], queue: asyncio.Queue,
+                      executor: ThreadPoolExecutor, stats: PipelineStats, concurrency: int, max_requeues: int = 1):
+    """
+    Producer: run blocking provider fetches on the thread pool and hand results to the writer.
+    A chunk that still fails after the provider's own retries is split up and its tickers are
+    requeued individually at the back of the queue (so one bad ticker can't sink the chunk);
+    tickers that exhaust max_requeues are dropped and reported.
+    Queue items are (batches, empty) pairs: `empty` maps a ticker to the range a successful
+    one-ticker fetch returned nothing for. A ticker missing from a grouped download is not
+    taken as proof there is no data, so only one-ticker answers are recorded.
+    """
+    loop = asyncio.get_running_loop()
+    busy_lock = threading.Lock()
+    pending: asyncio.Queue = asyncio.Queue()
+    for rng, chunk in work:
+        pending.put_nowait((rng, chunk, 0))
+
+    def timed_fetch(chunk: List[str], range_start: datetime, range_end: datetime):
+        # Runs on a worker thread; time only the fetch itself, not the wait for a free worker
+        t0 = time.perf_counter()
+        try:
+            # One grouped download per chunk, kept columnar (BarBatch) until the write
+            return provider.fetch_batches_many(chunk, range_start, range_end, chunk_size=len(chunk), max_workers=1)
+        finally:
+            with busy_lock:
+                stats.fetch_busy += time.perf_counter() - t0
+
+    async def fetch_one(rng: DateRange, chunk: List[str], requeues: int):
+        stats.fetch_calls += 1
+        try:
+            batches = await loop.run_in_executor(executor, timed_fetch, chunk, *rng)
+        except Exception as e:
+            stats.fetch_errors += 1
+            if requeues < max_requeues:
+                print(f"Error fetching {chunk[0]}..{chunk[-1]}: {e} (requeued)")
+                stats.retried.update(chunk)
+                for ticker in chunk:
+                    pending.put_nowait((rng, [ticker], requeues + 1))
+            else:
+                print(f"Error fetching {chunk[0]}..{chunk[-1]}: {e} (dropped)")
+                stats.dropped.update(chunk)
+            return
+
+        stats.tickers_fetched += sum(1 for batch in batches.values() if len(batch))
+        stats.bars_fetched += sum(len(batch) for batch in batches.values())
+
+        empty: Dict[str, DateRange] = {}
+        settled = min(rng[1], datetime.utcnow() - EMPTY_SETTLE)
+        if len(chunk) == 1 and not len(batches.get(chunk[0], ())) and rng[0] < settled:
+            empty[chunk[0]] = (rng[0], settled)
+        # Blocks when the writer falls behind (bounded queue = backpressure)
+        await queue.put((batches, empty))
 
-async def backfill_bars(exchange: str, years: int):
+    async def worker():
+        while True:
+            rng, chunk, requeues = await pending.get()
+            try:
+                await fetch_one(rng, chunk, requeues)
+            finally:
+                pending.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    # join() only returns once requeued items are done too
+    await pending.join()
+    for w in workers:
+        w.cancel()
+    stats.fetch_done = time.perf_counter()
+    await queue.put(None)
+
+
+async def write_stage(coll, queue: asyncio.Queue, batch_size: int, stats: PipelineStats, storage: str = "docs",
+                      timeseries: bool = False, coverage_coll=None, versions_coll=None, exchange: str = "SSE"):
+    """
+    Consumer: coalesce bars from several tickers into large unordered bulk writes.
+    storage="docs" upserts one document per bar into bars_daily; storage="buckets" merges
+    the bars into per-ticker-year packed documents in bars_yearly (see app.db.buckets).
+    With timeseries=True (bars_daily is a time-series collection) upserts are not
+    supported, so each ticker's fetched dates are deleted and re-inserted instead.
+    After each successful write the per-ticker coverage documents are updated (including
+    ranges confirmed empty) and the tickers' data versions bumped.
+    """
+    # Batch upsert is tricky with standard update_many for upserts with different IDs,
+    # so we use bulk_write with ReplaceOne. Unordered lets the server apply ops in parallel.
+    pending: Dict[str, List[BarBatch]] = {}
+    pending_empty: Dict[str, List[DateRange]] = {}
+    n_pending = 0
+
+    async def write_bars(batch: Dict[str, BarBatch]) -> Dict[str, int]:
+        """Write merged per-ticker batches; returns the bars each ticker gained (not just rewrote)."""
+        added: Dict[str, int] = defaultdict(int)
+        if storage == "buckets":
+            # Straight from the arrays into packed buckets, no per-bar documents
+            frames = {t: (b.exchange, b.to_frame()) for t, b in batch.items()}
+            ops, added = await bucket_write_ops(coll, frames, source=next(iter(batch.values())).source)
+            if ops:
+                await coll.bulk_write(ops, ordered=False)
+        elif timeseries:
+            # Delete exactly the dates being re-inserted: a ticker's pending batches can span
+            # several disjoint ranges, and stored bars between them must survive. If the insert
+            # fails, only these dates go missing and the next incremental run refetches them.
+            deleted: Dict[str, int] = {}
+            for ticker, b in batch.items():
+                dates = b.date.astype("datetime64[us]").tolist()
+                result = await coll.delete_many({"ticker": ticker, "date": {"$in": dates}})
+                deleted[ticker] = result.deleted_count
+            await coll.insert_many([bar for b in batch.values() for bar in b.to_docs()], ordered=False)
+            for ticker, b in batch.items():
+                added[ticker] = len(b) - deleted[ticker]
+        else:
+            op_tickers = [t for t, b in batch.items() for _ in range(len(b))]
+            ops = [ReplaceOne({"_id": bar["_id"]}, bar, upsert=True) for b in batch.values() for bar in b.to_docs()]
+            result = await coll.bulk_write(ops, ordered=False)
+            for i in result.upserted_ids:
+                added[op_tickers[i]] += 1
+        return added
+
+    async def flush(parts: Dict[str, List[BarBatch]], n_bars: int, empty: Dict[str, List[DateRange]]):
+        t0 = time.perf_counter()
+        try:
+            batch = {t: BarBatch.concat(bs) for t, bs in parts.items()}
+            if batch:
+                added = await write_bars(batch)
+                stats.bars_written += n_bars
+
+                if coverage_coll is not None:
+                    deltas = {t: delta_from_batch(b, added.get(t, 0)) for t, b in batch.items()}
+                    await write_coverage(coverage_coll, coll.name, deltas)
+                if versions_coll is not None:
+                    # Invalidates cached API responses for these tickers
+                    await bump_versions(versions_coll, [bars_version_key(t, coll.name) for t in batch])
+            if coverage_coll is not None:
+                await write_empty_ranges(coverage_coll, coll.name, exchange, empty)
+        except Exception as e:
+            stats.write_errors += 1
+            print(f"Error writing batch of {n_bars} bars: {e}")
+        finally:
+            stats.write_busy += time.perf_counter() - t0
+            stats.write_calls += 1
+
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+
+        batches, empty = item
+        for ticker, batch in batches.items():
+            if len(batch):
+                pending.setdefault(ticker, []).append(batch)
+                n_pending += len(batch)
+        for ticker, rng in empty.items():
+            pending_empty.setdefault(ticker, []).append(rng)
+
+        if n_pending >= batch_size:
+            await flush(pending, n_pending, pending_empty)
+            pending, pending_empty, n_pending = {}, {}, 0
+            print(f"Written {stats.bars_written} bars so far...")
+
+    if pending or pending_empty:
+        await flush(pending, n_pending, pending_empty)
+
+
+def make_provider(name: str, universe_size: int = 2000, stats: PipelineStats = None):
+    if name == "synthetic":
+        return SyntheticProvider(n_tickers=universe_size)
+
+    def on_retry(tickers: List[str], attempt: int, error: Exception):
+        if stats is not None:
+            stats.retried.update(tickers)
+        print(f"Retrying {tickers[0]}..{tickers[-1]} (attempt {attempt}): {error}")
+
+    # Shared token bucket: concurrent backfills and the dashboard draw from one Yahoo budget
+    return RateLimitedProvider(YahooProvider(), yahoo_bucket(), retries=settings.YAHOO_RETRIES, on_retry=on_retry)
+
+
+async def backfill_bars(exchange: str, years: int, chunk_size: int = 50, incremental: bool = False,
+                        concurrency: int = 4, batch_size: int = 5000, provider_name: str = "yahoo",
+                        universe_size: int = 2000, storage: str = "docs"):
     print(f"Backfilling {years} years for {exchange}...")
     # Initialize DB connection
     await db.create_indexes()
-    
+
     # Get instruments
     inst_coll = await db.get_collection("instruments")
-    cursor = inst_coll.find({"exchange": exchange, "is_active": True})
+    cursor = inst_coll.find({"exchange": exchange, "is_active": True}, {"_id": 0, "ticker": 1})
     instruments = await cursor.to_list(length=None)
-    
+
     if not instruments:
         print("No instruments found. Run load_instruments.py first.")
         return
 
-    provider = YahooProvider()
-    bars_coll = await db.get_collection("bars_daily")
-    
-    end_date = datetime.now(timezone.utc)
+    stats = PipelineStats()
+    provider = make_provider(provider_name, universe_size, stats)
+    bars_coll = await db.get_collection(BUCKET_COLLECTION if storage == "buckets" else "bars_daily")
+    timeseries = storage == "docs" and await db.is_timeseries("bars_daily")
+    coverage_coll = await db.get_collection(COVERAGE_COLLECTION)
+    versions_coll = await db.get_collection(VERSIONS_COLLECTION)
+
+    # Stored dates are naive UTC; keep the window naive so comparisons line up
+    end_date = datetime.now(timezone.utc).replace(tzinfo=None)
     start_date = end_date - timedelta(days=years*365)
-    
+
     print(f"Processing {len(instruments)} instruments...")
-    
-    for inst in instruments:
-        ticker = inst["ticker"]
-        # optimization: check latest date in DB to avoid refetching? 
-        # For MVP we just fetch all requested range to be safe or overwrite.
-        
-        try:
-            bars = provider.fetch_bars(ticker, start_date, end_date)
-            if not bars:
-                continue
-                
-            # Batch upsert is tricky with standard update_many for upserts with different IDs
-            # Simple approach: one by one or bulk_write
-            # For MVP speed, let's use bulk_write with ReplaceOne
-            from pymongo import ReplaceOne
-            
-            ops = []
-            for bar in bars:
-                ops.append(
-                    ReplaceOne(
-                        {"_id": bar.id},
-                        bar.model_dump(by_alias=True),
-                        upsert=True
-                    )
-                )
-            
-            if ops:
-                result = await bars_coll.bulk_write(ops)
-                print(f"Upserted {len(ops)} bars for {ticker}")
-                
-        except Exception as e:
-            print(f"Error processing {ticker}: {e}")
-            
+
+    tickers = [inst["ticker"] for inst in instruments]
+    if incremental:
+        planner = plan_incremental_buckets if storage == "buckets" else plan_incremental
+        plan = await planner(bars_coll, exchange, tickers, start_date, end_date, coverage_coll)
+        n_ranges = sum(len(v) for v in plan.values())
+        print(f"Incremental plan: {n_ranges} missing ranges across {len({t for v in plan.values() for t in v})} tickers.")
+    else:
+        plan = {(start_date, end_date): tickers}
+
+    work = [
+        (rng, group[i:i + chunk_size])
+        for rng, group in plan.items()
+        for i in range(0, len(group), chunk_size)
+    ]
+
+    # fetch workers (threads) -> bounded queue -> single writer coroutine
+    stats.started = time.perf_counter()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(2, concurrency * 2))
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fetch") as executor:
+        await asyncio.gather(
+            fetch_stage(provider, work, queue, executor, stats, concurrency),
+            write_stage(bars_coll, queue, batch_size, stats, storage, timeseries, coverage_coll, versions_coll, exchange),
+        )
+
+    stats.report()
     print("Backfill complete.")
     db.close()
 
+async def rebuild_bar_coverage():
+    """Seed the coverage collection from bars_daily (for bars written before coverage tracking)."""
+    await db.create_indexes()
+    bars_coll = await db.get_collection("bars_daily")
+    coverage_coll = await db.get_collection(COVERAGE_COLLECTION)
+    n = await rebuild_coverage(bars_coll, coverage_coll, "bars_daily")
+    print(f"Rebuilt coverage for {n} tickers.")
+    db.close()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--exchange", type=str, default="SSE")
     parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--chunk-size", type=int, default=50, help="Tickers per grouped Yahoo download")
+    parser.add_argument("--incremental", action="store_true", help="Only fetch ranges missing from the DB (tail top-up and interior gaps)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel fetch workers")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Bars per unordered bulk write")
+    parser.add_argument("--provider", type=str, default="yahoo", choices=["yahoo", "synthetic"])
+    parser.add_argument("--universe-size", type=int, default=2000, help="Number of names for --provider synthetic")
+    parser.add_argument("--storage", type=str, default="docs", choices=["docs", "buckets"],
+                        help="docs: one document per bar (bars_daily); buckets: one packed document per ticker-year (bars_yearly)")
+    parser.add_argument("--rebuild-coverage", action="store_true",
+                        help="Only recompute per-ticker coverage metadata from bars_daily, then exit")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write cProfile/tracemalloc reports for this run to PROFILE_DIR (same as PROFILE=true)")
     args = parser.parse_args()
-    
-    asyncio.run(backfill_bars(args.exchange, args.years))
+
+    with profile_run("backfill_bars", enabled=args.profile or None, threads=True):
+        if args.rebuild_coverage:
+            asyncio.run(rebuild_bar_coverage())
+        else:
+            asyncio.run(backfill_bars(args.exchange, args.years, args.chunk_size, args.incremental,
+                                      args.concurrency, args.batch_size, args.provider, args.universe_size, args.storage))
@@ -1,7 +1,13 @@
 import asyncio
 import argparse
+from datetime import datetime
+from typing import Dict, List, Tuple
+from pymongo import InsertOne, UpdateOne
 from app.db.mongo import db
 from app.db.schema import Instrument
+from app.db.versions import INSTRUMENTS_VERSION_KEY, VERSIONS_COLLECTION, bump_versions
+from app.providers.synthetic import SyntheticProvider
+from app.profiling import profile_run
 
 STOCK_CONNECT_SSE_SAMPLE = [
     "600000.SH", "600009.SH", "600010.SH", "600011.SH", "600015.SH",
@@ -31,42 +37,98 @@ STOCK_CONNECT_SSE_SAMPLE = [
     "601998.SH"
 ]
 
-async def load_instruments(source: str):
+# Fields compared when diffing; updated_at only moves when one of these changes
+SYNC_FIELDS = ("exchange", "name", "is_active", "source")
+
+def diff_instruments(existing: Dict[str, dict], instruments: List[Instrument], source: str) -> Tuple[list, dict]:
+    """
+    Diff the desired instrument list against the current collection.
+    Returns bulk ops (inserts, field-level updates, and is_active=False for names of this
+    source/exchange that dropped out of the list) plus a count summary.
+    """
+    now = datetime.utcnow()
+    ops = []
+    summary = {"inserted": 0, "updated": 0, "deactivated": 0, "unchanged": 0}
+
+    desired = {inst.ticker: inst for inst in instruments}
+    for ticker, inst in desired.items():
+        current = existing.get(ticker)
+        if current is None:
+            ops.append(InsertOne(inst.model_dump()))
+            summary["inserted"] += 1
+            continue
+
+        doc = inst.model_dump()
+        changed = {f: doc[f] for f in SYNC_FIELDS if current.get(f) != doc[f]}
+        if changed:
+            changed["updated_at"] = now
+            ops.append(UpdateOne({"ticker": ticker}, {"$set": changed}))
+            summary["updated"] += 1
+        else:
+            summary["unchanged"] += 1
+
+    # Only names this source owns on the same exchange(s) are retired
+    exchanges = {inst.exchange for inst in instruments}
+    for ticker, current in existing.items():
+        if (ticker not in desired and current.get("is_active", True)
+                and current.get("source") == source and current.get("exchange") in exchanges):
+            ops.append(UpdateOne({"ticker": ticker}, {"$set": {"is_active": False, "updated_at": now}}))
+            summary["deactivated"] += 1
+
+    return ops, summary
+
+async def load_instruments(source: str, universe_size: int = 2000):
     print(f"Loading instruments from {source}...")
     await db.create_indexes()
     
     collection = await db.get_collection("instruments")
     
-    if source == "hkex_stock_connect":
-        tickers = STOCK_CONNECT_SSE_SAMPLE
+    if source == "synthetic":
+        # Offline scale-test universe; backfill with --provider synthetic --exchange SYN
+        instruments = SyntheticProvider(n_tickers=universe_size).get_instruments()
     else:
-        print("Unknown source. Using sample.")
-        tickers = ["600000.SH", "600519.SH"]
+        if source == "hkex_stock_connect":
+            tickers = STOCK_CONNECT_SSE_SAMPLE
+        else:
+            print("Unknown source. Using sample.")
+            tickers = ["600000.SH", "600519.SH"]
+        instruments = [
+            Instrument(
+                ticker=ticker,
+                exchange="SSE",
+                is_active=True,
+                source=source
+            )
+            for ticker in tickers
+        ]
+
+    # One read of the current master, one unordered bulk write of the diff
+    existing = {
+        doc["ticker"]: doc
+        for doc in await collection.find({}, {"_id": 0}).to_list(length=None)
+    }
+    ops, summary = diff_instruments(existing, instruments, source)
 
-    count = 0
-    for ticker in tickers:
-        inst = Instrument(
-            ticker=ticker,
-            exchange="SSE",
-            is_active=True,
-            source=source
-        )
+    if ops:
         try:
-            await collection.replace_one(
-                {"ticker": ticker},
-                inst.model_dump(),
-                upsert=True
-            )
-            count += 1
+            await collection.bulk_write(ops, ordered=False)
+            await bump_versions(await db.get_collection(VERSIONS_COLLECTION), [INSTRUMENTS_VERSION_KEY])
         except Exception as e:
-            print(f"Failed to upsert {ticker}: {e}")
-            
-    print(f"Loaded {count} instruments.")
+            print(f"Failed to sync instruments: {e}")
+            db.close()
+            return
+
+    print(f"Synced {len(instruments)} instruments: {summary['inserted']} inserted, "
+          f"{summary['updated']} updated, {summary['deactivated']} deactivated, {summary['unchanged']} unchanged.")
     db.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--source", type=str, default="hkex_stock_connect")
+    parser.add_argument("--universe-size", type=int, default=2000, help="Number of names for --source synthetic")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write cProfile/tracemalloc reports for this run to PROFILE_DIR (same as PROFILE=true)")
     args = parser.parse_args()
-    
-    asyncio.run(load_instruments(args.source))
+
+    with profile_run("load_instruments", enabled=args.profile or None, threads=True):
+        asyncio.run(load_instruments(args.source, args.universe_size))